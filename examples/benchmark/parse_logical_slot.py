@@ -0,0 +1,47 @@
+import timeit
+
+import click
+
+from pgsync.base import ColumnDecoders
+
+
+def wide_row(ncolumns):
+    columns = []
+    for i in range(ncolumns):
+        if i % 3 == 0:
+            columns.append(f'id_{i}[integer]:{i}')
+        elif i % 3 == 1:
+            columns.append(
+                f'"Title {i}"[character varying]:\'It\'\'s row {i} of '
+                f'{ncolumns}\''
+            )
+        else:
+            columns.append(f'description_{i}[text]:null')
+    return f'table public.book: INSERT: {" ".join(columns)}'
+
+
+@click.command()
+@click.option('--ncolumns', '-c', default=500, help='Number of columns')
+@click.option('--nsize', '-n', default=1000, help='Number of rows to parse')
+def main(ncolumns, nsize):
+
+    # the decoders of the reflected columns without a database
+    decoders = ColumnDecoders({
+        'public.book': {
+            f'id_{i}': int for i in range(0, ncolumns, 3)
+        },
+    })
+    row = wide_row(ncolumns)
+
+    elapsed = timeit.timeit(
+        lambda: decoders.parse_logical_slot(row),
+        number=nsize,
+    )
+    print(
+        f'Parsed {nsize} rows of {ncolumns} columns in {elapsed:.3f} secs '
+        f'({nsize / elapsed:,.0f} rows/sec)'
+    )
+
+
+if __name__ == '__main__':
+    main()
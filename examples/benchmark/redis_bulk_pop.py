@@ -0,0 +1,59 @@
+import json
+import timeit
+
+import click
+
+from pgsync.redisqueue import redis_engine, RedisQueue
+
+
+def loop_pop(db, key, chunk_size):
+    """The LLEN + LPOP loop RedisQueue.bulk_pop used to run."""
+    items = []
+    while db.llen(key) != 0:
+        if len(items) > chunk_size:
+            break
+        item = db.lpop(key)
+        items.append(json.loads(item))
+    return items
+
+
+@click.command()
+@click.option('--chunk-size', '-c', default=1000, help='Items per pop')
+@click.option('--nsize', '-n', default=100000, help='Number of items')
+def main(chunk_size, nsize):
+
+    queue = RedisQueue('benchmark')
+    db = redis_engine()
+    item = {
+        'xmin': 1234,
+        'new': {'id': 1},
+        'old': None,
+        'tg_op': 'INSERT',
+        'table': 'book',
+        'schema': 'public',
+    }
+
+    def drain(pop):
+        queue._delete()
+        queue.bulk_push([item] * nsize)
+
+        def _drain():
+            while pop():
+                pass
+
+        return timeit.timeit(_drain, number=1)
+
+    for name, pop in (
+        ('LLEN + LPOP loop', lambda: loop_pop(db, queue.key, chunk_size)),
+        ('MULTI LRANGE + LTRIM', lambda: queue.bulk_pop(chunk_size)),
+    ):
+        elapsed = drain(pop)
+        print(
+            f'{name}: popped {nsize} items in {elapsed:.3f} secs '
+            f'({nsize / elapsed:,.0f} items/sec)'
+        )
+    queue._delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,16 @@
 """PGSync Base class."""
 import collections
+import itertools
+import json
 import logging
 import os
 import sys
 import warnings
 
+import psycopg2
 import sqlalchemy as sa
 import sqlparse
+from psycopg2.extras import LogicalReplicationConnection
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.orm import sessionmaker
@@ -14,19 +18,40 @@ from sqlalchemy.sql import Values
 
 from .constants import (
     BUILTIN_SCHEMAS,
+    DOCUMENTS_TABLE,
     FOREIGN_KEY_VIEW,
-    LOGICAL_SLOT_PREFIX,
-    LOGICAL_SLOT_SUFFIX,
-    PLUGIN,
+    LOGICAL_SLOT_COLUMN,
+    LOGICAL_SLOT_TABLE,
+    LOGICAL_SLOT_TAIL,
+    LOGICAL_SLOT_TUPLE,
+    OUTBOX_TABLE,
     PRIMARY_KEY_VIEW,
+    ROW_TRIGGERS,
     SCHEMA,
+    SPILL_TABLE,
+    STATEMENT_TRIGGERS,
     TG_OP,
     TRIGGER_FUNC,
+    TRIGGERS,
+    UNCHANGED_TOAST_DATUM,
     UPDATE,
 )
+from .decoder import get_column_decoders, get_decoder
 from .exc import ForeignKeyError, ParseLogicalSlotError, TableNotFoundError
-from .settings import PG_SSLMODE, PG_SSLROOTCERT, QUERY_CHUNK_SIZE
-from .trigger import CREATE_TRIGGER_TEMPLATE
+from .settings import (
+    LOGICAL_DECODING_PLUGIN,
+    NOTIFY_QUEUE_THRESHOLD,
+    OUTBOX_CAPTURE,
+    PG_SSLMODE,
+    PG_SSLROOTCERT,
+    QUERY_CHUNK_SIZE,
+    STATEMENT_LEVEL_TRIGGERS,
+)
+from .trigger import (
+    create_statement_trigger_template,
+    create_trigger_template,
+    trigger_function,
+)
 from .utils import get_postgres_url
 from .view import CreateView, DropView
 
@@ -53,10 +78,16 @@ class Base(object):
             database: The database name
         """
         self.__engine = pg_engine(database, **kwargs)
+        self.__params = kwargs
         self.__schemas = None
         # models is a dict of f'{schema}.{table}'
         self.models = {}
         self.__metadata = {}
+        # column value decoders keyed by f'{schema}.{table}'
+        self.__column_decoders = {}
+        # logical decoding output plugin of the replication slot
+        self.output_plugin = LOGICAL_DECODING_PLUGIN
+        self.decoder = get_decoder(self, self.output_plugin)
 
     def connect(self):
         """Connect to database."""
@@ -140,11 +171,43 @@ class Base(object):
 
         return self.models[name]
 
+    def column_decoders(self, table, schema):
+        """
+        Get the replication value decoders of a table.
+
+        The decoders are built once from the reflected model and keyed by
+        column name. Tables that cannot be reflected have no decoders.
+
+        Args:
+            table (str): The tablename
+            schema (str): The database schema
+
+        Returns:
+            dict of column name to decoder function
+        """
+        name = f'{schema}.{table}'
+        if name not in self.__column_decoders:
+            try:
+                model = self.model(table, schema)
+            except TableNotFoundError:
+                self.__column_decoders[name] = {}
+            else:
+                self.__column_decoders[name] = get_column_decoders(model)
+        return self.__column_decoders[name]
+
     @property
     def database(self):
         """str: Get the database name."""
         return self.__engine.url.database
 
+    def replication_connection(self):
+        """Open a logical replication connection to the database."""
+        params = {
+            key: value for key, value in self.__params.items()
+            if key != 'echo'
+        }
+        return pg_replication_connection(self.database, **params)
+
     @property
     def session(self):
         connection = self.__engine.connect()
@@ -233,7 +296,7 @@ class Base(object):
     def replication_slots(
         self,
         slot_name,
-        plugin=PLUGIN,
+        plugin=None,
         slot_type='logical',
     ):
         """
@@ -241,6 +304,7 @@ class Base(object):
 
         SELECT * FROM PG_REPLICATION_SLOTS
         """
+        plugin = plugin or self.output_plugin
         statement = sa.select(['*']).select_from(
             sa.text('PG_REPLICATION_SLOTS')
         ).where(
@@ -266,7 +330,7 @@ class Base(object):
         statement = sa.select(['*']).select_from(
             sa.func.PG_CREATE_LOGICAL_REPLICATION_SLOT(
                 slot_name,
-                PLUGIN,
+                self.output_plugin,
             )
         )
         return self.query_one(statement)
@@ -289,6 +353,62 @@ class Base(object):
                 logger.exception(f'{e}')
                 raise
 
+    def _logical_slot_changes(
+        self,
+        slot_name,
+        upto_lsn=None,
+        upto_nchanges=None,
+        peek=False,
+        tables=None,
+    ):
+        """
+        Get the function returning changes for the output plugin.
+
+        pgoutput only produces binary output and the output plugin options
+        (including any table filter) are passed as trailing key/value pairs.
+        e.g:
+        PG_LOGICAL_SLOT_PEEK_BINARY_CHANGES(
+            'testdb', NULL, 1, 'proto_version', '1', 'publication_names',
+            'testdb'
+        )
+        """
+        name = 'PEEK' if peek else 'GET'
+        if self.decoder.binary:
+            name = f'{name}_BINARY'
+        options = itertools.chain(
+            *self.decoder.options(slot_name, tables=tables).items()
+        )
+        return getattr(sa.func, f'PG_LOGICAL_SLOT_{name}_CHANGES')(
+            slot_name,
+            upto_lsn,
+            upto_nchanges,
+            *options,
+        )
+
+    def _logical_slot_filters(self, txmin=None, txmax=None, tables=None):
+        """Get the filters for changes from a logical replication slot."""
+        filters = []
+        if txmin:
+            filters.append(
+                sa.cast(
+                    sa.cast(sa.column('xid'), sa.Text),
+                    sa.BigInteger,
+                ) >= txmin
+            )
+        if txmax:
+            filters.append(
+                sa.cast(
+                    sa.cast(sa.column('xid'), sa.Text),
+                    sa.BigInteger,
+                ) < txmax
+            )
+        if tables:
+            # only for output plugins that cannot filter tables themselves
+            pattern = self.decoder.data_pattern(tables)
+            if pattern:
+                filters.append(sa.column('data').op('~')(pattern))
+        return filters
+
     def logical_slot_get_changes(
         self,
         slot_name,
@@ -296,6 +416,7 @@ class Base(object):
         txmax=None,
         upto_lsn=None,
         upto_nchanges=None,
+        tables=None,
     ):
         """
         Get/Consume changes from a logical replication slot.
@@ -306,31 +427,22 @@ class Base(object):
         To get ALL changes and data in existing replication slot:
         SELECT * FROM PG_LOGICAL_SLOT_GET_CHANGES('testdb', NULL, NULL)
         """
-        filters = []
         statement = sa.select(
             [sa.column('xid'), sa.column('data')]
         )
         statement = statement.select_from(
-            sa.func.PG_LOGICAL_SLOT_GET_CHANGES(
+            self._logical_slot_changes(
                 slot_name,
-                upto_lsn,
-                upto_nchanges,
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                tables=tables,
             )
         )
-        if txmin:
-            filters.append(
-                sa.cast(
-                    sa.cast(sa.column('xid'), sa.Text),
-                    sa.BigInteger,
-                ) >= txmin
-            )
-        if txmax:
-            filters.append(
-                sa.cast(
-                    sa.cast(sa.column('xid'), sa.Text),
-                    sa.BigInteger,
-                ) < txmax
-            )
+        filters = self._logical_slot_filters(
+            txmin=txmin,
+            txmax=txmax,
+            tables=tables,
+        )
         if filters:
             statement = statement.where(sa.and_(*filters))
         if self.verbose:
@@ -344,41 +456,269 @@ class Base(object):
         txmax=None,
         upto_lsn=None,
         upto_nchanges=None,
+        tables=None,
     ):
         """
         Peek a logical replication slot without consuming changes.
 
         SELECT * FROM PG_LOGICAL_SLOT_PEEK_CHANGES('testdb', NULL, 1)
+
+        Only changes to tables are returned when given.
         """
-        filters = []
         statement = sa.select(
             [sa.column('xid'), sa.column('data')]
         ).select_from(
-            sa.func.PG_LOGICAL_SLOT_PEEK_CHANGES(
+            self._logical_slot_changes(
                 slot_name,
-                upto_lsn,
-                upto_nchanges,
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                peek=True,
+                tables=tables,
             )
         )
-        if txmin:
-            filters.append(
-                sa.cast(
-                    sa.cast(sa.column('xid'), sa.Text),
-                    sa.BigInteger,
-                ) >= txmin
-            )
-        if txmax:
-            filters.append(
-                sa.cast(
-                    sa.cast(sa.column('xid'), sa.Text),
-                    sa.BigInteger,
-                ) < txmax
-            )
+        filters = self._logical_slot_filters(
+            txmin=txmin,
+            txmax=txmax,
+            tables=tables,
+        )
         if filters:
             statement = statement.where(sa.and_(*filters))
         if self.verbose:
             compiled_query(statement, 'logical_slot_peek_changes')
-        return self.query(statement)
+        return self.query_stream(statement)
+
+    def logical_slot_count_changes(
+        self,
+        slot_name,
+        upto_lsn=None,
+        upto_nchanges=None,
+        tables=None,
+    ):
+        """
+        Consume changes from a logical replication slot.
+
+        Only the number of changes consumed is returned so the decoded
+        data is never sent back over the wire.
+        NB: tables must match the peek so both decode the same changes.
+
+        SELECT COUNT(*) FROM PG_LOGICAL_SLOT_GET_CHANGES('testdb', NULL, 1)
+        """
+        statement = sa.select([sa.func.COUNT()]).select_from(
+            self._logical_slot_changes(
+                slot_name,
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                tables=tables,
+            )
+        )
+        if self.verbose:
+            compiled_query(statement, 'logical_slot_count_changes')
+        return self.fetchone(statement)[0]
+
+    # Publications...
+    def create_publication(self, publication):
+        """Create an empty publication for the pgoutput output plugin."""
+        logger.debug(f'Creating publication: {publication}')
+        self.execute(f'CREATE PUBLICATION "{publication}"')
+
+    def add_publication_tables(self, publication, schema, tables=None):
+        """
+        Add tables to a publication.
+
+        NB: tables without a primary key need a REPLICA IDENTITY before
+        UPDATE and DELETE can be published.
+        """
+        views = sa.inspect(self.engine).get_view_names(schema)
+        _tables = []
+        for table in self.tables(schema):
+            schema, table = self._get_schema(schema, table)
+            if (tables and table not in tables) or (table in views):
+                continue
+            _tables.append(f'"{schema}"."{table}"')
+        if _tables:
+            logger.debug(f'Adding tables to publication: {_tables}')
+            self.execute(
+                f'ALTER PUBLICATION "{publication}" '
+                f'ADD TABLE {", ".join(_tables)}'
+            )
+
+    def drop_publication(self, publication):
+        """Drop a publication."""
+        logger.debug(f'Dropping publication: {publication}')
+        self.execute(f'DROP PUBLICATION IF EXISTS "{publication}"')
+
+    # Spill and outbox tables...
+    def add_document(self, schema, name, columns=None, foreign_keys=None):
+        """
+        Add a document to the documents synced from a schema.
+
+        The triggers copy the notifications they store in the spill and
+        outbox tables for each of these documents, and the trigger function
+        of a table is generated with the columns of all of them.
+
+        Args:
+            schema (str): The database schema
+            name (str): The replication slot name of the document
+            columns (dict): The indexed columns keyed by table
+            foreign_keys (dict): Additional foreign keys keyed by table
+        """
+        logger.debug(f'Adding document {name} to: {schema}.{DOCUMENTS_TABLE}')
+        self.execute(
+            f'CREATE TABLE IF NOT EXISTS "{schema}"."{DOCUMENTS_TABLE}" '
+            f'(name TEXT PRIMARY KEY, columns JSON, foreign_keys JSON)'
+        )
+        self.execute(
+            sa.text(
+                f'INSERT INTO "{schema}"."{DOCUMENTS_TABLE}" '
+                f'(name, columns, foreign_keys) '
+                f'VALUES (:name, :columns, :foreign_keys) '
+                f'ON CONFLICT (name) DO UPDATE SET '
+                f'columns = EXCLUDED.columns, '
+                f'foreign_keys = EXCLUDED.foreign_keys'
+            ),
+            {
+                'name': name,
+                'columns': json.dumps({
+                    table: sorted(values)
+                    for table, values in (columns or {}).items()
+                }),
+                'foreign_keys': json.dumps({
+                    table: sorted(values)
+                    for table, values in (foreign_keys or {}).items()
+                }),
+            },
+        )
+
+    def documents_columns(self, schema):
+        """
+        Get the columns of the tables of all the documents of a schema.
+
+        Returns:
+            The indexed columns and the additional foreign keys of every
+            document keyed by table
+        """
+        columns = collections.defaultdict(set)
+        foreign_keys = collections.defaultdict(set)
+        table = f'"{schema}"."{DOCUMENTS_TABLE}"'
+        if not self._table_exists(table):
+            return columns, foreign_keys
+        for _columns, _foreign_keys in self.fetchall(
+            f'SELECT columns, foreign_keys FROM {table}'
+        ):
+            for name, values in (_columns or {}).items():
+                columns[name] |= set(values)
+            for name, values in (_foreign_keys or {}).items():
+                foreign_keys[name] |= set(values)
+        return columns, foreign_keys
+
+    def _table_exists(self, table):
+        return self.fetchone(
+            sa.select([sa.func.TO_REGCLASS(table)])
+        )[0] is not None
+
+    def remove_document(self, schema, name):
+        """
+        Remove a document from the documents synced from a schema.
+
+        Returns:
+            The number of documents left
+        """
+        logger.debug(
+            f'Removing document {name} from: {schema}.{DOCUMENTS_TABLE}'
+        )
+        table = f'"{schema}"."{DOCUMENTS_TABLE}"'
+        if not self._table_exists(table):
+            return 0
+        self.execute(
+            sa.text(f'DELETE FROM {table} WHERE name = :name'),
+            {'name': name},
+        )
+        count = self.fetchone(f'SELECT COUNT(*) FROM {table}')[0]
+        if not count:
+            self.execute(f'DROP TABLE IF EXISTS {table}')
+        return count
+
+    def create_spill_table(self, schema):
+        """Create the unlogged table notifications are spilled to."""
+        logger.debug(f'Creating spill table: {schema}.{SPILL_TABLE}')
+        self.execute(
+            f'CREATE UNLOGGED TABLE IF NOT EXISTS "{schema}"."{SPILL_TABLE}" '
+            f'(id BIGSERIAL PRIMARY KEY, name TEXT NOT NULL, '
+            f'payload JSON NOT NULL)'
+        )
+        self.execute(
+            f'CREATE INDEX IF NOT EXISTS "{SPILL_TABLE}_name_id" '
+            f'ON "{schema}"."{SPILL_TABLE}" (name, id)'
+        )
+
+    def drop_spill_table(self, schema):
+        """Drop the spill table."""
+        logger.debug(f'Dropping spill table: {schema}.{SPILL_TABLE}')
+        self.execute(f'DROP TABLE IF EXISTS "{schema}"."{SPILL_TABLE}"')
+
+    def create_outbox_table(self, schema):
+        """Create the table the triggers append notifications to."""
+        logger.debug(f'Creating outbox table: {schema}.{OUTBOX_TABLE}')
+        self.execute(
+            f'CREATE TABLE IF NOT EXISTS "{schema}"."{OUTBOX_TABLE}" '
+            f'(id BIGSERIAL PRIMARY KEY, name TEXT NOT NULL, '
+            f'payload JSON NOT NULL)'
+        )
+        self.execute(
+            f'CREATE INDEX IF NOT EXISTS "{OUTBOX_TABLE}_name_id" '
+            f'ON "{schema}"."{OUTBOX_TABLE}" (name, id)'
+        )
+
+    def drop_outbox_table(self, schema):
+        """Drop the outbox table."""
+        logger.debug(f'Dropping outbox table: {schema}.{OUTBOX_TABLE}')
+        self.execute(f'DROP TABLE IF EXISTS "{schema}"."{OUTBOX_TABLE}"')
+
+    def pop_notifications(
+        self,
+        schema,
+        table,
+        name,
+        callback,
+        chunk_size=None,
+    ):
+        """
+        Consume the notifications of a document in the spill or outbox table.
+
+        Each batch is deleted in the same transaction the callback is called
+        in so it is only removed once it has been handled. Rows claimed by
+        another consumer are skipped so several consumers of a document can
+        share a table.
+
+        Args:
+            schema (str): The database schema
+            table (str): The spill or outbox table
+            name (str): The replication slot name of the document
+            callback: function called with each batch of notifications
+            chunk_size (int): The number of notifications in a batch
+
+        Returns:
+            The number of notifications consumed
+        """
+        chunk_size = chunk_size or QUERY_CHUNK_SIZE
+        statement = sa.text(
+            f'DELETE FROM "{schema}"."{table}" WHERE id IN ('
+            f'SELECT id FROM "{schema}"."{table}" WHERE name = :name '
+            f'ORDER BY id LIMIT :chunk_size FOR UPDATE SKIP LOCKED'
+            f') RETURNING id, payload'
+        )
+        count = 0
+        while True:
+            with self.__engine.begin() as conn:
+                rows = conn.execute(
+                    statement,
+                    {'name': name, 'chunk_size': chunk_size},
+                ).fetchall()
+                if rows:
+                    callback([payload for _, payload in sorted(rows)])
+            count += len(rows)
+            if len(rows) < chunk_size:
+                return count
 
     # Views...
     def _primary_key_view_statement(self):
@@ -510,20 +850,56 @@ class Base(object):
             logger.debug(f'Dropped view: {schema}.{view}')
 
     # Triggers...
-    def create_triggers(self, schema, tables=None):
-        """Create a database triggers."""
-        self.execute(CREATE_TRIGGER_TEMPLATE)
+    def create_triggers(
+        self,
+        schema,
+        tables=None,
+        columns=None,
+        foreign_keys=None,
+    ):
+        """
+        Create a database triggers.
+
+        Each table gets its own trigger function generated with its key
+        columns. The generic trigger function of older versions is dropped
+        along with the triggers calling it.
+
+        Args:
+            schema (str): The database schema
+            tables (set): The tables to create triggers on
+            columns (dict): The indexed columns keyed by table. UPDATEs are
+                only notified when one of these (or a key) changes. Defaults
+                to all the columns of the table.
+            foreign_keys (dict): Additional foreign keys keyed by table
+
+        With STATEMENT_LEVEL_TRIGGERS, the triggers fire once per statement
+        and notify the keys of all the changed rows in batches.
+        """
+        if STATEMENT_LEVEL_TRIGGERS:
+            triggers = STATEMENT_TRIGGERS
+        else:
+            triggers = ROW_TRIGGERS
+        self._drop_legacy_trigger_function(schema)
         views = sa.inspect(self.engine).get_view_names(schema)
         queries = []
         for table in self.tables(schema):
             schema, table = self._get_schema(schema, table)
-            if (tables and table not in tables) or (table in views):
+            if (
+                (tables and table not in tables) or
+                (table in views) or
+                (table in (DOCUMENTS_TABLE, SPILL_TABLE, OUTBOX_TABLE))
+            ):
                 continue
             logger.debug(f'Creating trigger on table: {schema}.{table}')
-            for name, for_each, tg_op in [
-                ('notify', 'ROW', ['INSERT', 'UPDATE', 'DELETE']),
-                ('truncate', 'STATEMENT', ['TRUNCATE']),
-            ]:
+            queries.append(
+                self._trigger_function(
+                    schema,
+                    table,
+                    columns=(columns or {}).get(table),
+                    foreign_keys=(foreign_keys or {}).get(table),
+                )
+            )
+            for name, for_each, tg_op, referencing in triggers:
 
                 if self.trigger_exists(f'{table}_{name}', table):
                     continue
@@ -532,14 +908,61 @@ class Base(object):
                     sa.DDL(
                         f'CREATE TRIGGER {table}_{name} '
                         f'AFTER {" OR ".join(tg_op)} ON "{schema}"."{table}" '
+                        f'{referencing}'
                         f'FOR EACH {for_each} EXECUTE PROCEDURE '
-                        f'{TRIGGER_FUNC}()',
+                        f'"{schema}"."{trigger_function(table)}"()',
                     )
                 )
 
         for query in queries:
             self.execute(query)
 
+    def _trigger_function(
+        self,
+        schema,
+        table,
+        columns=None,
+        foreign_keys=None,
+    ):
+        """Generate the trigger function of a table."""
+        model = self.model(table, schema)
+        table_columns = [
+            column.name for column in model.columns
+            if column.name not in ('xmin', 'oid')
+        ]
+        primary_keys = list(model.primary_keys or [])
+        foreign_keys = sorted(
+            set(
+                key.parent.name for key in model.original.foreign_keys
+            ) | (
+                set(foreign_keys or []) & set(table_columns)
+            )
+        )
+        if columns is None:
+            columns = table_columns
+        keys = set(primary_keys) | set(foreign_keys)
+        columns = [
+            column for column in table_columns
+            if column in keys or column in columns
+        ]
+        text_columns = [
+            column for column in columns
+            if not _has_equality(model.columns[column].type)
+        ]
+        template = create_trigger_template
+        if STATEMENT_LEVEL_TRIGGERS:
+            template = create_statement_trigger_template
+        return template(
+            schema,
+            table,
+            primary_keys,
+            foreign_keys,
+            columns,
+            text_columns=text_columns,
+            queue_threshold=NOTIFY_QUEUE_THRESHOLD,
+            outbox=OUTBOX_CAPTURE,
+        )
+
     def drop_triggers(self, schema, tables=None):
         """Drop all pgsync defined triggers in database."""
         for table in self.tables(schema):
@@ -547,19 +970,32 @@ class Base(object):
             if tables and table not in tables:
                 continue
             logger.debug(f'Dropping trigger on table: {schema}.{table}')
-            for name in ('notify', 'truncate'):
+            for name in TRIGGERS:
                 query = (
                     f'DROP TRIGGER IF EXISTS {table}_{name} ON '
                     f'"{schema}"."{table}"'
                 )
                 self.execute(query)
+            self.execute(
+                f'DROP FUNCTION IF EXISTS '
+                f'"{schema}"."{trigger_function(table)}"()'
+            )
+        self._drop_legacy_trigger_function(schema)
+
+    def _drop_legacy_trigger_function(self, schema):
+        """Drop the generic trigger function of older versions."""
+        self.execute(
+            f'DROP FUNCTION IF EXISTS "{schema}"."{TRIGGER_FUNC}"() CASCADE'
+        )
 
     def disable_triggers(self, schema):
         """Disable all pgsync defined triggers in database."""
         for table in self.tables(schema):
             schema, table = self._get_schema(schema, table)
             logger.debug(f'Disabling trigger on table: {schema}.{table}')
-            for name in ('notify', 'truncate'):
+            for name in TRIGGERS:
+                if not self.trigger_exists(f'{table}_{name}', table):
+                    continue
                 query = (
                     f'ALTER TABLE "{schema}"."{table}" '
                     f'DISABLE TRIGGER {table}_{name}'
@@ -571,7 +1007,9 @@ class Base(object):
         for table in self.tables(schema):
             schema, table = self._get_schema(schema, table)
             logger.debug(f'Enabling trigger on table: {schema}.{table}')
-            for name in ('notify', 'truncate'):
+            for name in TRIGGERS:
+                if not self.trigger_exists(f'{table}_{name}', table):
+                    continue
                 query = (
                     f'ALTER TABLE "{schema}"."{table}" '
                     f'ENABLE TRIGGER {table}_{name}'
@@ -658,6 +1096,32 @@ class Base(object):
         )
         return self.fetchone(statement)[0]
 
+    @property
+    def notification_queue_usage(self):
+        """
+        Get the fraction (0 to 1) of the notification queue in use.
+
+        Writing transactions fail to commit once the queue is full.
+
+        SELECT PG_NOTIFICATION_QUEUE_USAGE()
+        """
+        statement = sa.select(['*']).select_from(
+            sa.func.PG_NOTIFICATION_QUEUE_USAGE()
+        )
+        return self.fetchone(statement)[0]
+
+    @property
+    def current_wal_lsn(self):
+        """
+        Get the current write-ahead log location.
+
+        SELECT PG_CURRENT_WAL_LSN()
+        """
+        statement = sa.select(['*']).select_from(
+            sa.func.PG_CURRENT_WAL_LSN()
+        )
+        return self.fetchone(statement)[0]
+
     def parse_value(self, type_, value):
         """
         Parse datatypes from db.
@@ -696,10 +1160,7 @@ class Base(object):
         ):
             value = value.lstrip("'").rstrip("'")
         if type_.lower() in ('boolean',):
-            try:
-                value = bool(value)
-            except ValueError:
-                raise
+            value = value.lower() in ('t', 'true')
         if type_.lower() in (
             'double precision',
             'float4',
@@ -713,67 +1174,67 @@ class Base(object):
         return value
 
     def parse_logical_slot(self, row):
+        """
+        Parse a test_decoding row into a payload.
 
-        def _parse_logical_slot(data):
+        The row is decoded in a single pass by matching each column in
+        place rather than re-slicing the remainder of the row.
 
-            while True:
+        e.g:
+            table public.book: UPDATE: old-key: id[integer]:1 new-tuple:
+            id[integer]:2 title[text]:'It''s here'
+        """
+        match = LOGICAL_SLOT_TABLE.match(row)
+        if not match:
+            logger.exception(f'No match for row: {row}')
+            raise ParseLogicalSlotError(f'No match for row: {row}')
 
-                match = LOGICAL_SLOT_SUFFIX.search(data)
-                if not match:
-                    break
+        quoted_schema, schema, quoted_table, table, tg_op = match.groups()
+        schema = _unquote_identifier(quoted_schema, schema)
+        table = _unquote_identifier(quoted_table, table)
 
-                key = match.groupdict().get('key')
-                if key:
-                    key = key.replace('"', '')
-                value = match.groupdict().get('value')
-                type_ = match.groupdict().get('type')
+        if tg_op not in TG_OP:
+            msg = f'Unknown {tg_op} operation for row: {row}'
+            logger.exception(msg)
+            raise ParseLogicalSlotError(msg)
 
-                value = self.parse_value(type_, value)
+        payload = dict(schema=schema, tg_op=tg_op, table=table, old={}, new={})
+        decoders = self.column_decoders(table, schema)
+        # this can be an INSERT, DELETE, UPDATE or TRUNCATE operation
+        data = payload['new']
+        pos = match.end()
 
-                # set data for next iteration of the loop
-                data = f'{data[match.span()[1]:]} '
-                yield key, value
+        while True:
 
-        payload = dict(schema=None, tg_op=None, table=None, old={}, new={})
+            match = LOGICAL_SLOT_COLUMN.match(row, pos)
+            if match is None:
+                tuple_ = _parse_logical_slot_tuple(row, pos, tg_op, payload)
+                if tuple_ is None:
+                    break
+                data, pos = tuple_
+                continue
 
-        match = LOGICAL_SLOT_PREFIX.search(row)
-        if not match:
-            logger.exception(f'No match for row: {row}')
-            raise ParseLogicalSlotError(f'No match for row: {row}')
+            pos = match.end()
+            quoted_key, key, type_, quoted_value, value = match.groups()
+            key = _unquote_identifier(quoted_key, key)
 
-        payload.update(match.groupdict())
-        span = match.span()
-        # trailing space is deliberate
-        suffix = f'{row[span[1]:]} '
-
-        if 'old-key' and 'new-tuple' in suffix:
-            # this can only be an UPDATE operation
-            if payload['tg_op'] != UPDATE:
-                msg = f"Unknown {payload['tg_op']} operation for row: {row}"
-                logger.exception(msg)
-                raise ParseLogicalSlotError(msg)
-
-            i = suffix.index('old-key:')
-            if i > -1:
-                j = suffix.index('new-tuple:')
-                s = suffix[i + len('old-key:'): j]
-                for key, value in _parse_logical_slot(s):
-                    payload['old'][key] = value
-
-            i = suffix.index('new-tuple:')
-            if i > -1:
-                s = suffix[i + len('new-tuple:'):]
-                for key, value in _parse_logical_slot(s):
-                    payload['new'][key] = value
-        else:
-            # this can be an INSERT, DELETE, UPDATE or TRUNCATE operation
-            if payload['tg_op'] not in TG_OP:
-                msg = f"Unknown {payload['tg_op']} operation for row: {row}"
-                logger.exception(msg)
-                raise ParseLogicalSlotError(msg)
+            if quoted_value is not None:
+                value = quoted_value.replace("''", "'")
+            elif value == UNCHANGED_TOAST_DATUM:
+                # the value was not modified and is not available
+                continue
+            elif value == 'null':
+                data[key] = None
+                continue
+
+            decoder = decoders.get(key)
+            if decoder:
+                value = decoder(value)
+            elif quoted_value is None:
+                # fallback to the type name for tables we cannot reflect
+                value = self.parse_value(type_, value)
 
-            for key, value in _parse_logical_slot(suffix):
-                payload['new'][key] = value
+            data[key] = value
 
         return payload
 
@@ -831,6 +1292,20 @@ class Base(object):
                 for keys, row, *primary_keys in chunk:
                     yield keys, row, primary_keys
 
+    def query_stream(self, query, chunk_size=None):
+        """Yield rows from a query using a server side cursor."""
+        chunk_size = chunk_size or QUERY_CHUNK_SIZE
+        with self.__engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                query
+            )
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
     def query_count(self, query):
         with self.__engine.connect() as conn:
             query = query.original.with_only_columns(
@@ -839,9 +1314,67 @@ class Base(object):
             return conn.execute(query).scalar()
 
 
+class ColumnDecoders(object):
+    """
+    The replication value decoders of the tables without a database.
+
+    Stands in for Base in the decoding worker processes. It is pickled with
+    the column decoders built by the parent so the workers never query the
+    database.
+    """
+
+    def __init__(self, column_decoders):
+        """
+        Args:
+            column_decoders (dict): The decoders of each column by table
+                e.g {'public.book': {'id': int}}
+        """
+        self.__column_decoders = column_decoders
+
+    def column_decoders(self, table, schema):
+        return self.__column_decoders.get(f'{schema}.{table}', {})
+
+    # NB: these only use the column decoders
+    parse_value = Base.parse_value
+    parse_logical_slot = Base.parse_logical_slot
+
+
 # helper methods
 
 
+def _unquote_identifier(quoted, name):
+    """Get an identifier of a test_decoding row which may be quoted."""
+    if quoted is None:
+        return name
+    return quoted.replace('""', '"')
+
+
+def _parse_logical_slot_tuple(row, pos, tg_op, payload):
+    """
+    Parse the tuple or the tail of a test_decoding row at pos.
+
+    Returns:
+        The dict of the payload the next columns go into and the position
+        after the tuple, or None at the end of the row
+    """
+    match = LOGICAL_SLOT_TUPLE.match(row, pos)
+    if match is None:
+        # trailing whitespace, (no-tuple-data) or truncate flags
+        if LOGICAL_SLOT_TAIL.match(row, pos):
+            return None
+        msg = f'Cannot parse {row[pos:]!r} of row: {row}'
+        logger.exception(msg)
+        raise ParseLogicalSlotError(msg)
+    if match.group('tuple') != 'old-key':
+        return payload['new'], match.end()
+    # this can only be an UPDATE operation
+    if tg_op != UPDATE:
+        msg = f'Unknown {tg_op} operation for row: {row}'
+        logger.exception(msg)
+        raise ParseLogicalSlotError(msg)
+    return payload['old'], match.end()
+
+
 def subtransactions(session):
     """Context manager for executing code within a sub-transaction."""
     class ControlledExecution:
@@ -860,6 +1393,16 @@ def subtransactions(session):
     return ControlledExecution(session)
 
 
+def _has_equality(type_):
+    """Check whether Postgres has an equality operator for a column type."""
+    if isinstance(type_, sa.ARRAY):
+        return _has_equality(type_.item_type)
+    if isinstance(type_, sa.JSON):
+        return isinstance(type_, sa.dialects.postgresql.JSONB)
+    # types we could not reflect e.g point, xml
+    return not isinstance(type_, sa.types.NullType)
+
+
 def _get_primary_keys(model):
     return sorted([primary_key.key for primary_key in model.primary_key])
 
@@ -944,6 +1487,44 @@ def pg_engine(
     sslmode=None,
     sslrootcert=None,
 ):
+    connect_args = pg_connect_args(sslmode=sslmode, sslrootcert=sslrootcert)
+    url = get_postgres_url(
+        database,
+        user=user,
+        host=host,
+        password=password,
+        port=port,
+    )
+    return sa.create_engine(url, echo=echo, connect_args=connect_args)
+
+
+def pg_replication_connection(
+    database,
+    user=None,
+    host=None,
+    password=None,
+    port=None,
+    sslmode=None,
+    sslrootcert=None,
+):
+    """Open a psycopg2 logical replication connection."""
+    connect_args = pg_connect_args(sslmode=sslmode, sslrootcert=sslrootcert)
+    url = get_postgres_url(
+        database,
+        user=user,
+        host=host,
+        password=password,
+        port=port,
+    )
+    return psycopg2.connect(
+        url,
+        connection_factory=LogicalReplicationConnection,
+        **connect_args,
+    )
+
+
+def pg_connect_args(sslmode=None, sslrootcert=None):
+    """Get the SSL connection arguments for Postgres."""
     connect_args = {}
     sslmode = sslmode or PG_SSLMODE
     sslrootcert = sslrootcert or PG_SSLROOTCERT
@@ -968,15 +1549,7 @@ def pg_engine(
                 f'authority (CA) certificate(s).'
             )
         connect_args['sslrootcert'] = sslrootcert
-
-    url = get_postgres_url(
-        database,
-        user=user,
-        host=host,
-        password=password,
-        port=port,
-    )
-    return sa.create_engine(url, echo=echo, connect_args=connect_args)
+    return connect_args
 
 
 def pg_execute(engine, query, values=None, options=None):
@@ -0,0 +1,85 @@
+"""PGSync queue codecs."""
+import json
+import zlib
+
+from .settings import REDIS_CODEC
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# the version byte of each codec. Items without one are JSON objects
+TUPLE = b'\x01'
+MSGPACK = b'\x02'
+ZLIB = b'\x03'
+
+CODECS = ('json', 'tuple', 'msgpack', 'zlib')
+
+# the fields of a notification stored by position
+FIELDS = ('xmin', 'tg_op', 'schema', 'table', 'new', 'old')
+
+
+def check_codec(codec):
+    """Check that a codec exists and can be used."""
+    if codec not in CODECS:
+        raise ValueError(
+            f'Unknown codec "{codec}": expected one of {", ".join(CODECS)}'
+        )
+    if codec == 'msgpack' and msgpack is None:
+        raise RuntimeError('The msgpack codec requires msgpack')
+
+
+def _pack(item):
+    """Store the fields of a notification as a list."""
+    if len(item) == len(FIELDS) and all(field in item for field in FIELDS):
+        return [item[field] for field in FIELDS]
+    return item
+
+
+def _unpack(value):
+    if isinstance(value, list):
+        return dict(zip(FIELDS, value))
+    return value
+
+
+def encode(item, codec=None):
+    """
+    Encode a queue item.
+
+    Args:
+        item (dict): The notification or checkpoint
+        codec (str): json, tuple (a JSON list of the fields), msgpack or
+            zlib (a compressed tuple)
+
+    Returns:
+        The encoded item, prefixed with the version byte of the codec
+    """
+    codec = codec or REDIS_CODEC
+    if codec == 'json':
+        return json.dumps(item)
+    value = _pack(item)
+    if codec == 'msgpack':
+        return MSGPACK + msgpack.packb(value, use_bin_type=True)
+    data = json.dumps(value, separators=(',', ':')).encode()
+    if codec == 'tuple':
+        return TUPLE + data
+    if codec == 'zlib':
+        return ZLIB + zlib.compress(data)
+    check_codec(codec)
+
+
+def decode(data):
+    """Decode a queue item encoded with any codec."""
+    if isinstance(data, str):
+        return json.loads(data)
+    version = data[:1]
+    if version == TUPLE:
+        return _unpack(json.loads(data[1:]))
+    if version == MSGPACK:
+        if msgpack is None:
+            raise RuntimeError('Decoding this item requires msgpack')
+        return _unpack(msgpack.unpackb(data[1:], raw=False))
+    if version == ZLIB:
+        return _unpack(json.loads(zlib.decompress(data[1:])))
+    return json.loads(data)
@@ -161,16 +161,71 @@ BUILTIN_SCHEMAS = ['information_schema']
 # Primary key identifier
 META = '_meta'
 
-# Logical decoding output plugin
-PLUGIN = 'test_decoding'
+# Logical decoding output plugins
+PGOUTPUT = 'pgoutput'
+TEST_DECODING = 'test_decoding'
+WAL2JSON = 'wal2json'
+
+PLUGINS = [
+    PGOUTPUT,
+    TEST_DECODING,
+    WAL2JSON,
+]
 
 # Trigger function
 TRIGGER_FUNC = 'table_notify'
 
+# Triggers created on each table as
+# (name, for each, tg_op, referencing transition tables)
+ROW_TRIGGERS = [
+    ('notify', 'ROW', ['INSERT', 'UPDATE', 'DELETE'], ''),
+    ('truncate', 'STATEMENT', ['TRUNCATE'], ''),
+]
+STATEMENT_TRIGGERS = [
+    (
+        'insert',
+        'STATEMENT',
+        ['INSERT'],
+        'REFERENCING NEW TABLE AS new_table ',
+    ),
+    (
+        'update',
+        'STATEMENT',
+        ['UPDATE'],
+        'REFERENCING OLD TABLE AS old_table NEW TABLE AS new_table ',
+    ),
+    (
+        'delete',
+        'STATEMENT',
+        ['DELETE'],
+        'REFERENCING OLD TABLE AS old_table ',
+    ),
+    ('truncate', 'STATEMENT', ['TRUNCATE'], ''),
+]
+# names of all the triggers
+TRIGGERS = ['notify', 'insert', 'update', 'delete', 'truncate']
+
+# Table of the documents synced from a schema by replication slot name.
+# The notifications stored in the spill and outbox tables are copied for
+# each of them
+DOCUMENTS_TABLE = '_pgsync_documents'
+# Unlogged table of the notifications too big for (or spilled from) the
+# notification queue
+SPILL_TABLE = '_pgsync_spill'
+# notification key pointing to the spill table
+SPILL = 'spill'
+# Table the triggers append notifications to instead of NOTIFY
+OUTBOX_TABLE = '_pgsync_outbox'
+
 # Views
 PRIMARY_KEY_VIEW = '_pkey_view'
 FOREIGN_KEY_VIEW = '_fkey_view'
 
+# Redis queue item marking the LSN of the changes queued before it
+CHECKPOINT = 'checkpoint'
+# Redis queue item marking the LSN from which changes were dropped
+RESYNC = 'resync'
+
 # Primary key delimiter
 PRIMARY_KEY_DELIMITER = '|'
 
@@ -181,3 +236,26 @@ LOGICAL_SLOT_PREFIX = re.compile(
 LOGICAL_SLOT_SUFFIX = re.compile(
     "\s(?P<key>\"?\w+\"?)\[(?P<type>[\w\s]+)\]:(?P<value>[\w\'\"\-]+)"
 )
+
+# test_decoding row patterns matched in place at a position in the row
+# NB: identifiers and values are optionally quoted with embedded quotes
+# escaped by doubling them
+LOGICAL_SLOT_TABLE = re.compile(
+    r'\s*table\s'
+    r'(?:"(?P<quoted_schema>[^"]*(?:""[^"]*)*)"|(?P<schema>[^\s."]+))\.'
+    r'(?:"(?P<quoted_table>[^"]*(?:""[^"]*)*)"|(?P<table>[^\s:"]+)):\s'
+    r'(?P<tg_op>[A-Z]+):'
+)
+LOGICAL_SLOT_COLUMN = re.compile(
+    r'\s(?:"(?P<quoted_key>[^"]*(?:""[^"]*)*)"|(?P<key>[^\s\["]+))'
+    r'\[(?P<type>[^\[\]]*(?:\[\])*)\]:'
+    r"(?:'(?P<quoted_value>[^']*(?:''[^']*)*)'|(?P<value>\S+))"
+)
+LOGICAL_SLOT_TUPLE = re.compile(r'\s(?P<tuple>old-key|new-tuple):')
+# what can follow the columns: (no-tuple-data) or truncate flags
+LOGICAL_SLOT_TAIL = re.compile(
+    r'(?:\s\(no-tuple-data\)|\s\(no-flags\)|\srestart_seqs|\scascade)*\s*$'
+)
+
+# test_decoding value of an unmodified TOASTed column
+UNCHANGED_TOAST_DATUM = 'unchanged-toast-datum'
@@ -0,0 +1,517 @@
+"""PGSync logical decoding output plugin decoders."""
+import decimal
+import functools
+import json
+import logging
+import multiprocessing
+import re
+import struct
+from datetime import date, datetime, timedelta, timezone
+
+import sqlalchemy as sa
+
+from .constants import (
+    DELETE,
+    INSERT,
+    PGOUTPUT,
+    PLUGINS,
+    TEST_DECODING,
+    TRUNCATE,
+    UPDATE,
+    WAL2JSON,
+)
+from .exc import ParseLogicalSlotError
+
+logger = logging.getLogger(__name__)
+
+# wal2json and pgoutput actions
+ACTIONS = {
+    'D': DELETE,
+    'I': INSERT,
+    'T': TRUNCATE,
+    'U': UPDATE,
+}
+
+# Postgres text output of date and timestamp values
+DATE_PATTERN = re.compile(r'(\d{4})-(\d\d)-(\d\d)$')
+TIMESTAMP_PATTERN = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?'
+    r'(?:([+-])(\d\d)(?::?(\d\d))?(?::?(\d\d))?)?$'
+)
+
+
+def decode_boolean(value):
+    return value in ('t', 'true')
+
+
+def decode_bytea(value):
+    """Decode a bytea value in hex format."""
+    if value.startswith('\\x'):
+        return bytes.fromhex(value[2:])
+    return value
+
+
+def decode_date(value):
+    """Decode a date value, special values like infinity are left as is."""
+    match = DATE_PATTERN.match(value)
+    if not match:
+        return value
+    return date(*map(int, match.groups()))
+
+
+def decode_timestamp(value):
+    """
+    Decode a timestamp with or without time zone.
+
+    Special values like infinity are left as is.
+    """
+    match = TIMESTAMP_PATTERN.match(value)
+    if not match:
+        return value
+    (
+        year, month, day, hour, minute, second, fraction,
+        sign, tz_hours, tz_minutes, tz_seconds,
+    ) = match.groups()
+    tzinfo = None
+    if sign:
+        offset = timedelta(
+            hours=int(tz_hours),
+            minutes=int(tz_minutes or 0),
+            seconds=int(tz_seconds or 0),
+        )
+        tzinfo = timezone(-offset if sign == '-' else offset)
+    return datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour),
+        int(minute),
+        int(second),
+        int((fraction or '0').ljust(6, '0')),
+        tzinfo=tzinfo,
+    )
+
+
+def decode_array(value, decoder=None):
+    """
+    Decode a Postgres array literal into a (nested) list.
+
+    e.g: '{1,NULL,"a \\"b\\""}' -> [1, None, 'a "b"']
+    """
+    if not value.startswith('{'):
+        # e.g arrays with explicit bounds '[0:1]={1,2}'
+        return value
+
+    def _decode_array(pos):
+        items = []
+        pos += 1
+        while True:
+            char = value[pos]
+            if char == '}':
+                return items, pos + 1
+            if char == ',':
+                pos += 1
+            elif char == '{':
+                item, pos = _decode_array(pos)
+                items.append(item)
+            elif char == '"':
+                chars = []
+                pos += 1
+                while value[pos] != '"':
+                    if value[pos] == '\\':
+                        pos += 1
+                    chars.append(value[pos])
+                    pos += 1
+                pos += 1
+                item = ''.join(chars)
+                items.append(decoder(item) if decoder else item)
+            else:
+                end = pos
+                while value[end] not in ',}':
+                    end += 1
+                item = value[pos:end]
+                pos = end
+                if item == 'NULL':
+                    items.append(None)
+                else:
+                    items.append(decoder(item) if decoder else item)
+
+    return _decode_array(0)[0]
+
+
+def get_type_decoder(type_):
+    """Get the text value decoder for an SQLAlchemy column type."""
+    if isinstance(type_, sa.ARRAY):
+        item_decoder = get_type_decoder(type_.item_type)
+        return functools.partial(decode_array, decoder=item_decoder)
+    if isinstance(type_, sa.Boolean):
+        return decode_boolean
+    if isinstance(type_, sa.Integer):
+        return int
+    # Float is a Numeric so check for it first
+    if isinstance(type_, sa.Float):
+        return float
+    if isinstance(type_, sa.Numeric):
+        return decimal.Decimal
+    if isinstance(type_, sa.DateTime):
+        return decode_timestamp
+    if isinstance(type_, sa.Date):
+        return decode_date
+    if isinstance(type_, sa.JSON):
+        return json.loads
+    if isinstance(type_, sa.LargeBinary):
+        return decode_bytea
+    # strings, uuids and enums are passed through as text
+    return None
+
+
+def get_column_decoders(model):
+    """Get the text value decoders for a model keyed by column name."""
+    decoders = {}
+    for column in model.columns:
+        decoder = get_type_decoder(column.type)
+        if decoder:
+            decoders[column.name] = decoder
+    return decoders
+
+
+# text output decoders keyed by Postgres builtin type oid
+PG_TYPE_DECODERS = {
+    16: decode_boolean,
+    20: int,
+    21: int,
+    23: int,
+    26: int,
+    700: float,
+    701: float,
+}
+
+
+class TestDecodingDecoder(object):
+    """Decoder for the test_decoding output plugin."""
+
+    binary = False
+
+    def __init__(self, base):
+        self.base = base
+        self.xid = None
+
+    def options(self, slot_name, tables=None):
+        return {'include-xids': '1', 'skip-empty-xacts': '1'}
+
+    def data_pattern(self, tables):
+        """
+        Get a Postgres regular expression matching changes to tables.
+
+        test_decoding has no table filter so changes are filtered on the
+        row prefix instead e.g: table public."Book": INSERT:
+        """
+        names = '|'.join(
+            re.escape(table.replace('"', '""')) for table in sorted(tables)
+        )
+        return (
+            r'^table (?:"(?:[^"]|"")*"|[^ ."]+)\.'
+            f'(?:{names}|"(?:{names})"): '
+        )
+
+    def is_commit(self, data):
+        return data.startswith('COMMIT')
+
+    def decode(self, data):
+        """Yield the payloads of a test_decoding row."""
+        if data.startswith('BEGIN'):
+            xid = data[len('BEGIN'):].strip()
+            self.xid = int(xid) if xid.isdigit() else None
+            return
+        if data.startswith('COMMIT'):
+            return
+        payload = self.base.parse_logical_slot(data)
+        payload['xmin'] = self.xid
+        yield payload
+
+
+class Wal2JsonDecoder(object):
+    """
+    Decoder for the wal2json output plugin.
+
+    format-version 2 emits one JSON object per change with typed values.
+    e.g:
+        {
+            "action": "U",
+            "schema": "public",
+            "table": "book",
+            "columns": [{"name": "id", "type": "integer", "value": 2}],
+            "identity": [{"name": "id", "type": "integer", "value": 1}]
+        }
+    """
+
+    binary = False
+
+    def __init__(self, base=None):
+        self.base = base
+        self.xid = None
+
+    def options(self, slot_name, tables=None):
+        options = {'format-version': '2', 'include-xids': '1'}
+        if tables:
+            # tables in any schema with the separators escaped
+            options['add-tables'] = ','.join(
+                '*.' + re.sub(r'([,.\\])', r'\\\1', table)
+                for table in sorted(tables)
+            )
+        return options
+
+    def data_pattern(self, tables):
+        return None
+
+    def is_commit(self, data):
+        return data.startswith('{"action":"C"')
+
+    def decode(self, data):
+        """Yield the payloads of a wal2json message."""
+        message = json.loads(data)
+        action = message['action']
+        if action == 'B':
+            self.xid = message.get('xid')
+            return
+        if action not in ACTIONS:
+            # commit and logical decoding messages
+            return
+        schema = message['schema']
+        table = message['table']
+        decoders = {}
+        if self.base:
+            decoders = self.base.column_decoders(table, schema)
+        payload = dict(
+            schema=schema,
+            tg_op=ACTIONS[action],
+            table=table,
+            old=_decode_columns(message.get('identity', []), decoders),
+            new=_decode_columns(message.get('columns', []), decoders),
+            xmin=self.xid,
+        )
+        yield payload
+
+
+class PgOutputDecoder(object):
+    """
+    Decoder for the pgoutput output plugin (protocol version 1).
+
+    Relation messages describing the table columns and their type oids
+    precede the first change to each table, so we keep them around to
+    decode the tuple data of subsequent changes.
+    """
+
+    binary = True
+
+    def __init__(self, base=None):
+        self.base = base
+        self.xid = None
+        self.relations = {}
+
+    def options(self, slot_name, tables=None):
+        # the publication named after the slot already filters the tables
+        return {'proto_version': '1', 'publication_names': slot_name}
+
+    def data_pattern(self, tables):
+        return None
+
+    def is_commit(self, data):
+        return data[:1] == b'C'
+
+    def decode(self, data):
+        """Yield the payloads of a pgoutput message."""
+        data = bytes(data)
+        kind = data[:1]
+
+        if kind == b'B':
+            # final lsn, commit timestamp, xid
+            self.xid = struct.unpack_from('!I', data, 17)[0]
+
+        elif kind == b'R':
+            relid = struct.unpack_from('!I', data, 1)[0]
+            namespace, pos = _read_string(data, 5)
+            table, pos = _read_string(data, pos)
+            # skip the replica identity setting
+            pos += 1
+            ncolumns = struct.unpack_from('!h', data, pos)[0]
+            pos += 2
+            columns = []
+            for _ in range(ncolumns):
+                # skip the key flag
+                pos += 1
+                name, pos = _read_string(data, pos)
+                type_oid = struct.unpack_from('!I', data, pos)[0]
+                pos += 8
+                columns.append((name, type_oid))
+            self.relations[relid] = (namespace or 'pg_catalog', table, columns)
+
+        elif kind in (b'I', b'U', b'D'):
+            relid = struct.unpack_from('!I', data, 1)[0]
+            schema, table, columns = self._relation(relid)
+            decoders = {}
+            if self.base:
+                decoders = self.base.column_decoders(table, schema)
+            payload = dict(
+                schema=schema,
+                tg_op=ACTIONS[kind.decode()],
+                table=table,
+                old={},
+                new={},
+                xmin=self.xid,
+            )
+            pos = 5
+            while pos < len(data):
+                marker = data[pos:pos + 1]
+                values, pos = _read_tuple(data, pos + 1, columns, decoders)
+                # old key (K) or old tuple (O) for UPDATE and DELETE
+                payload['new' if marker == b'N' else 'old'] = values
+            yield payload
+
+        elif kind == b'T':
+            nrelations = struct.unpack_from('!i', data, 1)[0]
+            # skip the truncate options
+            for relid in struct.unpack_from(f'!{nrelations}I', data, 6):
+                schema, table, _ = self._relation(relid)
+                yield dict(
+                    schema=schema,
+                    tg_op=TRUNCATE,
+                    table=table,
+                    old={},
+                    new={},
+                    xmin=self.xid,
+                )
+
+    def _relation(self, relid):
+        try:
+            return self.relations[relid]
+        except KeyError:
+            msg = f'Unknown relation {relid} in pgoutput message'
+            logger.exception(msg)
+            raise ParseLogicalSlotError(msg)
+
+
+def _read_string(data, pos):
+    """Read a null terminated string."""
+    end = data.index(b'\x00', pos)
+    return data[pos:end].decode(), end + 1
+
+
+def _decode_columns(columns, decoders):
+    """Decode wal2json columns into a dict of column values."""
+    values = {}
+    for column in columns:
+        name = column['name']
+        value = column['value']
+        # wal2json already outputs numbers and booleans as JSON
+        if isinstance(value, str) and name in decoders:
+            value = decoders[name](value)
+        values[name] = value
+    return values
+
+
+def _read_tuple(data, pos, columns, decoders):
+    """Read pgoutput TupleData into a dict of column values."""
+    values = {}
+    ncolumns = struct.unpack_from('!h', data, pos)[0]
+    pos += 2
+    for i in range(ncolumns):
+        name, type_oid = columns[i]
+        kind = data[pos:pos + 1]
+        pos += 1
+        if kind == b'n':
+            values[name] = None
+        elif kind == b't':
+            length = struct.unpack_from('!i', data, pos)[0]
+            pos += 4
+            value = data[pos:pos + length].decode()
+            pos += length
+            decoder = decoders.get(name) or PG_TYPE_DECODERS.get(type_oid)
+            values[name] = decoder(value) if decoder else value
+        # unchanged toasted values (u) are not available
+    return values, pos
+
+
+def decode_changes(decoder, rows):
+    """
+    Decode replication slot rows into payloads in commit order.
+
+    Args:
+        decoder: The output plugin decoder
+        rows: iterable of (xid, data) tuples
+
+    Yields:
+        payload dicts with the xmin set from the row xid
+    """
+    for xid, data in rows:
+        logger.debug(f'txid: {xid}')
+        logger.debug(f'data: {data}')
+        try:
+            # BEGIN/COMMIT rows do not decode into a payload
+            payloads = list(decoder.decode(data))
+        except Exception as e:
+            logger.exception(f'Error parsing row: {e}\nRow data: {data}')
+            raise
+        for payload in payloads:
+            # BEGIN rows may have been filtered out by the server
+            payload['xmin'] = xid
+            yield payload
+
+
+# decoder of a decoding worker process
+_worker_decoder = None
+
+
+def _init_decode_worker(decoder):
+    global _worker_decoder
+    _worker_decoder = decoder
+
+
+def _decode_worker_changes(rows):
+    return list(decode_changes(_worker_decoder, rows))
+
+
+def decode_pool(decoder, processes):
+    """
+    Get a process pool decoding replication slot rows.
+
+    The workers are spawned rather than forked since the parent may be
+    running threads. The decoder is pickled to them so its base must be
+    a ColumnDecoders with the column decoders built by the parent.
+    """
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(
+        processes,
+        initializer=_init_decode_worker,
+        initargs=(decoder,),
+    )
+
+
+def decode_changes_parallel(pool, rows, processes):
+    """
+    Decode replication slot rows into payloads using a process pool.
+
+    The rows are split into one chunk per process and the decoded chunks
+    are merged back in order, so payloads are yielded in commit order.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    size = -(-len(rows) // processes)
+    chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+    for payloads in pool.map(_decode_worker_changes, chunks):
+        yield from payloads
+
+
+def get_decoder(base, plugin):
+    """Get the decoder for a logical decoding output plugin."""
+    if plugin == TEST_DECODING:
+        return TestDecodingDecoder(base)
+    if plugin == WAL2JSON:
+        return Wal2JsonDecoder(base)
+    if plugin == PGOUTPUT:
+        return PgOutputDecoder(base)
+    raise ValueError(
+        f'Invalid logical decoding output plugin "{plugin}": '
+        f'expected one of {", ".join(PLUGINS)}'
+    )
@@ -22,8 +22,10 @@ from .settings import (
     ELASTICSEARCH_CHUNK_SIZE,
     ELASTICSEARCH_CLIENT_CERT,
     ELASTICSEARCH_CLIENT_KEY,
+    ELASTICSEARCH_KEEP_ALIVE,
     ELASTICSEARCH_MAX_CHUNK_BYTES,
     ELASTICSEARCH_QUEUE_SIZE,
+    ELASTICSEARCH_SEARCH_SIZE,
     ELASTICSEARCH_SSL_SHOW_WARN,
     ELASTICSEARCH_THREAD_COUNT,
     ELASTICSEARCH_TIMEOUT,
@@ -34,6 +36,9 @@ from .utils import get_elasticsearch_url
 
 logger = logging.getLogger(__name__)
 
+# the default maximum number of clauses in a bool query
+MAX_CLAUSE_COUNT = 1024
+
 
 class ElasticHelper(object):
     """Elasticsearch Helper."""
@@ -72,14 +77,23 @@ class ElasticHelper(object):
         max_chunk_bytes=None,
         queue_size=None,
         thread_count=None,
+        done=None,
     ):
-        """Bulk index, update, delete docs to Elasticsearch."""
+        """
+        Bulk index, update, delete docs to Elasticsearch.
+
+        Args:
+            done (callable): Called with the results of up to chunk_size
+                docs at a time once Elasticsearch has accepted them
+                e.g [{'index': {'_id': '1', ...}}]
+        """
         chunk_size = chunk_size or ELASTICSEARCH_CHUNK_SIZE
         max_chunk_bytes = max_chunk_bytes or ELASTICSEARCH_MAX_CHUNK_BYTES
         thread_count = thread_count or ELASTICSEARCH_THREAD_COUNT
         queue_size = queue_size or ELASTICSEARCH_QUEUE_SIZE
 
-        for _ in parallel_bulk(
+        items = []
+        for _, item in parallel_bulk(
             self.__es,
             docs,
             index=index,
@@ -89,7 +103,14 @@ class ElasticHelper(object):
             queue_size=queue_size,
             refresh=False,
         ):
-            pass
+            if done is None:
+                continue
+            items.append(item)
+            if len(items) >= chunk_size:
+                done(items)
+                items = []
+        if items:
+            done(items)
 
     def refresh(self, indices):
         """Refresh the Elasticsearch index."""
@@ -106,9 +127,7 @@ class ElasticHelper(object):
             'uid': ['a002', 'a009']
         }
         """
-        search = Search(using=self.__es, index=index)
-        # explicitly exclude all fields since we only need the doc _id
-        search = search.source(excludes=['*'])
+        search = Search(using=self.__es)
         for key, values in fields.items():
             search = search.query(
                 Bool(
@@ -118,8 +137,110 @@ class ElasticHelper(object):
                     ]
                 )
             )
-        for hit in search.scan():
-            yield hit.meta.id
+        yield from self._scan(index, search)
+
+    def _search_keys(self, index, table, keys):
+        """
+        Search private area for docs matching any of the keys.
+
+        Looks up the keys of many rows in as few queries as possible:
+        a terms query for single column keys or a bool query of the columns
+        of each key for composite keys.
+        Only returns the _id of each matching document once.
+
+        keys = [
+            {'id': 1, 'uid': 'a002'},
+            {'id': 2, 'uid': 'a009'}
+        ]
+        """
+        if not keys:
+            return
+        columns = sorted(keys[0])
+        if len(columns) == 1:
+            key = columns[0]
+            values = [row[key] for row in keys]
+            queries = [
+                Q('terms', **{f'{META}.{table}.{key}': values}) |
+                Q('terms', **{f'{META}.{table}.{key}.keyword': values})
+            ]
+        else:
+            # each column is a term query on the field and its keyword
+            chunk_size = max(MAX_CLAUSE_COUNT // (3 * len(columns)), 1)
+            queries = [
+                Bool(
+                    should=[
+                        Bool(
+                            filter=[
+                                Q(
+                                    'term',
+                                    **{f'{META}.{table}.{key}': row[key]}
+                                ) |
+                                Q(
+                                    'term',
+                                    **{
+                                        f'{META}.{table}.{key}.keyword':
+                                        row[key]
+                                    }
+                                )
+                                for key in columns
+                            ]
+                        )
+                        for row in keys[i:i + chunk_size]
+                    ],
+                    minimum_should_match=1,
+                )
+                for i in range(0, len(keys), chunk_size)
+            ]
+        doc_ids = set([])
+        for query in queries:
+            search = Search(using=self.__es).query(Bool(filter=[query]))
+            for doc_id in self._scan(index, search):
+                if doc_id not in doc_ids:
+                    doc_ids.add(doc_id)
+                    yield doc_id
+
+    def _scan(self, index, search):
+        """
+        Get the _id of every document matching a search.
+
+        From Elasticsearch 7.12, the hits are paged with search_after in a
+        point in time instead of a scroll when the client supports it.
+        """
+        # explicitly exclude all fields since we only need the doc _id
+        search = search.source(excludes=['*'])
+        if self.version[:2] < [7, 12] or not hasattr(
+            self.__es, 'open_point_in_time'
+        ):
+            for hit in search.index(index).scan():
+                yield hit.meta.id
+            return
+
+        pit_id = self.__es.open_point_in_time(
+            index=index,
+            keep_alive=ELASTICSEARCH_KEEP_ALIVE,
+        )['id']
+        search = search.sort({'_shard_doc': 'asc'}).extra(
+            size=ELASTICSEARCH_SEARCH_SIZE,
+        )
+        try:
+            search_after = None
+            while True:
+                page = search.extra(
+                    pit={'id': pit_id, 'keep_alive': ELASTICSEARCH_KEEP_ALIVE}
+                )
+                if search_after is not None:
+                    page = page.extra(search_after=search_after)
+                response = page.execute()
+                # NB: the id of the point in time can change between pages
+                pit_id = getattr(response, 'pit_id', pit_id)
+                hits = response.hits
+                for hit in hits:
+                    yield hit.meta.id
+                if len(hits) < ELASTICSEARCH_SEARCH_SIZE:
+                    break
+                search_after = list(hits[-1].meta.sort)
+        finally:
+            self.__es.close_point_in_time(body={'id': pit_id})
 
     def search(self, index, body):
         """
@@ -39,7 +39,8 @@ def teardown(
             drop_database(sync.database)
         if drop_index:
             sync.es.teardown(sync.index)
-        if delete_redis:
+        # NB: there is no queue with OUTBOX_CAPTURE
+        if delete_redis and sync.redis is not None:
             sync.redis._delete()
         if delete_checkpoint:
             try:
@@ -187,6 +187,14 @@ class Node(object):
             ) for primary_key in self.model.primary_keys
         ]
 
+    @property
+    def indexed_columns(self):
+        """The table columns fetched for the document."""
+        return set(
+            re.split(f"({'|'.join(JSONB_OPERATORS)})", column_name)[0]
+            for column_name in self.column_names
+        )
+
     @property
     def is_root(self):
         return self.parent is None
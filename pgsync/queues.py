@@ -0,0 +1,263 @@
+"""PGSync queue backends."""
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from .codec import check_codec, decode, encode
+from .redisqueue import RedisCoalescingQueue, RedisQueue, RedisStreamQueue
+from .settings import (
+    QUEUE_BACKEND,
+    QUEUE_MAX_SIZE,
+    QUEUE_PATH,
+    REDIS_CHUNK_SIZE,
+    REDIS_COALESCE,
+    REDIS_CODEC,
+    REDIS_STREAM_PARTITIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUE_BACKENDS = ('redis', 'memory', 'sqlite')
+
+
+def get_queue(name, backend=None, primary_keys=None):
+    """
+    Get the queue of a document.
+
+    Args:
+        name (str): The name of the queue
+        backend (str): redis, memory (in-process and bounded) or
+            sqlite (on disk)
+        primary_keys (function): Get the primary key columns of a schema
+            and table for the coalescing and stream queues
+    """
+    backend = backend or QUEUE_BACKEND
+    if backend == 'redis':
+        if REDIS_COALESCE and REDIS_STREAM_PARTITIONS:
+            raise ValueError(
+                'REDIS_COALESCE cannot be used with REDIS_STREAM_PARTITIONS'
+            )
+        if REDIS_COALESCE:
+            return RedisCoalescingQueue(name, primary_keys=primary_keys)
+        if REDIS_STREAM_PARTITIONS:
+            return RedisStreamQueue(name, primary_keys=primary_keys)
+        return RedisQueue(name)
+    if backend == 'memory':
+        return MemoryQueue(name)
+    if backend == 'sqlite':
+        return SQLiteQueue(name)
+    raise ValueError(
+        f'Unknown queue backend "{backend}": '
+        f'expected one of {", ".join(QUEUE_BACKENDS)}'
+    )
+
+
+class MemoryQueue(object):
+    """
+    Bounded in-process queue.
+
+    The producer never waits on the queue. Once it holds maxsize items, the
+    changes are no longer queued but resynced from the replication slot as
+    with REDIS_HIGH_WATERMARK.
+    NB: the items are lost when the process stops.
+    """
+
+    def __init__(self, name, maxsize=None):
+        self.key = name
+        self.maxsize = QUEUE_MAX_SIZE if maxsize is None else maxsize
+        self.reliable = False
+        self.__items = collections.deque()
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+
+    def qsize(self):
+        """Return the size of the queue."""
+        with self.__lock:
+            return len(self.__items)
+
+    def empty(self):
+        """Return True if the queue is empty, False otherwise."""
+        return self.qsize() == 0
+
+    def push(self, item):
+        """Push item into the queue."""
+        self.bulk_push([item])
+
+    def bulk_push(self, items):
+        """Push multiple items onto the queue."""
+        items = list(items)
+        with self.__not_empty:
+            self.__items.extend(items)
+            self.__not_empty.notify()
+
+    def bulk_push_raw(self, items):
+        """Push multiple items serialized as JSON onto the queue."""
+        self.bulk_push(map(json.loads, items))
+
+    def pop(self, block=True, timeout=None):
+        """
+        Remove and return an item from the queue.
+
+        If optional args block is true and timeout is None (the default), block
+        if necessary until an item is available.
+        Returns None if there is no item.
+        """
+        with self.__not_empty:
+            if block:
+                self.__not_empty.wait_for(lambda: self.__items, timeout)
+            if self.__items:
+                return self.__items.popleft()
+
+    def bulk_pop(self, chunk_size=None):
+        """Remove and return up to chunk_size items from the queue."""
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        with self.__lock:
+            items = [
+                self.__items.popleft()
+                for _ in range(min(chunk_size, len(self.__items)))
+            ]
+        return items
+
+    def pop_nowait(self):
+        """Equivalent to pop(False)."""
+        return self.pop(False)
+
+    def _delete(self):
+        with self.__lock:
+            self.__items.clear()
+
+
+class SQLiteQueue(object):
+    """
+    Durable on-disk queue in a SQLite database in WAL mode.
+
+    Items are only deleted once acknowledged so the items of a batch that
+    was not synced are read again after a restart.
+    """
+
+    def __init__(self, name, path=None, codec=None):
+        path = path or QUEUE_PATH
+        self.key = name
+        self.path = os.path.join(path, f'.{name}.queue.db')
+        self.codec = codec or REDIS_CODEC
+        check_codec(self.codec)
+        self.reliable = True
+        # the last item read but not yet acknowledged
+        self._last_id = 0
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__db = sqlite3.connect(self.path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.execute(
+            'CREATE TABLE IF NOT EXISTS queue '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB NOT NULL)'
+        )
+
+    def qsize(self):
+        """Return the size of the queue."""
+        with self.__lock:
+            return self.__db.execute(
+                'SELECT COUNT(*) FROM queue WHERE id > ?', (self._last_id,)
+            ).fetchone()[0]
+
+    def empty(self):
+        """Return True if the queue is empty, False otherwise."""
+        return self.qsize() == 0
+
+    def push(self, item):
+        """Push item into the queue."""
+        self.bulk_push([item])
+
+    def bulk_push(self, items):
+        """Push multiple items onto the queue."""
+        self._insert(encode(item, self.codec) for item in items)
+
+    def bulk_push_raw(self, items):
+        """Push multiple items serialized as JSON onto the queue."""
+        if self.codec != 'json':
+            items = (encode(json.loads(item), self.codec) for item in items)
+        self._insert(items)
+
+    def _insert(self, items):
+        with self.__not_empty:
+            with self.__db:
+                self.__db.executemany(
+                    'INSERT INTO queue (data) VALUES (?)',
+                    ((item,) for item in items),
+                )
+            self.__not_empty.notify_all()
+
+    def bulk_reserve(self, chunk_size=None, timeout=None):
+        """
+        Read up to chunk_size items not read yet.
+
+        With a timeout, waits up to that long (in secs) for an item pushed
+        by this process.
+        """
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        with self.__not_empty:
+            rows = self._select(chunk_size)
+            if not rows and timeout:
+                self.__not_empty.wait(timeout)
+                rows = self._select(chunk_size)
+            if rows:
+                self._last_id = rows[-1][0]
+        return [decode(data) for _, data in rows]
+
+    def _select(self, chunk_size):
+        return self.__db.execute(
+            'SELECT id, data FROM queue WHERE id > ? ORDER BY id LIMIT ?',
+            (self._last_id, chunk_size),
+        ).fetchall()
+
+    def ack(self):
+        """Delete the items read."""
+        with self.__lock:
+            with self.__db:
+                self.__db.execute(
+                    'DELETE FROM queue WHERE id <= ?', (self._last_id,)
+                )
+
+    def requeue(self):
+        """
+        Read the items read but never acknowledged again.
+
+        Returns:
+            The number of items requeued
+        """
+        with self.__lock:
+            self._last_id = 0
+            return self.__db.execute(
+                'SELECT COUNT(*) FROM queue'
+            ).fetchone()[0]
+
+    def pop(self, block=True, timeout=None):
+        """
+        Remove and return an item from the queue.
+
+        Returns None if there is no item.
+        """
+        items = self.bulk_pop(chunk_size=1, timeout=timeout if block else 0)
+        if items:
+            return items[0]
+
+    def bulk_pop(self, chunk_size=None, timeout=None):
+        """Remove and return up to chunk_size items from the queue."""
+        items = self.bulk_reserve(chunk_size=chunk_size, timeout=timeout)
+        self.ack()
+        return items
+
+    def pop_nowait(self):
+        """Equivalent to pop(False)."""
+        return self.pop(False)
+
+    def _delete(self):
+        logger.info(f'Deleting queue: {self.path}')
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('DELETE FROM queue')
+            self._last_id = 0
@@ -1,26 +1,171 @@
 """PGSync RedisQueue."""
 import json
 import logging
+import time
+import uuid
+import zlib
 
 from redis import Redis
-from redis.exceptions import ConnectionError
+from redis.exceptions import ConnectionError, ResponseError
 
-from .settings import REDIS_CHUNK_SIZE, REDIS_SOCKET_TIMEOUT
-from .utils import get_redis_url
+from .codec import check_codec, decode, encode
+from .constants import CHECKPOINT, DELETE, INSERT, UPDATE
+from .settings import (
+    REDIS_CHUNK_SIZE,
+    REDIS_CODEC,
+    REDIS_POLL_INTERVAL,
+    REDIS_RELIABLE_QUEUE,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_STREAM_CLAIM_IDLE,
+    REDIS_STREAM_CONSUMER,
+    REDIS_STREAM_CONSUMERS,
+    REDIS_STREAM_PARTITIONS,
+)
+from .trigger import notification_payloads
+from .utils import get_redis_url, parse_lsn
 
 logger = logging.getLogger(__name__)
 
+# move up to ARGV[1] items from the head of the queue to the processing list
+RESERVE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, ARGV[1] - 1)
+if #items > 0 then
+    redis.call('RPUSH', KEYS[2], unpack(items))
+    redis.call('LTRIM', KEYS[1], #items, -1)
+end
+return items
+"""
+
+# move the processing list back to the head of the queue (in order)
+REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', KEYS[1], items[i])
+end
+redis.call('DEL', KEYS[2])
+return #items
+"""
+
+# pop up to ARGV[1] entries of a coalescing queue skipping the dropped ones
+COALESCE_POP_SCRIPT = """
+local items = {}
+while #items < tonumber(ARGV[1]) do
+    local id = redis.call('LPOP', KEYS[1])
+    if not id then
+        break
+    end
+    local item = redis.call('HGET', KEYS[2], id)
+    if item then
+        table.insert(items, item)
+        redis.call('HDEL', KEYS[2], id)
+        local row = redis.call('HGET', KEYS[4], id)
+        redis.call('HDEL', KEYS[4], id)
+        if row and redis.call('HGET', KEYS[3], row) == id then
+            redis.call('HDEL', KEYS[3], row)
+        end
+    end
+end
+return items
+"""
+
+# renew the leases of the partitions of a consumer and take the free ones
+# which belong to it or to a consumer which stopped. KEYS[i] is the lease of
+# partition i, KEYS[n + i] the heartbeat of the consumer it belongs to and
+# KEYS[2n + 1] the heartbeat of this consumer ARGV[1]. ARGV[2] is the lease
+# duration (in ms)
+ASSIGN_SCRIPT = """
+local n = (#KEYS - 1) / 2
+redis.call('SET', KEYS[#KEYS], 1, 'PX', ARGV[2])
+local partitions = {}
+for i = 1, n do
+    local owner = redis.call('GET', KEYS[i])
+    local own = KEYS[n + i] == KEYS[#KEYS]
+    local alive = redis.call('EXISTS', KEYS[n + i]) == 1
+    if owner == ARGV[1] and (own or not alive) then
+        redis.call('PEXPIRE', KEYS[i], ARGV[2])
+        table.insert(partitions, i - 1)
+    elseif owner == ARGV[1] then
+        -- hand the partition back to its consumer
+        redis.call('DEL', KEYS[i])
+    elseif not owner and (own or not alive) then
+        redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+        table.insert(partitions, i - 1)
+    end
+end
+return partitions
+"""
+
+# lock the documents KEYS for the consumer ARGV[1] for ARGV[2] ms if none of
+# them is locked by another consumer
+LOCK_SCRIPT = """
+for i = 1, #KEYS do
+    local owner = redis.call('GET', KEYS[i])
+    if owner and owner ~= ARGV[1] then
+        return 0
+    end
+end
+for i = 1, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+end
+return 1
+"""
+
+# unlock the documents KEYS locked by the consumer ARGV[1]
+UNLOCK_SCRIPT = """
+for i = 1, #KEYS do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        redis.call('DEL', KEYS[i])
+    end
+end
+return #KEYS
+"""
+
+# the pending change to a row and the change to it cancel out
+DROP = object()
+
+
+def coalesce(pending, change):
+    """
+    Coalesce a change to a row with the pending change to the same row.
+
+    - INSERT then UPDATE is an INSERT of the updated row
+    - INSERT then DELETE cancel out
+    - UPDATE then UPDATE is an UPDATE from the first old row to the last
+      new row
+
+    Returns:
+        The change replacing both, DROP when they cancel out or None when
+        they cannot be coalesced
+    """
+    if pending['tg_op'] == INSERT:
+        if change['tg_op'] == UPDATE:
+            return dict(change, tg_op=INSERT, old=pending['old'])
+        if change['tg_op'] == DELETE:
+            return DROP
+    elif pending['tg_op'] == UPDATE and change['tg_op'] == UPDATE:
+        return dict(change, old=pending['old'])
+
 
 class RedisQueue(object):
     """Simple Queue with Redis Backend."""
 
-    def __init__(self, name, namespace='queue', **kwargs):
+    def __init__(self, name, namespace='queue', codec=None, **kwargs):
         """
         The default connection parameters are:
         host = 'localhost', port = 6379, db = 0
         """
         url = get_redis_url(**kwargs)
         self.key = f'{namespace}:{name}'
+        self.codec = codec or REDIS_CODEC
+        check_codec(self.codec)
+        # whether the consumer reserves the items and acknowledges them
+        self.reliable = REDIS_RELIABLE_QUEUE
+        # the consumers reserving items and this one
+        self.consumers_key = f'{self.key}:consumers'
+        self.consumer = uuid.uuid4().hex
+        # items popped by this consumer but not yet acknowledged
+        self.processing_key = self._processing_key(self.consumer)
+        self._heartbeat_at = 0
         try:
             self.__db = Redis.from_url(
                 url,
@@ -30,6 +175,8 @@ class RedisQueue(object):
         except ConnectionError as e:
             logger.exception(f'Redis server is not running: {e}')
             raise
+        self.__reserve = self.__db.register_script(RESERVE_SCRIPT)
+        self.__requeue = self.__db.register_script(REQUEUE_SCRIPT)
 
     def qsize(self):
         """Return the approximate size of the queue."""
@@ -41,7 +188,7 @@ class RedisQueue(object):
 
     def push(self, item):
         """Push item into the queue."""
-        self.__db.rpush(self.key, json.dumps(item))
+        self.__db.rpush(self.key, encode(item, self.codec))
 
     def pop(self, block=True, timeout=None):
         """
@@ -49,29 +196,732 @@ class RedisQueue(object):
 
         If optional args block is true and timeout is None (the default), block
         if necessary until an item is available.
+        Returns None if there is no item.
         """
         if block:
             item = self.__db.blpop(self.key, timeout=timeout)
+            if item:
+                item = item[1]
         else:
             item = self.__db.lpop(self.key)
         if item:
-            item = item[1]
-        return json.loads(item)
+            return decode(item)
 
     def bulk_pop(self, chunk_size=None):
-        """Remove and return multiple items from the queue."""
+        """
+        Remove and return up to chunk_size items from the queue.
+
+        The items are read and removed in a single MULTI/EXEC round trip so
+        no other consumer can pop the same items.
+        """
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        pipeline = self.__db.pipeline(transaction=True)
+        pipeline.lrange(self.key, 0, chunk_size - 1)
+        pipeline.ltrim(self.key, chunk_size, -1)
+        items, _ = pipeline.execute()
+        return list(map(decode, items))
+
+    def bulk_reserve(self, chunk_size=None, timeout=None):
+        """
+        Move up to chunk_size items to the processing list and return them.
+
+        The items stay in the processing list of this consumer until they
+        are acknowledged and are requeued by a consumer starting after a
+        crash. NB: the processing list holds a single batch at a time.
+
+        With a timeout, waits a little while the queue is empty. There is
+        no blocking move to the processing list before Redis 6.2.
+        """
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        if time.time() >= self._heartbeat_at:
+            self._heartbeat()
+        items = self.__reserve(
+            keys=[self.key, self.processing_key],
+            args=[chunk_size],
+        )
+        if not items and timeout:
+            time.sleep(min(REDIS_POLL_INTERVAL, timeout))
+        return list(map(decode, items))
+
+    def ack(self):
+        """Acknowledge the items in the processing list."""
+        self.__db.delete(self.processing_key)
+
+    def requeue(self):
+        """
+        Move the items left in the processing lists back to the queue.
+
+        These are the items of this consumer and of the consumers which
+        stopped renewing their heartbeat for REDIS_STREAM_CLAIM_IDLE e.g
+        after a crash. The items of the running consumers are left alone.
+
+        Returns:
+            The number of items requeued
+        """
+        self._heartbeat()
+        count = 0
+        for consumer in self.__db.smembers(self.consumers_key):
+            consumer = consumer.decode()
+            if consumer != self.consumer:
+                if self.__db.exists(self._heartbeat_key(consumer)):
+                    continue
+                self.__db.srem(self.consumers_key, consumer)
+            count += self.__requeue(
+                keys=[self.key, self._processing_key(consumer)]
+            )
+        if count:
+            logger.info(f'Requeued {count} unacknowledged item(s)')
+        return count
+
+    def _processing_key(self, consumer):
+        return f'{self.key}:processing:{consumer}'
+
+    def _heartbeat_key(self, consumer):
+        return f'{self.key}:consumer:{consumer}'
+
+    def _heartbeat(self):
+        """Tell the other consumers this consumer is running."""
+        pipeline = self.__db.pipeline(transaction=True)
+        pipeline.sadd(self.consumers_key, self.consumer)
+        pipeline.set(
+            self._heartbeat_key(self.consumer),
+            1,
+            px=REDIS_STREAM_CLAIM_IDLE,
+        )
+        pipeline.execute()
+        # renewed well before the heartbeat expires
+        self._heartbeat_at = time.time() + REDIS_STREAM_CLAIM_IDLE / 3000
+
+    def bulk_push(self, items):
+        """Push multiple items onto the queue."""
+        self.__db.rpush(
+            self.key,
+            *[encode(item, self.codec) for item in items]
+        )
+
+    def bulk_push_raw(self, items):
+        """Push multiple items serialized as JSON onto the queue."""
+        if self.codec != 'json':
+            # NB: the items are decoded to encode them with the codec
+            items = [encode(json.loads(item), self.codec) for item in items]
+        self.__db.rpush(self.key, *items)
+
+    def pop_nowait(self):
+        """Equivalent to pop(False)."""
+        return self.pop(False)
+
+    def _delete(self):
+        logger.info(f'Deleting redis key: {self.key}')
+        consumers = [
+            consumer.decode()
+            for consumer in self.__db.smembers(self.consumers_key)
+        ]
+        if self.consumer not in consumers:
+            consumers.append(self.consumer)
+        self.__db.delete(
+            self.key,
+            self.consumers_key,
+            *[self._processing_key(consumer) for consumer in consumers],
+            *[self._heartbeat_key(consumer) for consumer in consumers],
+        )
+        self._heartbeat_at = 0
+
+
+class RedisStreamQueue(object):
+    """
+    Queue partitioned over Redis Streams read by a consumer group.
+
+    The changes of a row always go to the same partition and each
+    partition is only read by one of the consumers, so the changes of a row
+    are synced in order while the consumers run concurrently.
+    Items are read into the pending entries of the consumer and removed
+    once acknowledged.
+
+    A consumer holds a lease on the partitions it reads, renewed while it
+    reads them. Partition i belongs to consumer i % consumers. The
+    partitions of a consumer which stopped renewing its leases for
+    REDIS_STREAM_CLAIM_IDLE are taken over by the other consumers, which
+    claim the entries it left pending, and are handed back once it is
+    alive again.
+
+    The changes to the rows of a document can be in different partitions,
+    so the consumers lock the documents they sync. A document is synced by
+    one consumer at a time and the last one to sync it reads its latest
+    rows.
+
+    Checkpoints are pushed to every partition and are not returned to the
+    consumer. The last checkpoint read from a partition is stored in Redis
+    once acknowledged, so the changes are synced up to the oldest checkpoint
+    of all the partitions.
+    """
+
+    def __init__(
+        self,
+        name,
+        namespace='stream',
+        partitions=None,
+        consumer=None,
+        consumers=None,
+        primary_keys=None,
+        codec=None,
+        **kwargs,
+    ):
+        """
+        The default connection parameters are:
+        host = 'localhost', port = 6379, db = 0
+
+        primary_keys is a function of the schema and table returning the
+        primary key columns of a table. Without it, the changes of a row
+        are only partitioned together when they have the same keys and
+        foreign keys.
+        """
+        url = get_redis_url(**kwargs)
+        partitions = partitions or REDIS_STREAM_PARTITIONS
+        consumer = REDIS_STREAM_CONSUMER if consumer is None else consumer
+        consumers = consumers or REDIS_STREAM_CONSUMERS
+        if not 0 <= consumer < consumers:
+            raise ValueError(
+                f'Stream consumer {consumer} is not one of the {consumers} '
+                f'consumers'
+            )
+        self.key = f'{namespace}:{name}'
+        self.codec = codec or REDIS_CODEC
+        check_codec(self.codec)
+        self.reliable = True
+        self.keys = [f'{self.key}:{i}' for i in range(partitions)]
+        self.group = 'pgsync'
+        self.consumer = f'consumer-{consumer}'
+        self.consumers = consumers
+        self.primary_keys = primary_keys
+        # the last checkpoint acknowledged in each partition
+        self.checkpoints_key = f'{self.key}:checkpoints'
+        # the partitions leased by this consumer
+        self.streams = []
+        # when to renew the leases
+        self._assign_at = 0
+        # the documents locked by this consumer
+        self._locks = []
+        # entries read but not yet acknowledged
+        self._pending = []
+        # the last checkpoint read from each partition
+        self._checkpoints = {}
+        # the partitions read from their pending entries before the new ones
+        # with the id of the last entry read
+        self._backlog = {}
+        try:
+            self.__db = Redis.from_url(
+                url,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+            )
+            self.__db.ping()
+        except ConnectionError as e:
+            logger.exception(f'Redis server is not running: {e}')
+            raise
+        self.__assign = self.__db.register_script(ASSIGN_SCRIPT)
+        self.__lock = self.__db.register_script(LOCK_SCRIPT)
+        self.__unlock = self.__db.register_script(UNLOCK_SCRIPT)
+        for key in self.keys:
+            try:
+                self.__db.xgroup_create(key, self.group, id=0, mkstream=True)
+            except ResponseError as e:
+                # BUSYGROUP: the group already exists
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def partition(self, item):
+        """
+        Get the stream of the row changed by an item.
+
+        The row is identified by its primary key, so its changes go to the
+        same partition whichever foreign keys they hold.
+        """
+        row = item.get('new') or item.get('old') or {}
+        columns = sorted(row)
+        if row and self.primary_keys:
+            columns = self.primary_keys(item['schema'], item['table'])
+        key = json.dumps([
+            item.get('schema'),
+            item.get('table'),
+            [row.get(column) for column in columns],
+        ])
+        return self.keys[zlib.crc32(key.encode()) % len(self.keys)]
+
+    def qsize(self):
+        """Return the approximate size of the queue."""
+        return sum(self.__db.xlen(key) for key in self.keys)
+
+    def empty(self):
+        """Return True if the queue is empty, False otherwise."""
+        return self.qsize() == 0
+
+    def push(self, item):
+        """Push item into the queue."""
+        self.bulk_push([item])
+
+    def bulk_push(self, items):
+        """
+        Push multiple items onto the queue.
+
+        Statement level notifications are split into their rows and
+        checkpoints are pushed to every partition.
+        """
+        pipeline = self.__db.pipeline(transaction=False)
+        for item in items:
+            if CHECKPOINT in item:
+                for key in self.keys:
+                    pipeline.xadd(key, {'data': encode(item, self.codec)})
+                continue
+            for payload in notification_payloads(item):
+                pipeline.xadd(
+                    self.partition(payload),
+                    {'data': encode(payload, self.codec)},
+                )
+        pipeline.execute()
+
+    def bulk_push_raw(self, items):
+        """Push multiple items serialized as JSON onto the queue."""
+        # NB: the items are decoded to find their partition
+        self.bulk_push(map(json.loads, items))
+
+    def bulk_reserve(self, chunk_size=None, timeout=None):
+        """
+        Read up to chunk_size items into the pending entries.
+
+        Args:
+            chunk_size (int): The maximum number of items
+            timeout (int): How long (in secs) to wait for an item
+
+        Returns:
+            The items read
+        """
+        if not self._pending and time.time() >= self._assign_at:
+            self._assign()
+        if not self.streams:
+            if timeout:
+                time.sleep(timeout)
+            return []
         chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        backlog = {
+            key: self._backlog[key]
+            for key in self.streams if key in self._backlog
+        }
+        pending = bool(self._pending)
+        streams = self.__db.xreadgroup(
+            self.group,
+            self.consumer,
+            backlog or {key: '>' for key in self.streams},
+            count=chunk_size,
+            block=None if backlog or not timeout else timeout * 1000,
+        )
+        # NB: the pending entries are read once, from after the last one
+        # read, as they are only acknowledged after the batch
+        self._backlog = {}
+        count = 0
         items = []
-        while self.__db.llen(self.key) != 0:
-            if len(items) > chunk_size:
-                break
-            item = self.__db.lpop(self.key)
-            items.append(json.loads(item))
+        for key, entries in streams or []:
+            key = key.decode()
+            if backlog and entries:
+                self._backlog[key] = entries[-1][0]
+            for entry_id, fields in entries:
+                count += 1
+                self._pending.append((key, entry_id))
+                item = decode(fields[b'data'])
+                if CHECKPOINT in item:
+                    self._checkpoints[key] = item[CHECKPOINT]
+                    continue
+                items.append(item)
+        if backlog and not count:
+            return self.bulk_reserve(chunk_size=chunk_size, timeout=timeout)
+        if not items and not pending:
+            # only checkpoints were read
+            self.ack()
         return items
 
+    def bulk_pop(self, chunk_size=None):
+        """Remove and return multiple items from the queue."""
+        items = self.bulk_reserve(chunk_size=chunk_size)
+        self.ack()
+        return items
+
+    def ack(self):
+        """
+        Acknowledge and remove the pending entries read.
+
+        The partitions are now synced up to the last checkpoint read.
+        """
+        if not self._pending:
+            return
+        pipeline = self.__db.pipeline(transaction=False)
+        for key, entry_id in self._pending:
+            pipeline.xack(key, self.group, entry_id)
+            pipeline.xdel(key, entry_id)
+        if self._checkpoints:
+            pipeline.hset(self.checkpoints_key, mapping=self._checkpoints)
+        pipeline.execute()
+        self._pending = []
+        self._checkpoints = {}
+
+    def checkpoint(self):
+        """
+        Get the WAL location all the partitions are synced up to.
+
+        Returns:
+            The oldest checkpoint acknowledged in the partitions or None
+            until every partition has acknowledged one
+        """
+        values = self.__db.hmget(self.checkpoints_key, self.keys)
+        if None in values:
+            return None
+        return min((value.decode() for value in values), key=parse_lsn)
+
+    def requeue(self):
+        """
+        Re-deliver the entries read but never acknowledged.
+
+        These are the pending entries of this consumer and the entries of
+        other consumers pending in the partitions it leases e.g after a
+        crash or a change in the number of consumers.
+
+        Returns:
+            The number of entries claimed from other consumers
+        """
+        self._pending = []
+        self._checkpoints = {}
+        self._backlog = {}
+        # the entries pending in every partition leased are claimed
+        self.streams = []
+        return self._assign()
+
+    def _heartbeat_key(self, consumer):
+        return f'{self.key}:{consumer}'
+
+    def _assign(self):
+        """
+        Renew the leases of the partitions read by this consumer.
+
+        Partitions taken over are read from their pending entries first.
+
+        Returns:
+            The number of entries claimed from other consumers
+        """
+        keys = [f'{key}:lease' for key in self.keys]
+        keys.extend(
+            self._heartbeat_key(f'consumer-{i % self.consumers}')
+            for i in range(len(self.keys))
+        )
+        keys.append(self._heartbeat_key(self.consumer))
+        partitions = self.__assign(
+            keys=keys,
+            args=[self.consumer, REDIS_STREAM_CLAIM_IDLE],
+        )
+        streams = [self.keys[i] for i in partitions]
+        count = 0
+        for key in streams:
+            if key not in self.streams:
+                count += self._claim(key)
+                self._backlog[key] = '0'
+        if count:
+            logger.info(f'Claimed {count} pending item(s)')
+        self.streams = streams
+        # renewed well before the leases expire
+        self._assign_at = time.time() + REDIS_STREAM_CLAIM_IDLE / 3000
+        return count
+
+    def _claim(self, key):
+        """Claim the entries of other consumers pending in a partition."""
+        pending = self.__db.xpending(key, self.group)['pending']
+        if not pending:
+            return 0
+        entry_ids = [
+            entry['message_id'] for entry in self.__db.xpending_range(
+                key,
+                self.group,
+                min='-',
+                max='+',
+                count=pending,
+            )
+            if entry['consumer'].decode() != self.consumer
+        ]
+        if not entry_ids:
+            return 0
+        return len(
+            self.__db.xclaim(key, self.group, self.consumer, 0, entry_ids)
+        )
+
+    def lock(self, doc_ids):
+        """
+        Lock documents until they are unlocked.
+
+        Waits until none of the documents is locked by another consumer.
+        NB: the documents locked are all unlocked at once so a consumer
+        locks all the documents it syncs together.
+        """
+        keys = [f'{self.key}:lock:{doc_id}' for doc_id in doc_ids]
+        if not keys:
+            return
+        while not self.__lock(
+            keys=keys,
+            args=[self.consumer, REDIS_STREAM_CLAIM_IDLE],
+        ):
+            time.sleep(REDIS_POLL_INTERVAL)
+        self._locks.extend(keys)
+
+    def unlock(self):
+        """Unlock the documents locked by this consumer."""
+        if self._locks:
+            self.__unlock(keys=self._locks, args=[self.consumer])
+            self._locks = []
+
+    def _delete(self):
+        logger.info(f'Deleting redis key: {self.key}')
+        self.__db.delete(
+            *self.keys,
+            *[f'{key}:lease' for key in self.keys],
+            *[
+                self._heartbeat_key(f'consumer-{i}')
+                for i in range(self.consumers)
+            ],
+            self.checkpoints_key,
+        )
+
+
+class RedisCoalescingQueue(object):
+    """
+    Queue which coalesces the pending changes to the same row.
+
+    The queue is a list of entry ids with the entries in a hash and an
+    index of the last entry of each row, so a change to a row with a
+    pending change is merged into it in place.
+    """
+
+    def __init__(
+        self,
+        name,
+        namespace='coalesce',
+        primary_keys=None,
+        codec=None,
+        **kwargs,
+    ):
+        """
+        The default connection parameters are:
+        host = 'localhost', port = 6379, db = 0
+
+        primary_keys is a function of the schema and table returning the
+        primary key columns of a table. Without it, only the changes with
+        the same keys and foreign keys are coalesced and DELETEs, which
+        only have the primary keys, never are.
+        """
+        url = get_redis_url(**kwargs)
+        self.key = f'{namespace}:{name}'
+        self.entries_key = f'{self.key}:entries'
+        self.rows_key = f'{self.key}:rows'
+        self.entry_rows_key = f'{self.key}:entry_rows'
+        self.sequence_key = f'{self.key}:sequence'
+        self.primary_keys = primary_keys
+        self.codec = codec or REDIS_CODEC
+        check_codec(self.codec)
+        self.reliable = False
+        try:
+            self.__db = Redis.from_url(
+                url,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+            )
+            self.__db.ping()
+        except ConnectionError as e:
+            logger.exception(f'Redis server is not running: {e}')
+            raise
+        self.__pop = self.__db.register_script(COALESCE_POP_SCRIPT)
+
+    def row_key(self, item):
+        """
+        Get the key of the row changed by an item.
+
+        Returns None for the items which are never coalesced e.g TRUNCATE,
+        checkpoints and UPDATEs of the primary key.
+        """
+        tg_op = item.get('tg_op')
+        if tg_op not in (INSERT, UPDATE, DELETE):
+            return None
+        row = item['old'] if tg_op == DELETE else item['new']
+        if not row:
+            return None
+        columns = sorted(row)
+        if self.primary_keys:
+            columns = self.primary_keys(item['schema'], item['table'])
+        values = [row.get(column) for column in columns]
+        if tg_op == UPDATE and item['old'] and values != [
+            item['old'].get(column) for column in columns
+        ]:
+            return None
+        return json.dumps([item['schema'], item['table'], values])
+
+    def qsize(self):
+        """Return the number of pending changes."""
+        return self.__db.hlen(self.entries_key)
+
+    def empty(self):
+        """Return True if the queue is empty, False otherwise."""
+        return self.qsize() == 0
+
+    def push(self, item):
+        """Push item into the queue."""
+        self.bulk_push([item])
+
     def bulk_push(self, items):
-        """Push multiple items onto the queue."""
-        self.__db.rpush(self.key, *map(json.dumps, items))
+        """Push multiple items onto the queue coalescing them."""
+        items = [
+            payload for item in items
+            for payload in notification_payloads(item)
+        ]
+        if not items:
+            return
+        rows = [self.row_key(item) for item in items]
+
+        def _push(pipeline):
+            keys = list(set(row for row in rows if row is not None))
+            index, entries = self._read_pending(pipeline, keys)
+            sequence = pipeline.incrby(self.sequence_key, len(items))
+            appended, dropped = self._coalesce(
+                rows,
+                items,
+                index,
+                entries,
+                sequence - len(items),
+            )
+
+            pipeline.multi()
+            if entries:
+                pipeline.hset(
+                    self.entries_key,
+                    mapping={
+                        entry_id: encode(entry, self.codec)
+                        for entry_id, entry in entries.items()
+                    },
+                )
+            if index:
+                pipeline.hset(self.rows_key, mapping=index)
+                pipeline.hset(
+                    self.entry_rows_key,
+                    mapping={
+                        entry_id: row for row, entry_id in index.items()
+                    },
+                )
+            if dropped:
+                pipeline.hdel(self.entries_key, *dropped)
+                pipeline.hdel(self.entry_rows_key, *dropped)
+                dropped_rows = [
+                    row for row in keys
+                    if row not in index
+                ]
+                if dropped_rows:
+                    pipeline.hdel(self.rows_key, *dropped_rows)
+            if appended:
+                pipeline.rpush(self.key, *appended)
+
+        self.__db.transaction(
+            _push,
+            self.key,
+            self.entries_key,
+            self.rows_key,
+        )
+
+    def _read_pending(self, pipeline, keys):
+        """
+        Read the pending changes to the rows of a batch.
+
+        Returns:
+            The entry id of the pending change of each row and these
+            changes by entry id
+        """
+        index = {}
+        if keys:
+            index = {
+                key: entry_id.decode()
+                for key, entry_id in zip(
+                    keys, pipeline.hmget(self.rows_key, keys)
+                ) if entry_id is not None
+            }
+        entries = {}
+        if index:
+            entry_ids = list(index.values())
+            entries = {
+                entry_id: decode(entry)
+                for entry_id, entry in zip(
+                    entry_ids, pipeline.hmget(self.entries_key, entry_ids)
+                ) if entry is not None
+            }
+        return index, entries
+
+    def _coalesce(self, rows, items, index, entries, sequence):
+        """
+        Coalesce a batch into the pending changes.
+
+        The index and entries are updated in place and the changes which
+        cannot be coalesced are appended with the entry ids following
+        sequence.
+
+        Returns:
+            The entry ids appended and the entry ids of the pending changes
+            dropped
+        """
+        appended = []
+        dropped = set([])
+        for row, item in zip(rows, items):
+            entry_id = index.get(row)
+            if entry_id in entries:
+                change = coalesce(entries[entry_id], item)
+                if change is DROP:
+                    del entries[entry_id]
+                    del index[row]
+                    if entry_id in appended:
+                        appended.remove(entry_id)
+                    else:
+                        dropped.add(entry_id)
+                    continue
+                if change is not None:
+                    entries[entry_id] = change
+                    continue
+            sequence += 1
+            entry_id = str(sequence)
+            appended.append(entry_id)
+            entries[entry_id] = item
+            if row is not None:
+                index[row] = entry_id
+        return appended, dropped
+
+    def bulk_push_raw(self, items):
+        """Push multiple items serialized as JSON onto the queue."""
+        self.bulk_push(map(json.loads, items))
+
+    def pop(self, block=True, timeout=None):
+        """
+        Remove and return an item from the queue.
+
+        There is no blocking pop so this waits a little when blocking.
+        Returns None if there is no item.
+        """
+        items = self.bulk_pop(chunk_size=1)
+        if not items and block:
+            time.sleep(
+                min(REDIS_POLL_INTERVAL, timeout or REDIS_POLL_INTERVAL)
+            )
+            items = self.bulk_pop(chunk_size=1)
+        if items:
+            return items[0]
+
+    def bulk_pop(self, chunk_size=None):
+        """Remove and return up to chunk_size items from the queue."""
+        chunk_size = chunk_size or REDIS_CHUNK_SIZE
+        items = self.__pop(
+            keys=[
+                self.key,
+                self.entries_key,
+                self.rows_key,
+                self.entry_rows_key,
+            ],
+            args=[chunk_size],
+        )
+        return list(map(decode, items))
 
     def pop_nowait(self):
         """Equivalent to pop(False)."""
@@ -79,7 +929,13 @@ class RedisQueue(object):
 
     def _delete(self):
         logger.info(f'Deleting redis key: {self.key}')
-        self.__db.delete(self.key)
+        self.__db.delete(
+            self.key,
+            self.entries_key,
+            self.rows_key,
+            self.entry_rows_key,
+            self.sequence_key,
+        )
 
 
 def redis_engine(host=None, password=None, port=None, db=None):
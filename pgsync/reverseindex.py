@@ -0,0 +1,200 @@
+"""PGSync reverse index of the root documents."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from .settings import REVERSE_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+# the maximum number of values in a query
+MAX_VARIABLES = 500
+# how the values are stored
+ENCODING = 'json'
+
+
+def encode_value(value):
+    """
+    Encode a key value as text.
+
+    NB: values of different types never match e.g 1 and '1'.
+    """
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class ReverseIndex(object):
+    """
+    Local index of the root documents containing each row.
+
+    The private keys of each document synced are stored in a SQLite
+    database so the root documents containing a changed row are found
+    without searching Elasticsearch, and are found even before Elasticsearch
+    has refreshed.
+
+    The index is only complete once a full sync has populated it. Until then
+    the lookups are made in Elasticsearch.
+    """
+
+    def __init__(self, name, path=None):
+        path = path or REVERSE_INDEX_PATH
+        self.path = os.path.join(path, f'.{name}.index.db')
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(self.path, check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        with self.__db:
+            self.__db.execute(
+                'CREATE TABLE IF NOT EXISTS private_keys ('
+                'table_name TEXT NOT NULL, '
+                'column_name TEXT NOT NULL, '
+                'value TEXT NOT NULL, '
+                'doc_id TEXT NOT NULL, '
+                'PRIMARY KEY (table_name, column_name, value, doc_id)'
+                ') WITHOUT ROWID'
+            )
+            self.__db.execute(
+                'CREATE INDEX IF NOT EXISTS private_keys_doc_id '
+                'ON private_keys (doc_id)'
+            )
+            self.__db.execute(
+                'CREATE TABLE IF NOT EXISTS state '
+                '(key TEXT PRIMARY KEY, value TEXT)'
+            )
+            row = self.__db.execute(
+                "SELECT value FROM state WHERE key = 'encoding'"
+            ).fetchone()
+            if row is None or row[0] != ENCODING:
+                # the values stored otherwise are rebuilt by a full sync
+                self.__db.execute('DELETE FROM private_keys')
+                self.__db.execute('DELETE FROM state')
+                self._set_encoding()
+
+    @property
+    def complete(self):
+        """Whether every document has been indexed by a full sync."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT value FROM state WHERE key = 'complete'"
+            ).fetchone()
+        return row is not None and row[0] == '1'
+
+    @complete.setter
+    def complete(self, value):
+        with self.__lock:
+            with self.__db:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO state (key, value) "
+                    "VALUES ('complete', ?)",
+                    ('1' if value else '0',),
+                )
+
+    def update(self, docs):
+        """
+        Replace the private keys of documents.
+
+        Args:
+            docs (list): (doc_id, private_keys) of each document e.g
+                ('1', {'author': {'id': [1, 2]}})
+        """
+        docs = list(docs)
+        if not docs:
+            return
+        with self.__lock:
+            with self.__db:
+                self._delete(doc_id for doc_id, _ in docs)
+                self.__db.executemany(
+                    'INSERT OR IGNORE INTO private_keys '
+                    '(table_name, column_name, value, doc_id) '
+                    'VALUES (?, ?, ?, ?)',
+                    (
+                        (table, column, encode_value(value), doc_id)
+                        for doc_id, private_keys in docs
+                        for table, columns in private_keys.items()
+                        for column, values in columns.items()
+                        for value in values
+                    ),
+                )
+
+    def delete(self, doc_ids):
+        """Remove documents from the index."""
+        with self.__lock:
+            with self.__db:
+                self._delete(doc_ids)
+
+    def _delete(self, doc_ids):
+        self.__db.executemany(
+            'DELETE FROM private_keys WHERE doc_id = ?',
+            ((doc_id,) for doc_id in doc_ids),
+        )
+
+    def lookup(self, table, keys):
+        """
+        Get the root documents containing any of the rows of a table.
+
+        keys = [
+            {'id': 1, 'uid': 'a002'},
+            {'id': 2, 'uid': 'a009'}
+        ]
+        Returns the documents containing any row of the table without keys.
+        """
+        doc_ids = set([])
+        with self.__lock:
+            if not keys:
+                doc_ids.update(
+                    doc_id for doc_id, in self.__db.execute(
+                        'SELECT DISTINCT doc_id FROM private_keys '
+                        'WHERE table_name = ?',
+                        (table,),
+                    )
+                )
+                return doc_ids
+
+            columns = sorted(keys[0])
+            if len(columns) == 1:
+                column = columns[0]
+                values = [encode_value(key[column]) for key in keys]
+                for i in range(0, len(values), MAX_VARIABLES):
+                    chunk = values[i:i + MAX_VARIABLES]
+                    placeholders = ', '.join('?' * len(chunk))
+                    doc_ids.update(
+                        doc_id for doc_id, in self.__db.execute(
+                            'SELECT DISTINCT doc_id FROM private_keys '
+                            'WHERE table_name = ? AND column_name = ? '
+                            f'AND value IN ({placeholders})',
+                            [table, column] + chunk,
+                        )
+                    )
+                return doc_ids
+
+            # the documents containing every column of a composite key
+            query = ' INTERSECT '.join(
+                'SELECT doc_id FROM private_keys '
+                'WHERE table_name = ? AND column_name = ? AND value = ?'
+                for _ in columns
+            )
+            for key in keys:
+                params = []
+                for column in columns:
+                    params.extend(
+                        [table, column, encode_value(key[column])]
+                    )
+                doc_ids.update(
+                    doc_id for doc_id, in self.__db.execute(query, params)
+                )
+        return doc_ids
+
+    def _drop(self):
+        logger.info(f'Deleting reverse index: {self.path}')
+        with self.__lock:
+            with self.__db:
+                self.__db.execute('DELETE FROM private_keys')
+                self.__db.execute('DELETE FROM state')
+                self._set_encoding()
+
+    def _set_encoding(self):
+        self.__db.execute(
+            "INSERT INTO state (key, value) VALUES ('encoding', ?)",
+            (ENCODING,),
+        )
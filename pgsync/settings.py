@@ -21,6 +21,44 @@ REPLICATION_SLOT_CLEANUP_INTERVAL = env.float(
     'REPLICATION_SLOT_CLEANUP_INTERVAL',
     default=180.0,
 )
+# stream changes from the replication slot over the replication protocol
+# instead of using LISTEN/NOTIFY and Redis
+LOGICAL_SLOT_STREAMING = env.bool('LOGICAL_SLOT_STREAMING', default=False)
+# logical decoding output plugin (test_decoding, wal2json or pgoutput)
+LOGICAL_DECODING_PLUGIN = env.str(
+    'LOGICAL_DECODING_PLUGIN',
+    default='test_decoding',
+)
+# replication slot chunk size (how many changes to process at a time)
+LOGICAL_SLOT_CHUNK_SIZE = env.int('LOGICAL_SLOT_CHUNK_SIZE', default=5000)
+# number of processes decoding replication slot changes (0 to disable)
+LOGICAL_SLOT_DECODE_WORKERS = env.int(
+    'LOGICAL_SLOT_DECODE_WORKERS',
+    default=0,
+)
+# notify the keys of all the rows changed by a statement in batches instead
+# of once per row (requires Postgres 10 or later)
+STATEMENT_LEVEL_TRIGGERS = env.bool('STATEMENT_LEVEL_TRIGGERS', default=False)
+# notification queue usage (0 to 1) from which changes are spilled to a table
+# and a warning is logged
+NOTIFY_QUEUE_THRESHOLD = env.float('NOTIFY_QUEUE_THRESHOLD', default=0.5)
+# append changes to an outbox table consumed without Redis instead of using
+# LISTEN/NOTIFY
+OUTBOX_CAPTURE = env.bool('OUTBOX_CAPTURE', default=False)
+# queue the changes are buffered in: redis, memory (in-process) or sqlite
+QUEUE_BACKEND = env.str('QUEUE_BACKEND', default='redis')
+# memory queue size above which changes are no longer queued but resynced
+# from the replication slot (0 for no limit)
+QUEUE_MAX_SIZE = env.int('QUEUE_MAX_SIZE', default=100000)
+# directory of the sqlite queue files
+QUEUE_PATH = env.str('QUEUE_PATH', default='.')
+# keep a local index of the root documents containing each row to route
+# the changes to child tables without searching Elasticsearch
+# NB: local to the process so not with OUTBOX_CAPTURE or
+# REDIS_STREAM_PARTITIONS
+REVERSE_INDEX = env.bool('REVERSE_INDEX', default=False)
+# directory of the reverse index files
+REVERSE_INDEX_PATH = env.str('REVERSE_INDEX_PATH', default='.')
 
 # Elasticsearch:
 ELASTICSEARCH_SCHEME = env.str('ELASTICSEARCH_SCHEME', default='http')
@@ -42,6 +80,10 @@ ELASTICSEARCH_THREAD_COUNT = env.int('ELASTICSEARCH_THREAD_COUNT', default=4)
 # the size of the task queue between the main thread
 # (producing chunks to send) and the processing threads.
 ELASTICSEARCH_QUEUE_SIZE = env.int('ELASTICSEARCH_QUEUE_SIZE', default=4)
+# number of documents read at a time when looking up the root documents
+ELASTICSEARCH_SEARCH_SIZE = env.int('ELASTICSEARCH_SEARCH_SIZE', default=1000)
+# how long a point in time is kept between the pages of a lookup
+ELASTICSEARCH_KEEP_ALIVE = env.str('ELASTICSEARCH_KEEP_ALIVE', default='1m')
 ELASTICSEARCH_VERIFY_CERTS = env.bool(
     'ELASTICSEARCH_VERIFY_CERTS',
     default=True,
@@ -77,10 +119,43 @@ REDIS_DB = env.int('REDIS_DB', default=0)
 REDIS_AUTH = env.str('REDIS_AUTH', default=None)
 # number of items to read from Redis at a time
 REDIS_CHUNK_SIZE = env.int('REDIS_CHUNK_SIZE', default=1000)
+# serialization of the items in Redis: json, tuple (the fields of a change
+# as a list), msgpack (requires msgpack) or zlib (a compressed tuple)
+REDIS_CODEC = env.str('REDIS_CODEC', default='json')
 # redis socket connection timeout
 REDIS_SOCKET_TIMEOUT = env.int('REDIS_SOCKET_TIMEOUT', default=5)
-# redis poll interval (in secs)
+# keep the items read from Redis until they are synced to Elasticsearch
+REDIS_RELIABLE_QUEUE = env.bool('REDIS_RELIABLE_QUEUE', default=False)
+# merge the pending changes to the same row in the Redis queue
+# NB: the items are not kept until synced as with REDIS_RELIABLE_QUEUE
+REDIS_COALESCE = env.bool('REDIS_COALESCE', default=False)
+# number of Redis streams the changes are partitioned over (0 to use a list)
+REDIS_STREAM_PARTITIONS = env.int('REDIS_STREAM_PARTITIONS', default=0)
+# this consumer (0 to REDIS_STREAM_CONSUMERS - 1) of the Redis streams
+# NB: only the first consumer captures the changes
+REDIS_STREAM_CONSUMER = env.int('REDIS_STREAM_CONSUMER', default=0)
+# number of consumers sharing the Redis streams
+REDIS_STREAM_CONSUMERS = env.int('REDIS_STREAM_CONSUMERS', default=1)
+# how long (in ms) a consumer can stop renewing the leases of its partitions
+# before the other consumers take them over, or stop renewing its heartbeat
+# before they requeue the items it reserved from the reliable queue
+REDIS_STREAM_CLAIM_IDLE = env.int('REDIS_STREAM_CLAIM_IDLE', default=60000)
+# redis poll interval (in secs) while the reliable queue is empty
 REDIS_POLL_INTERVAL = env.float('REDIS_POLL_INTERVAL', default=0.01)
+# queue size above which changes are no longer queued but resynced from the
+# replication slot once the queue is drained to REDIS_LOW_WATERMARK
+# (0 to never drop changes)
+REDIS_HIGH_WATERMARK = env.int('REDIS_HIGH_WATERMARK', default=0)
+REDIS_LOW_WATERMARK = env.int('REDIS_LOW_WATERMARK', default=0)
+# how long (in secs) a blocking read waits for an item from Redis
+# NB: must be shorter than REDIS_SOCKET_TIMEOUT
+REDIS_BLOCK_TIMEOUT = env.int('REDIS_BLOCK_TIMEOUT', default=1)
+# how long (in secs) to wait for more items before reading a partial batch
+REDIS_LINGER = env.float('REDIS_LINGER', default=0.0)
+# number of notifications buffered before they are written to Redis
+REDIS_WRITE_CHUNK_SIZE = env.int('REDIS_WRITE_CHUNK_SIZE', default=500)
+# maximum time (in secs) notifications are buffered before they are written
+REDIS_WRITE_INTERVAL = env.float('REDIS_WRITE_INTERVAL', default=0.1)
 
 
 # Logging:
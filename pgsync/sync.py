@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 """Main module."""
+import asyncio
 import collections
 import itertools
 import json
@@ -10,7 +11,9 @@ import pprint
 import re
 import select
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import click
@@ -18,30 +21,65 @@ import psycopg2
 import sqlalchemy as sa
 
 from . import __version__
-from .base import Base, compiled_query
+from .base import Base, ColumnDecoders, compiled_query
 from .constants import (
+    CHECKPOINT,
     DELETE,
     INSERT,
     META,
+    OUTBOX_TABLE,
+    PGOUTPUT,
     PRIMARY_KEY_DELIMITER,
+    RESYNC,
     SCHEMA,
+    SPILL_TABLE,
     TG_OP,
     TRUNCATE,
     UPDATE,
 )
+from .decoder import (
+    decode_changes,
+    decode_changes_parallel,
+    decode_pool,
+    get_decoder,
+)
 from .elastichelper import ElasticHelper
 from .exc import RDSError, SuperUserError
 from .node import traverse_breadth_first, traverse_post_order, Tree
 from .plugin import Plugins
 from .querybuilder import QueryBuilder
-from .redisqueue import RedisQueue
+from .queues import get_queue, MemoryQueue
+from .redisqueue import RedisStreamQueue
+from .reverseindex import ReverseIndex
 from .settings import (
+    LOGICAL_SLOT_CHUNK_SIZE,
+    LOGICAL_SLOT_DECODE_WORKERS,
+    LOGICAL_SLOT_STREAMING,
+    NOTIFY_QUEUE_THRESHOLD,
+    OUTBOX_CAPTURE,
     POLL_TIMEOUT,
-    REDIS_POLL_INTERVAL,
+    REDIS_BLOCK_TIMEOUT,
+    REDIS_CHUNK_SIZE,
+    REDIS_HIGH_WATERMARK,
+    REDIS_LINGER,
+    REDIS_LOW_WATERMARK,
+    REDIS_STREAM_CONSUMER,
+    REDIS_WRITE_CHUNK_SIZE,
+    REDIS_WRITE_INTERVAL,
     REPLICATION_SLOT_CLEANUP_INTERVAL,
+    REVERSE_INDEX,
 )
 from .transform import get_private_keys, transform
-from .utils import get_config, progress, show_settings, threaded, Timer
+from .trigger import notification_payloads, spill_schema
+from .utils import (
+    format_lsn,
+    get_config,
+    parse_lsn,
+    progress,
+    show_settings,
+    threaded,
+    Timer,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -69,11 +107,45 @@ class Sync(Base):
             '[^0-9a-zA-Z_]+', '', f"{self.database}_{self.index}"
         )
         self._checkpoint = None
+        # the checkpoint is set by the producer and the consumer
+        self._checkpoint_lock = threading.Lock()
         self._plugins = None
+        self._tables = None
         self._truncate = False
         self.verbose = verbose
         self._checkpoint_file = f".{self.__name}"
-        self.redis = RedisQueue(self.__name)
+        # raw notifications (and checkpoints) not yet pushed to Redis
+        self._notify_buffer = []
+        self._notify_deadline = None
+        # the WAL location before the last poll of the notifications
+        self._notify_lsn = None
+        # the last checkpoint queued with the notifications
+        self._notify_checkpoint = None
+        # the WAL location from which changes are dropped under backpressure
+        self._resync_lsn = None
+        # the replication slot is read by one thread at a time
+        self._slot_lock = threading.Lock()
+        # the notifications are read and pushed off the event loop, in order
+        self._producer_executor = ThreadPoolExecutor(max_workers=1)
+        # Redis is read in a thread of its own so the blocking pops of the
+        # documents received in one process do not starve each other
+        self._consumer_executor = ThreadPoolExecutor(max_workers=1)
+        if OUTBOX_CAPTURE:
+            # the outbox tables are consumed without Redis
+            self.redis = None
+        else:
+            # NB: named redis as it was the only queue backend
+            self.redis = get_queue(
+                self.__name, primary_keys=self._primary_keys
+            )
+        self.reverse_index = None
+        if REVERSE_INDEX:
+            self.reverse_index = ReverseIndex(self.__name)
+        # the private keys of the documents rendered and not yet written
+        # to Elasticsearch by document id
+        self._private_keys = {}
+        # the items read from the queue are acknowledged once synced
+        self._reliable = self.redis is not None and self.redis.reliable
         self.tree = Tree(self)
         self._last_truncate_timestamp = datetime.now()
         if validate:
@@ -125,6 +197,8 @@ class Sync(Base):
                     f'Ensure usesuper or userepl is True in pg_user'
                 )
 
+        self._validate_modes()
+
         if self.index is None:
             raise ValueError('Index is missing for document')
 
@@ -133,6 +207,35 @@ class Sync(Base):
         for node in traverse_breadth_first(root):
             pass
 
+    def _validate_modes(self):
+        """Check the capture, queue and index modes can be used together."""
+        if OUTBOX_CAPTURE and LOGICAL_SLOT_STREAMING:
+            raise RuntimeError(
+                'OUTBOX_CAPTURE cannot be used with LOGICAL_SLOT_STREAMING'
+            )
+
+        # NB: the reverse index is local to the process so every change of
+        # the document has to go through it
+        if REVERSE_INDEX and (
+            OUTBOX_CAPTURE or isinstance(self.redis, RedisStreamQueue)
+        ):
+            raise RuntimeError(
+                'REVERSE_INDEX cannot be used with OUTBOX_CAPTURE or '
+                'REDIS_STREAM_PARTITIONS'
+            )
+
+        if REDIS_HIGH_WATERMARK:
+            if isinstance(self.redis, RedisStreamQueue):
+                raise RuntimeError(
+                    'REDIS_HIGH_WATERMARK cannot be used with '
+                    'REDIS_STREAM_PARTITIONS'
+                )
+            if REDIS_LOW_WATERMARK >= REDIS_HIGH_WATERMARK:
+                raise ValueError(
+                    'REDIS_LOW_WATERMARK must be lower than '
+                    'REDIS_HIGH_WATERMARK'
+                )
+
     def create_setting(self):
         """Create Elasticsearch setting and mapping if required."""
         root = self.tree.build(self.nodes[0])
@@ -142,15 +245,24 @@ class Sync(Base):
         """Create the database triggers and replication slot."""
         self.teardown()
 
+        if self.output_plugin == PGOUTPUT:
+            self.create_publication(self.__name)
+
         for schema in self.schemas:
             tables = set([])
             # tables with manual foreign keys
             other_tables = []
+            # columns of each table in the document
+            # NB: through tables only need their keys
+            indexed_columns = collections.defaultdict(set)
 
             root = self.tree.build(self.nodes[0])
             for node in traverse_breadth_first(root):
                 tables |= set(node.relationship.through_tables)
                 tables |= set([node.table])
+                indexed_columns[node.table] |= node.indexed_columns
+                for through_table in node.relationship.through_tables:
+                    indexed_columns[through_table] |= set()
 
                 columns = []
                 if node.relationship.foreign_key.parent:
@@ -160,8 +272,35 @@ class Sync(Base):
                 if columns:
                     other_tables.append((node.table, columns))
 
-            self.create_triggers(schema, tables=tables)
+            foreign_keys = collections.defaultdict(list)
+            for table, columns in other_tables:
+                foreign_keys[table].extend(columns)
+
+            self.add_document(
+                schema,
+                self.__name,
+                columns=indexed_columns,
+                foreign_keys=foreign_keys,
+            )
+            if OUTBOX_CAPTURE:
+                self.create_outbox_table(schema)
+            else:
+                self.create_spill_table(schema)
+            # NB: the trigger function of a table is shared by the documents
+            columns, foreign_keys = self.documents_columns(schema)
+            self.create_triggers(
+                schema,
+                tables=tables,
+                columns=columns,
+                foreign_keys=foreign_keys,
+            )
             self.create_views(schema, tables, other_tables)
+            if self.output_plugin == PGOUTPUT:
+                self.add_publication_tables(
+                    self.__name,
+                    schema,
+                    tables=tables,
+                )
         self.create_replication_slot(self.__name)
 
     def teardown(self):
@@ -171,6 +310,8 @@ class Sync(Base):
             os.unlink(self._checkpoint_file)
         except OSError:
             pass
+        if self.reverse_index is not None:
+            self.reverse_index._drop()
 
         for schema in self.schemas:
             tables = set([])
@@ -178,9 +319,59 @@ class Sync(Base):
             for node in traverse_breadth_first(root):
                 tables |= set(node.relationship.through_tables)
                 tables |= set([node.table])
-            self.drop_triggers(schema=schema, tables=tables)
+            # NB: the other documents of the schema share the spill and
+            # outbox tables and the triggers of their tables
+            count = self.remove_document(schema, self.__name)
+            columns, foreign_keys = self.documents_columns(schema)
+            if tables - set(columns):
+                self.drop_triggers(
+                    schema=schema,
+                    tables=tables - set(columns),
+                )
+            if tables & set(columns):
+                # without the columns of this document
+                self.create_triggers(
+                    schema,
+                    tables=tables & set(columns),
+                    columns=columns,
+                    foreign_keys=foreign_keys,
+                )
             self.drop_views(schema=schema)
+            if not count:
+                self.drop_spill_table(schema)
+                self.drop_outbox_table(schema)
         self.drop_replication_slot(self.__name)
+        if self.output_plugin == PGOUTPUT:
+            self.drop_publication(self.__name)
+
+    @property
+    def document_tables(self):
+        """
+        All the tables (including through tables) in the document.
+
+        NB: not called tables so as not to hide Base.tables(schema).
+        """
+        if self._tables is None:
+            self.tree.build(self.nodes[0])
+            self._tables = self.tree.nodes | self.tree.through_nodes
+        return self._tables
+
+    @property
+    def producer(self):
+        """
+        Whether this process captures the changes.
+
+        Only the first of the consumers sharing the Redis streams captures
+        and pulls the changes, the others only consume them.
+        """
+        return (
+            not isinstance(self.redis, RedisStreamQueue) or
+            REDIS_STREAM_CONSUMER == 0
+        )
+
+    def _primary_keys(self, schema, table):
+        """Get the primary key columns of a table for the queue."""
+        return self.model(table, schema).primary_keys
 
     def get_doc_id(self, primary_keys):
         """Get the Elasticsearch document id from the primary keys."""
@@ -188,90 +379,105 @@ class Sync(Base):
             map(str, primary_keys)
         )
 
-    def logical_slot_changes(self, txmin=None, txmax=None):
+    def logical_slot_changes(
+        self,
+        txmin=None,
+        txmax=None,
+        upto_nchanges=None,
+    ):
         """
         Process changes from the db logical replication logs.
 
-        Here, we are grouping all rows of the same table and tg_op
-        and processing them as a group in bulk.
-        This is more efficient.
-        e.g [
-            {'tg_op': INSERT, 'table': A, ...},
-            {'tg_op': INSERT, 'table': A, ...},
-            {'tg_op': INSERT, 'table': A, ...},
-            {'tg_op': DELETE, 'table': A, ...},
-            {'tg_op': DELETE, 'table': A, ...},
-            {'tg_op': INSERT, 'table': A, ...},
-            {'tg_op': INSERT, 'table': A, ...},
-        ]
+        The changes of each window are compacted into the root documents
+        they change and synced in bulk as the changes read from Redis are.
 
-        We will have 3 groups being synced together in one execution
-        First 3 INSERT, Next 2 DELETE and then the next 2 INSERT.
-        Perhaps this could be improved but this is the best approach so far.
+        Only changes to tables in the document are decoded and returned by
+        the server, changes to any other table are skipped.
 
-        TODO: We can also process all INSERTS together and rearrange
-        them as done below
-        """
-        rows = self.logical_slot_peek_changes(
-            self.__name,
-            txmin=txmin,
-            txmax=txmax,
-            upto_nchanges=None,
-        )
+        The slot is drained in windows of at most upto_nchanges changes
+        up to the current WAL location. Each window is streamed from the
+        server and consumed from the slot once it has been synced, so memory
+        stays bounded and progress is kept during a long catch-up.
 
-        rows = rows or []
-        payloads = []
-        _rows = []
+        The checkpoint is set to the WAL location the slot was drained up to.
 
-        for row in rows:
-            if (
-                re.search(r'^BEGIN', row.data) or
-                re.search(r'^COMMIT', row.data)
-            ):
-                continue
-            _rows.append(row)
+        With LOGICAL_SLOT_DECODE_WORKERS each window is decoded by a pool
+        of processes and merged back in commit order before being synced.
+        """
+        upto_nchanges = upto_nchanges or LOGICAL_SLOT_CHUNK_SIZE
+        upto_lsn = self.current_wal_lsn
+
+        pool = None
+        # pgoutput relation messages must be decoded in order
+        processes = 0 if self.decoder.binary else LOGICAL_SLOT_DECODE_WORKERS
+        if processes > 1:
+            # the workers decode with the column decoders built here
+            decoder = get_decoder(
+                ColumnDecoders({
+                    f'{schema}.{table}': self.column_decoders(table, schema)
+                    for schema in self.schemas
+                    for table in self.document_tables
+                }),
+                self.output_plugin,
+            )
+            pool = decode_pool(decoder, processes)
 
-        for i, row in enumerate(_rows):
+        try:
+            self._logical_slot_changes(
+                txmin=txmin,
+                txmax=txmax,
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                pool=pool,
+                processes=processes,
+            )
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        # everything up to upto_lsn is now in Elasticsearch
+        self.checkpoint = upto_lsn
+
+    def _logical_slot_changes(
+        self,
+        txmin,
+        txmax,
+        upto_lsn,
+        upto_nchanges,
+        pool=None,
+        processes=0,
+    ):
+        """Drain the replication slot window by window up to upto_lsn."""
+        while True:
 
-            logger.debug(f'txid: {row.xid}')
-            logger.debug(f'data: {row.data}')
-            # TODO: optimize this so we are not parsing the same row twice
-            try:
-                payload = self.parse_logical_slot(row.data)
-            except Exception as e:
-                logger.exception(
-                    f'Error parsing row: {e}\nRow data: {row.data}'
-                )
-                raise
-            payloads.append(payload)
+            rows = self.logical_slot_peek_changes(
+                self.__name,
+                txmin=txmin,
+                txmax=txmax,
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                tables=self.document_tables,
+            )
 
-            j = i + 1
-            if j < len(_rows):
-                try:
-                    payload2 = self.parse_logical_slot(_rows[j].data)
-                except Exception as e:
-                    logger.exception(
-                        f'Error parsing row: {e}\nRow data: {_rows[j].data}'
-                    )
-                    raise
+            rows = ((row.xid, row.data) for row in rows)
+            if pool:
+                changes = decode_changes_parallel(pool, rows, processes)
+            else:
+                changes = decode_changes(self.decoder, rows)
 
-                if (
-                    payload['tg_op'] != payload2['tg_op'] or
-                    payload['table'] != payload2['table']
-                ):
-                    self.sync_payloads(payloads)
-                    payloads = []
-            elif j == len(_rows):
-                self.sync_payloads(payloads)
-                payloads = []
+            self._sync_changes(changes)
 
-        if rows:
-            self.logical_slot_get_changes(
+            # consume this window from the slot now that it has been synced
+            nchanges = self.logical_slot_count_changes(
                 self.__name,
-                txmin=txmin,
-                txmax=txmax,
-                upto_nchanges=len(rows),
+                upto_lsn=upto_lsn,
+                upto_nchanges=upto_nchanges,
+                tables=self.document_tables,
             )
+            # decoding only stops short of upto_nchanges once upto_lsn
+            # has been reached
+            if nchanges < upto_nchanges:
+                break
 
     def _payload_data(self, payload):
         """Extract the payload data from the payload."""
@@ -481,42 +687,37 @@ class Sync(Base):
                         docs.append(doc)
 
                 if docs:
-                    self.es.bulk(index, docs)
+                    self._bulk(docs)
 
             else:
 
                 # update the child tables
+                # NB: the root documents of all the rows are looked up at once
+                keys = {}
                 for payload in payloads:
                     payload_data = self._payload_data(payload)
-                    primary_values = [
+                    primary_values = tuple(
                         payload_data[key] for key in model.primary_keys
-                    ]
-                    primary_fields = dict(
+                    )
+                    keys[primary_values] = dict(
                         zip(model.primary_keys, primary_values)
                     )
-                    fields = collections.defaultdict(list)
-                    _filters = []
 
-                    for key, value in primary_fields.items():
-                        fields[key].append(value)
-                        if None in payload['new'].values():
-                            extra['table'] = table
-                            extra['column'] = key
+                    if None in payload['new'].values():
+                        extra['table'] = table
+                        extra['column'] = model.primary_keys[-1]
 
                     if None in payload['old'].values():
-                        for key, value in primary_fields.items():
-                            fields[key].append(0)
-
-                    for doc_id in self.es._search(index, table, fields):
-                        where = {}
-                        params = doc_id.split(PRIMARY_KEY_DELIMITER)
-                        for i, key in enumerate(root_model.primary_keys):
-                            where[key] = params[i]
+                        zeros = (0,) * len(model.primary_keys)
+                        keys[zeros] = dict(zip(model.primary_keys, zeros))
 
-                        _filters.append(where)
+                for doc_id in self._lookup(table, list(keys.values())):
+                    where = {}
+                    params = doc_id.split(PRIMARY_KEY_DELIMITER)
+                    for i, key in enumerate(root_model.primary_keys):
+                        where[key] = params[i]
 
-                    if _filters:
-                        filters[root_table].extend(_filters)
+                    filters[root_table].append(where)
 
         if tg_op == DELETE:
 
@@ -541,42 +742,36 @@ class Sync(Base):
                     docs.append(doc)
 
                 if docs:
-                    self.es.bulk(index, docs)
+                    self._bulk(docs)
 
             else:
 
                 # when deleting the child node, find the doc _id where
                 # the child keys match in private, then get the root doc_id and
                 # re-sync the child tables
+                keys = {}
                 for payload in payloads:
                     payload_data = self._payload_data(payload)
-                    primary_values = [
+                    primary_values = tuple(
                         payload_data[key] for key in model.primary_keys
-                    ]
-                    primary_fields = dict(
+                    )
+                    keys[primary_values] = dict(
                         zip(model.primary_keys, primary_values)
                     )
-                    fields = collections.defaultdict(list)
-                    _filters = []
-                    for key, value in primary_fields.items():
-                        fields[key].append(value)
-
-                    for doc_id in self.es._search(index, table, fields):
-                        where = {}
-                        params = doc_id.split(PRIMARY_KEY_DELIMITER)
-                        for i, key in enumerate(root_model.primary_keys):
-                            where[key] = params[i]
 
-                        _filters.append(where)
+                for doc_id in self._lookup(table, list(keys.values())):
+                    where = {}
+                    params = doc_id.split(PRIMARY_KEY_DELIMITER)
+                    for i, key in enumerate(root_model.primary_keys):
+                        where[key] = params[i]
 
-                    if _filters:
-                        filters[root_table].extend(_filters)
+                    filters[root_table].append(where)
 
         if tg_op == TRUNCATE:
 
             if table == root_table:
                 docs = []
-                for doc_id in self.es._search(index, table, {}):
+                for doc_id in self._lookup(table, []):
 
                     doc = {
                         '_id': doc_id,
@@ -588,12 +783,12 @@ class Sync(Base):
                     docs.append(doc)
 
                 if docs:
-                    self.es.bulk(index, docs)
+                    self._bulk(docs)
 
             else:
 
                 _filters = []
-                for doc_id in self.es._search(index, table, {}):
+                for doc_id in self._lookup(table, []):
                     where = {}
                     params = doc_id.split(PRIMARY_KEY_DELIMITER)
                     for i, key in enumerate(root_model.primary_keys):
@@ -619,6 +814,304 @@ class Sync(Base):
             extra=extra,
         )
 
+    def _root_changes(self, payload, lookups, parents):
+        """
+        Resolve a change to the root documents it changes.
+
+        The keys of the rows updated or deleted in child tables are added to
+        lookups, by table, to look up the root documents containing them
+        with _lookup_roots all at once. The parent keys of the tables are
+        kept in parents, by table, to resolve them once per batch.
+
+        Returns:
+            A list of (tg_op, doc_id, where) with DELETE for the root
+            documents deleted, INSERT for the root documents inserted or
+            updated and UPDATE for the root documents whose children changed
+            with where, the primary keys of the root document.
+            None if the change must be synced on its own e.g a change to a
+            through table.
+        """
+        tg_op = payload['tg_op']
+        table = payload['table']
+        if tg_op not in TG_OP:
+            logger.exception(f'Unknown tg_op {tg_op}')
+            raise
+
+        if (
+            table not in self.tree.nodes and
+            table not in self.tree.through_nodes
+        ):
+            return []
+        if table not in self.tree.nodes:
+            return None
+
+        root_table = self.nodes[0]['table']
+        root_model = self.model(
+            root_table,
+            self.nodes[0].get('schema', SCHEMA),
+        )
+
+        if tg_op == TRUNCATE:
+            # every root document containing a row of the table
+            if table == root_table:
+                return [
+                    (DELETE, doc_id, None)
+                    for doc_id in self._lookup(table, [])
+                ]
+            return [
+                (
+                    UPDATE,
+                    doc_id,
+                    dict(
+                        zip(
+                            root_model.primary_keys,
+                            doc_id.split(PRIMARY_KEY_DELIMITER),
+                        )
+                    ),
+                )
+                for doc_id in self._lookup(table, [])
+            ]
+        payload_data = self._payload_data(payload)
+
+        if table == root_table:
+            root_changes = []
+            values = [payload_data[key] for key in root_model.primary_keys]
+            if tg_op == UPDATE:
+                # delete the old document if the primary key has changed
+                old_values = [
+                    payload['old'][key] for key in root_model.primary_keys
+                    if key in payload['old']
+                ]
+                if len(old_values) == len(values) and old_values != values:
+                    root_changes.append(
+                        (DELETE, self.get_doc_id(old_values), None)
+                    )
+            root_changes.append((
+                DELETE if tg_op == DELETE else INSERT,
+                self.get_doc_id(values),
+                dict(zip(root_model.primary_keys, values)),
+            ))
+            return root_changes
+
+        if tg_op == INSERT:
+            # the new row is not in any document yet so its parent is the
+            # root document it changes
+            return self._parent_root_changes(
+                payload,
+                payload_data,
+                root_model,
+                parents,
+            )
+
+        if tg_op == UPDATE and (
+            None in payload['new'].values() or
+            None in payload['old'].values()
+        ):
+            # nullable foreign keys are tracked in the private keys
+            return None
+
+        model = self.model(table, payload['schema'])
+        values = tuple(payload_data[key] for key in model.primary_keys)
+        lookups[table][values] = dict(zip(model.primary_keys, values))
+        return []
+
+    def _parent_root_changes(self, payload, payload_data, root_model, parents):
+        """
+        Resolve a row inserted in a child table to its parent root document.
+
+        Returns:
+            A list of (UPDATE, doc_id, where) for each node of the table.
+            None if a node of the table is not a child of the root table on
+            its primary keys.
+        """
+        name = (payload['schema'], payload['table'])
+        if name not in parents:
+            parents[name] = self._root_parent_keys(
+                payload['schema'],
+                payload['table'],
+                root_model,
+            )
+        if parents[name] is None:
+            return None
+        root_changes = []
+        for parent_keys, keys in parents[name]:
+            where = {
+                parent_key: payload_data[key]
+                for parent_key, key in zip(parent_keys, keys)
+            }
+            root_changes.append((
+                UPDATE,
+                self.get_doc_id(
+                    [where[key] for key in root_model.primary_keys]
+                ),
+                where,
+            ))
+        return root_changes
+
+    def _root_parent_keys(self, schema, table, root_model):
+        """
+        Get the foreign keys from a table to the root table.
+
+        Returns:
+            A list of (parent_keys, keys) for each node of the table with
+            the primary keys of the root table and the foreign keys
+            referencing them. None if a node of the table is not a child of
+            the root table on its primary keys.
+        """
+        parent_keys = []
+        root = self.tree.build(self.nodes[0])
+        for node in traverse_post_order(root):
+            if table != node.table:
+                continue
+            if not node.parent:
+                logger.exception(
+                    f'Could not get parent from node: {node.name}'
+                )
+                raise
+            if not node.parent.is_root:
+                return None
+            foreign_keys = self.query_builder._get_foreign_keys(
+                node.parent,
+                node,
+            )
+            keys = foreign_keys[
+                self._absolute_table(schema, node.parent.table)
+            ]
+            if sorted(keys) != sorted(root_model.primary_keys):
+                return None
+            parent_keys.append(
+                (keys, foreign_keys[self._absolute_table(schema, table)])
+            )
+        return parent_keys
+
+    def _lookup_roots(self, lookups):
+        """
+        Look up the root documents containing the child rows changed.
+
+        Args:
+            lookups (dict): The keys of the rows changed in each table
+
+        Yields:
+            (doc_id, where) for each root document found with where, the
+            primary keys of the root document
+        """
+        root_model = self.model(
+            self.nodes[0]['table'],
+            self.nodes[0].get('schema', SCHEMA),
+        )
+        for table, keys in lookups.items():
+            for doc_id in self._lookup(table, list(keys.values())):
+                yield doc_id, dict(
+                    zip(
+                        root_model.primary_keys,
+                        doc_id.split(PRIMARY_KEY_DELIMITER),
+                    )
+                )
+
+    def _lookup(self, table, keys):
+        """
+        Get the root documents containing any of the rows of a table.
+
+        The rows are looked up in the reverse index once a full sync has
+        populated it and in Elasticsearch otherwise.
+
+        Args:
+            table (str): The tablename
+            keys (list): The primary keys of each row or an empty list for
+                all the rows of the table
+        """
+        if self.reverse_index is not None and self.reverse_index.complete:
+            return self.reverse_index.lookup(table, keys)
+        if not keys:
+            return self.es._search(self.index, table, {})
+        return self.es._search_keys(self.index, table, keys)
+
+    def _bulk(self, docs):
+        """
+        Bulk write documents to Elasticsearch.
+
+        The reverse index is only changed once Elasticsearch has accepted
+        the documents, so a failed write leaves both as they were.
+        """
+        if self.reverse_index is None:
+            self.es.bulk(self.index, docs)
+            return
+        try:
+            self.es.bulk(self.index, docs, done=self._reverse_index_done)
+        finally:
+            # NB: the documents rendered but not written are dropped
+            self._private_keys.clear()
+
+    def _reverse_index_done(self, items):
+        """Update the reverse index with the documents written."""
+        deletes = []
+        updates = []
+        for item in items:
+            (op_type, result), = item.items()
+            if op_type == 'delete':
+                deletes.append(result['_id'])
+            elif result['_id'] in self._private_keys:
+                updates.append(
+                    (result['_id'], self._private_keys.pop(result['_id']))
+                )
+        self.reverse_index.delete(deletes)
+        self.reverse_index.update(updates)
+
+    def _sync_roots(self, docs, lookups=None):
+        """
+        Sync root documents in one query and bulk request.
+
+        Args:
+            docs (dict): The primary keys of each root document to sync by
+                document id or None to delete it
+            lookups (dict): The keys of the child rows changed in each table
+                whose root documents are also synced
+        """
+        if lookups:
+            docs = dict(docs)
+            # the lookups commute with the other changes since they never
+            # override them
+            for doc_id, where in self._lookup_roots(lookups):
+                docs.setdefault(doc_id, where)
+        deletes = []
+        filters = []
+        for doc_id, where in docs.items():
+            if where is not None:
+                filters.append(where)
+                continue
+            doc = {
+                '_id': doc_id,
+                '_index': self.index,
+                '_op_type': 'delete',
+            }
+            if self.es.version[0] < 7:
+                doc['_type'] = '_doc'
+            deletes.append(doc)
+
+        if not filters and not deletes:
+            return
+        self._lock(docs)
+        try:
+            # NB: without filters, the sync query would sync the entire db
+            if filters:
+                root_table = self.nodes[0]['table']
+                docs = itertools.chain(
+                    deletes,
+                    self._sync(
+                        self.nodes,
+                        self.index,
+                        filters={root_table: filters},
+                    ),
+                )
+            else:
+                docs = deletes
+            self._bulk(docs)
+        except Exception as e:
+            logger.exception(f'Exception: {e}')
+            raise
+        finally:
+            self._unlock()
+
     def _build_filters(self, filters, node):
         """
         Build SQLAlchemy filters.
@@ -735,8 +1228,20 @@ class Sync(Base):
             if self.pipeline:
                 doc['pipeline'] = self.pipeline
 
+            self._keep_private_keys(doc['_id'], row[META])
+
             yield doc
 
+    def _keep_private_keys(self, doc_id, private_keys):
+        """
+        Keep the private keys of a document rendered for the reverse index.
+
+        They are added to the reverse index once the document is written by
+        _bulk.
+        """
+        if self.reverse_index is not None:
+            self._private_keys[doc_id] = private_keys
+
     def sync(self, txmin=None, txmax=None):
         """
         Pull sync all data from database.
@@ -745,7 +1250,11 @@ class Sync(Base):
         sync all tables as docs to Elasticsearch
         document contains -> nodes:
         nodes contains -> node
+
+        The checkpoint is set to the WAL location before the sync since
+        every change committed before then is visible to the sync.
         """
+        lsn = self.current_wal_lsn
         docs = self._sync(
             self.nodes,
             self.index,
@@ -753,14 +1262,24 @@ class Sync(Base):
             txmax=txmax,
         )
         try:
-            self.es.bulk(self.index, docs)
+            self._bulk(docs)
         except Exception as e:
             logger.exception(f'Exception {e}')
             raise
-        self.checkpoint = txmax or self.txid_current
+        if (
+            self.reverse_index is not None and
+            txmin is None and
+            txmax is None
+        ):
+            # every document is now in the reverse index
+            self.reverse_index.complete = True
+        self.checkpoint = lsn
 
     def sync_payloads(self, payloads):
         """Sync payload when an event is emitted."""
+        if isinstance(self.redis, RedisStreamQueue):
+            self._sync_payloads_locked(payloads)
+            return
         docs = []
         for doc in self._payloads(
             self.nodes,
@@ -769,41 +1288,143 @@ class Sync(Base):
         ):
             docs.append(doc)
         try:
-            self.es.bulk(
-                self.index,
-                itertools.chain(*docs),
-            )
+            self._bulk(itertools.chain(*docs))
+        except Exception as e:
+            logger.exception(f'Exception: {e}')
+            raise
+
+    def _sync_payloads_locked(self, payloads):
+        """
+        Sync payloads once the documents they change are locked.
+
+        The documents are only known once they are rendered, so they are
+        rendered again once locked until no other document is rendered.
+        NB: only the changes without side effects in Elasticsearch are
+        synced on their own.
+        """
+        doc_ids = set([])
+        try:
+            while True:
+                docs = list(
+                    itertools.chain(
+                        *self._payloads(self.nodes, self.index, payloads)
+                    )
+                )
+                rendered = set(doc['_id'] for doc in docs)
+                if rendered <= doc_ids:
+                    break
+                doc_ids = doc_ids | rendered
+                # NB: all the documents are locked at once
+                self._unlock()
+                self._lock(doc_ids)
+            self._bulk(docs)
         except Exception as e:
             logger.exception(f'Exception: {e}')
             raise
+        finally:
+            self._unlock()
+
+    def _lock(self, doc_ids):
+        """
+        Lock root documents until they are unlocked.
+
+        With REDIS_STREAM_PARTITIONS, the changes to the rows of a document
+        can be synced by different consumers at the same time, so a
+        document is only rendered and written under its lock.
+        """
+        if isinstance(self.redis, RedisStreamQueue):
+            self.redis.lock(doc_ids)
+
+    def _unlock(self):
+        if isinstance(self.redis, RedisStreamQueue):
+            self.redis.unlock()
 
     @property
     def checkpoint(self):
-        """Save the current txid as the checkpoint."""
+        """
+        The WAL location of the last change applied to Elasticsearch.
+
+        NB: checkpoints saved by older versions are a txid.
+        """
         if os.path.exists(self._checkpoint_file):
             with open(self._checkpoint_file, 'r') as fp:
-                self._checkpoint = int(fp.read().split()[0])
+                value = fp.read().split()[0]
+            self._checkpoint = int(value) if value.isdigit() else value
         return self._checkpoint
 
     @checkpoint.setter
     def checkpoint(self, value=None):
         if value is None:
             raise ValueError('Cannot assign a None value to checkpoint')
-        with open(self._checkpoint_file, 'w+') as fp:
-            fp.write(f'{value}\n')
-        self._checkpoint = value
+        with self._checkpoint_lock:
+            checkpoint = self.checkpoint
+            if (
+                isinstance(value, str) and
+                isinstance(checkpoint, str) and
+                parse_lsn(value) < parse_lsn(checkpoint)
+            ):
+                # NB: the checkpoint never goes back e.g to the checkpoint
+                # of a batch synced after a newer one
+                logger.debug(
+                    f'Checkpoint {value} is older than {checkpoint}'
+                )
+                return
+            with open(self._checkpoint_file, 'w+') as fp:
+                fp.write(f'{value}\n')
+            self._checkpoint = value
 
     @threaded
     def poll_redis(self):
-        """Consumer which polls Redis continuously."""
+        """
+        Consumer which polls Redis continuously.
+
+        With a reliable queue e.g REDIS_RELIABLE_QUEUE, REDIS_STREAM_PARTITIONS
+        or the sqlite backend, the items are only removed from the queue once
+        they are synced to Elasticsearch.
+        """
+        if self._reliable:
+            # items left by a consumer which stopped before syncing them
+            self.redis.requeue()
         while True:
-            payloads = self.redis.bulk_pop()
+            payloads = self._pop_redis()
             if payloads:
                 logger.debug(
                     f'poll_redis: {payloads}'
                 )
-                self.on_publish(payloads)
-            time.sleep(REDIS_POLL_INTERVAL)
+                self._publish_redis(payloads)
+
+    def _publish_redis(self, payloads):
+        """Sync a batch read from Redis and acknowledge it once synced."""
+        self.on_publish(payloads)
+        if self._reliable:
+            self.redis.ack()
+
+    def _pop_redis(self):
+        """
+        Read the next batch of changes from Redis.
+
+        Blocks for up to REDIS_BLOCK_TIMEOUT while there are no changes and
+        drains the queue without waiting while it is busy. With REDIS_LINGER,
+        waits that long for more changes before reading a partial batch.
+        """
+        if self._reliable:
+            payloads = self.redis.bulk_reserve(
+                chunk_size=1,
+                timeout=REDIS_BLOCK_TIMEOUT,
+            )
+        else:
+            payload = self.redis.pop(timeout=REDIS_BLOCK_TIMEOUT)
+            payloads = [] if payload is None else [payload]
+        if not payloads:
+            return []
+
+        if REDIS_LINGER and self.redis.qsize() < REDIS_CHUNK_SIZE:
+            # wait for more changes to sync them in a larger batch
+            time.sleep(REDIS_LINGER)
+        chunk_size = max(REDIS_CHUNK_SIZE - len(payloads), 1)
+        if self._reliable:
+            return payloads + self.redis.bulk_reserve(chunk_size=chunk_size)
+        return payloads + self.redis.bulk_pop(chunk_size=chunk_size)
 
     @threaded
     def poll_db(self):
@@ -811,25 +1432,36 @@ class Sync(Base):
         Producer which polls Postgres continuously.
 
         Receive a notification message from the channel we are listening on
+
+        Notifications are buffered and pushed to Redis as they were received
+        in a single command once REDIS_WRITE_CHUNK_SIZE of them are buffered
+        or the oldest one has waited REDIS_WRITE_INTERVAL.
         """
-        conn = self.engine.connect().connection
-        conn.set_isolation_level(
-            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
-        )
-        cursor = conn.cursor()
+        conn = self._listen()
         channel = self.database
-        cursor.execute(f'LISTEN {channel}')
-        logger.debug(f'Listening for notifications on channel "{channel}"')
 
         i = 0
-        j = 0
+        # notifications spilled while we were not listening
+        j = self.poll_spill_tables()
 
         while True:
+            timeout = POLL_TIMEOUT
+            deadline = self._notify_deadline
+            if deadline is not None:
+                timeout = max(min(timeout, deadline - time.time()), 0)
             # NB: consider reducing POLL_TIMEOUT to increase throughout
             if select.select(
-                [conn], [], [], POLL_TIMEOUT
+                [conn], [], [], timeout
             ) == ([], [], []):
+                if deadline is not None and time.time() >= deadline:
+                    self._flush_notifications()
+                    continue
+                if self._resync_lsn is not None:
+                    # recover from backpressure even if no notifications
+                    # arrive
+                    self._flush_notifications()
                 if i % 10 == 0:
+                    self._poll_idle(conn)
                     sys.stdout.write(
                         f'Polling db {channel}: {j:,} item(s)\n'
                     )
@@ -837,19 +1469,309 @@ class Sync(Base):
                 i += 1
                 continue
 
+            j += self._read_notifications(conn)
+            i = 0
+
+    def _read_notifications(self, conn):
+        """
+        Read the notifications received on a connection.
+
+        They are pushed to Redis once REDIS_WRITE_CHUNK_SIZE of them are
+        buffered or the oldest one has waited REDIS_WRITE_INTERVAL.
+
+        Returns:
+            The number of notifications read
+        """
+        count = self._on_notify(conn)
+        if (
+            len(self._notify_buffer) >= REDIS_WRITE_CHUNK_SIZE or (
+                self._notify_deadline is not None and
+                time.time() >= self._notify_deadline
+            )
+        ):
+            self._flush_notifications()
+        return count
+
+    def _poll_idle(self, conn):
+        """Poll a connection no notifications arrived on for a while."""
+        self._check_notification_queue()
+        # the checkpoint moves on while idle
+        self._on_notify(conn)
+        self._flush_notifications()
+
+    def _listen(self):
+        """Get a connection listening on the notification channel."""
+        conn = self.engine.connect().connection
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+        )
+        cursor = conn.cursor()
+        channel = self.database
+        cursor.execute(f'LISTEN {channel}')
+        logger.debug(f'Listening for notifications on channel "{channel}"')
+        return conn
+
+    def _on_notify(self, conn):
+        """
+        Read the notifications received on a connection into the buffer.
+
+        Returns:
+            The number of notifications read
+        """
+        # the WAL location before this poll. By the next poll, the
+        # notifications of everything committed before it have been
+        # received
+        lsn = self.current_wal_lsn
+        try:
+            conn.poll()
+        except psycopg2.OperationalError as e:
+            logger.fatal(f'OperationalError: {e}')
+            os._exit(-1)
+
+        count = 0
+        spilled = set([])
+        while conn.notifies:
+            notification = conn.notifies.pop(0)
+            schema = spill_schema(notification.payload)
+            if schema is not None:
+                spilled.add(schema)
+                continue
+            # forwarded as is and only decoded by the consumer
+            self._notify_buffer.append(notification.payload)
+            count += 1
+        if spilled:
+            self._check_notification_queue()
+            # keep the notifications in order
+            self._flush_notifications()
+            count += self.poll_spill_tables(schemas=spilled)
+        # NB: also queued when no notifications arrived so the replication
+        # slot does not hold on to the WAL of the changes to other tables
+        if self._notify_lsn and self._notify_lsn != self._notify_checkpoint:
+            self._notify_buffer.append(
+                json.dumps({CHECKPOINT: self._notify_lsn})
+            )
+            self._notify_checkpoint = self._notify_lsn
+        if self._notify_buffer and self._notify_deadline is None:
+            self._notify_deadline = time.time() + REDIS_WRITE_INTERVAL
+        self._notify_lsn = lsn
+        return count
+
+    def _flush_notifications(self):
+        """
+        Push the buffered notifications to Redis.
+
+        The notifications are dropped while the queue is above
+        REDIS_HIGH_WATERMARK.
+        """
+        if self._backpressure():
+            if self._notify_buffer:
+                logger.debug(
+                    f'on_notify: dropped {len(self._notify_buffer)} item(s)'
+                )
+        elif self._notify_buffer:
+            self.redis.bulk_push_raw(self._notify_buffer)
+            logger.debug(
+                f'on_notify: {len(self._notify_buffer)} item(s)'
+            )
+        self._notify_buffer = []
+        self._notify_deadline = None
+
+    def _backpressure(self):
+        """
+        Check the size of the queue against the watermarks.
+
+        Once the queue reaches REDIS_HIGH_WATERMARK, the changes are no
+        longer queued and only the WAL location they are dropped from is
+        kept. They are still in the replication slot since the checkpoint
+        is not moved past them. Once the queue is drained to
+        REDIS_LOW_WATERMARK, a resync marker is queued for the consumer to
+        catch up from the replication slot and changes are queued again.
+
+        A bounded memory queue has its maxsize for high watermark and half
+        of it for low watermark.
+
+        Returns:
+            True while the changes are dropped
+        """
+        high_watermark, low_watermark = self._watermarks()
+        if not high_watermark:
+            return False
+        qsize = self.redis.qsize()
+        if self._resync_lsn is None:
+            if qsize < high_watermark:
+                return False
+            self._resync_lsn = self._notify_lsn or self.current_wal_lsn
+            logger.warning(
+                f'Queue size {qsize:,} reached the high watermark: '
+                f'changes since {self._resync_lsn} will be resynced'
+            )
+            return True
+        if qsize > low_watermark:
+            return True
+        self.redis.push({RESYNC: self._resync_lsn})
+        logger.info(
+            f'Queue size {qsize:,} reached the low watermark: '
+            f'resyncing changes since {self._resync_lsn}'
+        )
+        self._resync_lsn = None
+        return False
+
+    def _watermarks(self):
+        """Get the high and low watermarks of the queue."""
+        if REDIS_HIGH_WATERMARK or not isinstance(self.redis, MemoryQueue):
+            return REDIS_HIGH_WATERMARK, REDIS_LOW_WATERMARK
+        # the producer never waits on a full memory queue
+        return self.redis.maxsize, self.redis.maxsize // 2
+
+    def poll_spill_tables(self, schemas=None):
+        """
+        Push the notifications in the spill tables to Redis.
+
+        Notifications too big for NOTIFY or sent while the notification
+        queue was filling up are stored in the spill table of the schema.
+        """
+        count = 0
+
+        def _push(notifications):
+            nonlocal count
+            if self._backpressure():
+                # resynced from the replication slot with the others
+                logger.debug(f'on_spill: dropped {len(notifications)} item(s)')
+                return
+            self.redis.bulk_push(notifications)
+            logger.debug(f'on_spill: {notifications}')
+            count += len(notifications)
+
+        for schema in schemas or self.schemas:
+            self.pop_notifications(schema, SPILL_TABLE, self.__name, _push)
+        return count
+
+    @threaded
+    def poll_outbox(self):
+        """Consumer thread which polls the outbox tables continuously."""
+        self._poll_outbox()
+
+    def _poll_outbox(self):
+        """
+        Poll the outbox tables continuously.
+
+        Each batch of notifications is synced to Elasticsearch before it is
+        deleted from the outbox table. Every document has its own copy of
+        the notifications and batches are claimed with FOR UPDATE SKIP
+        LOCKED so several consumers of a document can drain them.
+        """
+
+        def _publish(notifications):
+            logger.debug(f'poll_outbox: {notifications}')
+            self.on_publish(notifications)
+
+        i = 0
+        j = 0
+        while True:
+            # the WAL location before this poll. Everything committed before
+            # it is in the outbox tables
+            lsn = self.current_wal_lsn
+            count = 0
+            for schema in self.schemas:
+                count += self.pop_notifications(
+                    schema,
+                    OUTBOX_TABLE,
+                    self.__name,
+                    _publish,
+                )
+            if count:
+                # the checkpoint only moves once changes have been synced
+                self.checkpoint = lsn
+                j += count
+                i = 0
+                continue
+            if i % 10 == 0:
+                # NB: the outbox tables were empty so the checkpoint moves on
+                # while idle
+                self.checkpoint = lsn
+                sys.stdout.write(f'Polling outbox: {j:,} item(s)\n')
+                sys.stdout.flush()
+            i += 1
+            time.sleep(POLL_TIMEOUT)
+
+    def _check_notification_queue(self):
+        usage = self.notification_queue_usage
+        if usage >= NOTIFY_QUEUE_THRESHOLD:
+            logger.warning(
+                f'Notification queue is {usage:.0%} full: '
+                f'notifications are spilled to the spill tables'
+            )
+
+    @threaded
+    def stream_slot(self):
+        """Consumer thread which streams changes from the replication slot."""
+        self._stream_slot()
+
+    def _stream_slot(self):
+        """
+        Stream changes from the replication slot.
+
+        Changes are pushed by Postgres over the replication protocol as they
+        are committed. The flush position of the slot is only acknowledged
+        once the changes have been written to Elasticsearch, so anything not
+        yet synced is replayed after a restart.
+        """
+        conn = self.replication_connection()
+        cursor = conn.cursor()
+        cursor.start_replication(
+            slot_name=self.__name,
+            decode=not self.decoder.binary,
+            options=self.decoder.options(
+                self.__name, tables=self.document_tables
+            ),
+        )
+        logger.debug(f'Streaming replication slot "{self.__name}"')
+
+        payloads = []
+        flush_lsn = None
+        # the flush position last acknowledged
+        feedback_lsn = None
+
+        def _flush():
+            nonlocal payloads, feedback_lsn
+            if payloads:
+                self.on_publish(payloads)
+                payloads = []
+            # NB: also when the transactions had no changes to the document
+            # so the slot does not hold on to their WAL
+            if flush_lsn and flush_lsn != feedback_lsn:
+                cursor.send_feedback(flush_lsn=flush_lsn)
+                self.checkpoint = format_lsn(flush_lsn)
+                feedback_lsn = flush_lsn
+
+        while True:
             try:
-                conn.poll()
+                message = cursor.read_message()
             except psycopg2.OperationalError as e:
                 logger.fatal(f'OperationalError: {e}')
                 os._exit(-1)
 
-            while conn.notifies:
-                notification = conn.notifies.pop(0)
-                payload = json.loads(notification.payload)
-                self.redis.push(payload)
-                logger.debug(f'on_notify: {payload}')
-                j += 1
-            i = 0
+            if message is None:
+                # nothing more to read right now so sync what we have
+                _flush()
+                select.select([cursor], [], [], POLL_TIMEOUT)
+                continue
+
+            data = message.payload
+            logger.debug(f'stream_slot: {data}')
+
+            if self.decoder.is_commit(data):
+                flush_lsn = message.data_start
+                if not payloads or len(payloads) >= LOGICAL_SLOT_CHUNK_SIZE:
+                    _flush()
+                continue
+
+            try:
+                # the decoder sets the xmin of each payload
+                payloads.extend(self.decoder.decode(data))
+            except Exception as e:
+                logger.exception(f'Error parsing row: {e}\nRow data: {data}')
+                raise
 
     def on_publish(self, payloads):
         """
@@ -861,73 +1783,142 @@ class Sync(Base):
         """
         logger.debug(f'on_publish len {len(payloads)}')
 
-        # Safe inserts are insert operations that can be performed in any order
-        # Optimize the safe INSERTS
-        # TODO repeat this for the other place too
-        # if all payload operations are INSERTS
-        if set(
-            map(lambda x: x['tg_op'], payloads)
-        ) == set([INSERT]):
+        for i, payload in enumerate(payloads):
+            if RESYNC in payload:
+                # the changes dropped under backpressure come after the
+                # changes queued before the marker
+                self.on_publish(payloads[:i])
+                self.resync(payload[RESYNC])
+                self.on_publish(payloads[i + 1:])
+                return
+
+        checkpoints = []
+        changes = []
+        for payload in payloads:
+            if CHECKPOINT in payload:
+                checkpoints.append(payload[CHECKPOINT])
+            else:
+                # statement level notifications hold many rows
+                changes.extend(notification_payloads(payload))
 
-            _payloads = collections.defaultdict(list)
+        self._sync_changes(changes)
 
-            for payload in payloads:
-                _payloads[payload['table']].append(payload)
+        # NB: the stream queue keeps the checkpoints of its partitions
+        if checkpoints:
+            # everything queued before the last checkpoint is now synced
+            self.checkpoint = checkpoints[-1]
 
-            for _payload in _payloads.values():
-                self.sync_payloads(_payload)
+    def _sync_changes(self, changes):
+        """
+        Sync changes compacted into the root documents they change.
 
-        else:
+        The changes are compacted into the root documents to sync (or
+        delete) as of their last change so they are synced in one query and
+        bulk request. Changes which cannot be compacted are synced on their
+        own in order.
+        """
+        docs = {}
+        lookups = collections.defaultdict(dict)
+        parents = {}
+        for payload in changes:
+            root_changes = self._root_changes(payload, lookups, parents)
+            if root_changes is None:
+                self._sync_roots(docs, lookups)
+                docs = {}
+                lookups = collections.defaultdict(dict)
+                self.sync_payloads([payload])
+                continue
+            for tg_op, doc_id, where in root_changes:
+                if tg_op == DELETE:
+                    docs[doc_id] = None
+                elif tg_op == INSERT:
+                    docs[doc_id] = where
+                else:
+                    # NB: a change to the children of a deleted root
+                    # document does not bring it back
+                    docs.setdefault(doc_id, where)
+        self._sync_roots(docs, lookups)
 
-            _payloads = []
-            for i, payload in enumerate(payloads):
-                _payloads.append(payload)
-                j = i + 1
-                if j < len(payloads):
-                    payload2 = payloads[j]
-                    if (
-                        payload['tg_op'] != payload2['tg_op'] or
-                        payload['table'] != payload2['table']
-                    ):
-                        self.sync_payloads(_payloads)
-                        _payloads = []
-                elif j == len(payloads):
-                    self.sync_payloads(_payloads)
-                    _payloads = []
-
-        txids = set(
-            map(lambda x: x['xmin'], payloads)
-        )
-        # for truncate, tg_op txids is None so skip setting the checkpoint
-        if txids != set([None]):
-            txmin = min(min(txids), self.txid_current) - 1
-            self.checkpoint = txmin
+    def resync(self, lsn):
+        """
+        Catch up on the changes dropped under backpressure.
+
+        The replication slot holds every change since the checkpoint
+        including the dropped ones, so it is replayed up to the current WAL
+        location.
+        """
+        logger.info(f'Resyncing changes since {lsn} from the replication slot')
+        with self._slot_lock:
+            self.logical_slot_changes()
 
     def pull(self):
-        """Pull data from db."""
-        txmin = self.checkpoint
-        txmax = self.txid_current
-        logger.debug(f'pull txmin: {txmin} txmax: {txmax}')
-        # forward pass sync
-        self.sync(txmin=txmin, txmax=txmax)
-        # now sync up to txmax to capture everything we might have missed
-        self.logical_slot_changes(txmin=txmin, txmax=txmax)
+        """
+        Pull data from db.
+
+        The forward pass sync of the tables only runs the first time.
+        After that, we resume from the checkpoint in the replication slot.
+        """
+        checkpoint = self.checkpoint
+        logger.debug(f'pull checkpoint: {checkpoint}')
+        if checkpoint is None or isinstance(checkpoint, int):
+            # forward pass sync (from a txid checkpoint of older versions)
+            self.sync(txmin=checkpoint)
+        # skip the changes already in Elasticsearch
+        self.logical_slot_count_changes(
+            self.__name,
+            upto_lsn=self._slot_checkpoint(),
+            tables=self.document_tables,
+        )
+        # now replay the slot to capture everything since the checkpoint
+        self.logical_slot_changes()
         self._truncate = True
 
     @threaded
     def truncate_slots(self):
-        """Truncate the logical replication slot."""
+        """
+        Truncate the logical replication slot.
+
+        Only changes up to the checkpoint are truncated so that anything
+        not yet in Elasticsearch is replayed from the slot after a restart.
+        """
         while True:
             if self._truncate and (
                 datetime.now() >= self._last_truncate_timestamp + timedelta(
                     seconds=REPLICATION_SLOT_CLEANUP_INTERVAL
                 )
             ):
-                logger.debug(f'Truncating replication slot: {self.__name}')
-                self.logical_slot_get_changes(self.__name, upto_nchanges=None)
+                self._truncate_slot()
                 self._last_truncate_timestamp = datetime.now()
             time.sleep(0.1)
 
+    def _truncate_slot(self):
+        logger.debug(f'Truncating replication slot: {self.__name}')
+        with self._slot_lock:
+            self.logical_slot_count_changes(
+                self.__name,
+                upto_lsn=self._slot_checkpoint(),
+                tables=self.document_tables,
+            )
+
+    def _slot_checkpoint(self):
+        """
+        The WAL location the replication slot is synced up to.
+
+        With REDIS_STREAM_PARTITIONS, the consumers sync their partitions
+        concurrently so the queued changes are only synced up to the oldest
+        checkpoint acknowledged in the partitions.
+        """
+        checkpoint = self.checkpoint
+        if isinstance(self.redis, RedisStreamQueue):
+            lsn = self.redis.checkpoint()
+            if (
+                lsn is not None and
+                isinstance(checkpoint, str) and
+                parse_lsn(lsn) > parse_lsn(checkpoint)
+            ):
+                return lsn
+        return checkpoint
+
     def receive(self):
         """
         Receive events from db.
@@ -937,7 +1928,28 @@ class Sync(Base):
         1. Buffer all ongoing changes from db to Redis.
         2. Pull everything so far and also replay replication logs.
         3. Consume all changes from Redis.
+
+        With LOGICAL_SLOT_STREAMING, changes are instead streamed directly
+        from the replication slot once everything so far has been pulled.
+        With OUTBOX_CAPTURE, they are consumed from the outbox tables.
         """
+        if LOGICAL_SLOT_STREAMING:
+            self.pull()
+            self.stream_slot()
+            return
+
+        if OUTBOX_CAPTURE:
+            # the outbox tables hold every change committed since setup so
+            # there is nothing to buffer while pulling
+            self.pull()
+            self.poll_outbox()
+            self.truncate_slots()
+            return
+
+        if not self.producer:
+            self.poll_redis()
+            return
+
         # start a background worker producer thread to poll the db and populate
         # the Redis cache
         self.poll_db()
@@ -952,6 +1964,152 @@ class Sync(Base):
         # start a background worker thread to cleanup the replication slot
         self.truncate_slots()
 
+    async def async_receive(self):
+        """
+        Receive events from db on the asyncio event loop.
+
+        The same as receive but driven by events instead of polling threads:
+        the listening connection is only read when it is readable, Redis is
+        read with blocking pops and the replication slot is truncated on a
+        timer. Blocking work runs off the event loop so that several
+        documents can be received in one process. The replication stream and
+        the outbox tables block on the database so they are read in the
+        consumer thread of the document.
+
+        NB: receive is kept for the callers driving a document with
+        threads and shares its loops with this one.
+        """
+        loop = asyncio.get_event_loop()
+        if LOGICAL_SLOT_STREAMING:
+            await loop.run_in_executor(None, self.pull)
+            # NB: reading the replication stream blocks its thread
+            await loop.run_in_executor(
+                self._consumer_executor, self._stream_slot
+            )
+            return
+
+        if OUTBOX_CAPTURE:
+            await loop.run_in_executor(None, self.pull)
+            await asyncio.gather(
+                loop.run_in_executor(
+                    self._consumer_executor, self._poll_outbox
+                ),
+                self.async_truncate_slots(),
+            )
+            return
+
+        if not self.producer:
+            await self.async_poll_redis()
+            return
+
+        self.add_db_reader(loop)
+        await loop.run_in_executor(None, self.pull)
+        await asyncio.gather(
+            self.async_poll_redis(),
+            self.async_truncate_slots(),
+        )
+
+    def add_db_reader(self, loop):
+        """
+        Producer which reads the notifications as they arrive.
+
+        The listening connection is registered with the event loop and the
+        buffered notifications are pushed to Redis by a timer. Another timer
+        polls the connection while idle so the checkpoint moves on. Reading
+        and pushing the notifications block on the database and Redis so
+        they run in the producer thread.
+        """
+        conn = self._listen()
+        timer = None
+
+        def _read():
+            self._read_notifications(conn)
+            return bool(self._notify_buffer) or self._resync_lsn is not None
+
+        def _flush():
+            self._flush_notifications()
+            return self._resync_lsn is not None
+
+        def _idle():
+            self._poll_idle(conn)
+            return self._resync_lsn is not None
+
+        def _on_timer():
+            nonlocal timer
+            timer = None
+            loop.run_in_executor(
+                self._producer_executor, _flush
+            ).add_done_callback(_on_flushed)
+
+        def _on_flushed(future):
+            nonlocal timer
+            if self._pending_flush(future) and timer is None:
+                # recover from backpressure even if no notifications arrive
+                timer = loop.call_later(POLL_TIMEOUT, _on_timer)
+
+        def _on_idle():
+            loop.run_in_executor(
+                self._producer_executor, _idle
+            ).add_done_callback(_on_flushed)
+            loop.call_later(POLL_TIMEOUT * 10, _on_idle)
+
+        def _on_readable():
+            # the connection is not watched until the notifications are read
+            loop.remove_reader(conn)
+            loop.run_in_executor(
+                self._producer_executor, _read
+            ).add_done_callback(_on_read)
+
+        def _on_read(future):
+            nonlocal timer
+            loop.add_reader(conn, _on_readable)
+            if self._pending_flush(future) and timer is None:
+                timer = loop.call_later(REDIS_WRITE_INTERVAL, _on_timer)
+
+        # notifications spilled while we were not listening
+        loop.run_in_executor(self._producer_executor, self.poll_spill_tables)
+        loop.add_reader(conn, _on_readable)
+        loop.call_later(POLL_TIMEOUT * 10, _on_idle)
+
+    def _pending_flush(self, future):
+        """
+        Whether the producer thread left notifications to push to Redis.
+
+        A read or a push which failed is logged and retried since the
+        notifications not pushed are kept in the buffer.
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            logger.exception(f'Exception {e}')
+            return True
+
+    async def async_poll_redis(self):
+        """Consumer which waits on Redis until there are changes."""
+        loop = asyncio.get_event_loop()
+        if self._reliable:
+            # items left by a consumer which stopped before syncing them
+            await loop.run_in_executor(
+                self._consumer_executor, self.redis.requeue
+            )
+        while True:
+            # NB: redis-py has no asyncio client so this blocks the thread
+            payloads = await loop.run_in_executor(
+                self._consumer_executor, self._pop_redis
+            )
+            if payloads:
+                logger.debug(f'poll_redis: {payloads}')
+                await loop.run_in_executor(
+                    self._consumer_executor, self._publish_redis, payloads
+                )
+
+    async def async_truncate_slots(self):
+        """Truncate the logical replication slot periodically."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(REPLICATION_SLOT_CLEANUP_INTERVAL)
+            await loop.run_in_executor(None, self._truncate_slot)
+
 
 @click.command()
 @click.option(
@@ -1039,15 +2197,27 @@ def main(
     show_settings(config, params)
 
     with Timer():
+        syncs = []
         for document in json.load(open(config)):
             sync = Sync(
                 document,
                 verbose=verbose,
                 params=params,
             )
-            sync.pull()
-            if daemon:
-                sync.receive()
+            if sync.producer:
+                sync.pull()
+            syncs.append(sync)
+
+    if daemon:
+        # all the documents are received on one event loop
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(
+                asyncio.gather(*[sync.async_receive() for sync in syncs])
+            )
+        finally:
+            loop.close()
 
 
 if __name__ == '__main__':
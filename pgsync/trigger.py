@@ -1,8 +1,161 @@
 """PGSync Trigger template."""
-from .constants import FOREIGN_KEY_VIEW, PRIMARY_KEY_VIEW, TRIGGER_FUNC
+import json
 
-CREATE_TRIGGER_TEMPLATE = f"""
-CREATE OR REPLACE FUNCTION {TRIGGER_FUNC}() RETURNS TRIGGER AS $$
+from .constants import (
+    DOCUMENTS_TABLE,
+    OUTBOX_TABLE,
+    SPILL,
+    SPILL_TABLE,
+    TRIGGER_FUNC,
+)
+from .settings import NOTIFY_QUEUE_THRESHOLD, OUTBOX_CAPTURE
+
+# NOTIFY payloads must be shorter than 8000 bytes
+NOTIFY_PAYLOAD_LIMIT = 8000
+# size of the rows sent in a statement level notification
+NOTIFY_PAYLOAD_SIZE = 7500
+
+
+def trigger_function(table):
+    """Get the name of the trigger function of a table."""
+    return f'{TRIGGER_FUNC}_{table}'
+
+
+def notification_payloads(notification):
+    """
+    Get the payload of each row changed in a notification.
+
+    Notifications from statement level triggers hold lists with the keys
+    of many rows which are expanded into one payload per row.
+    """
+    new_rows = notification.get('new')
+    old_rows = notification.get('old')
+    if not isinstance(new_rows, list) and not isinstance(old_rows, list):
+        return [notification]
+    nrows = len(new_rows or old_rows)
+    return [
+        dict(notification, new=new_row, old=old_row)
+        for new_row, old_row in zip(
+            new_rows or [None] * nrows,
+            old_rows or [None] * nrows,
+        )
+    ]
+
+
+def spill_schema(payload):
+    """
+    Get the schema of a spill table pointer.
+
+    Returns None for any other notification without decoding it.
+    """
+    if payload.startswith(f'{{"{SPILL}"'):
+        return json.loads(payload)[SPILL]
+
+
+def _identifier(name):
+    name = name.replace('"', '""')
+    return f'"{name}"'
+
+
+def _json_object(record, columns):
+    """Build a JSON object of the columns of a record e.g NEW or OLD."""
+    if not columns:
+        return 'NULL'
+    pairs = ', '.join(
+        f"""'{column.replace("'", "''")}', {record}.{_identifier(column)}"""
+        for column in columns
+    )
+    return f'JSON_BUILD_OBJECT({pairs})'
+
+
+def _is_distinct(columns, text_columns=None, new='NEW', old='OLD'):
+    """Check whether any of the columns changed in an UPDATE."""
+    if not columns:
+        return 'TRUE'
+    text_columns = text_columns or []
+    expressions = []
+    for column in columns:
+        cast = '::TEXT' if column in text_columns else ''
+        expressions.append(
+            f'{new}.{_identifier(column)}{cast} IS DISTINCT FROM '
+            f'{old}.{_identifier(column)}{cast}'
+        )
+    return '\n                OR '.join(expressions)
+
+
+def _notify(schema, queue_threshold, outbox=False, indent=4):
+    """
+    Send the notification or spill it to the spill table.
+
+    Notifications too big for NOTIFY or sent while the notification queue
+    is filling up are inserted into the spill table, once for each document
+    synced from the schema, and only a pointer to it is sent.
+    NB: identical notifications in a transaction are only delivered once.
+
+    With outbox, the notification is appended to the outbox table instead,
+    also once for each document.
+    """
+    documents_table = (
+        f'{_identifier(schema)}.{_identifier(DOCUMENTS_TABLE)}'
+    )
+    if outbox:
+        outbox_table = f'{_identifier(schema)}.{_identifier(OUTBOX_TABLE)}'
+        block = f"""INSERT INTO {outbox_table} (name, payload)
+    SELECT name, notification FROM {documents_table};"""
+        return f'\n{" " * indent}'.join(block.split('\n'))
+    spill_table = f'{_identifier(schema)}.{_identifier(SPILL_TABLE)}'
+    limit = NOTIFY_PAYLOAD_LIMIT
+    block = f"""IF OCTET_LENGTH(notification::TEXT) >= {limit} OR
+    PG_NOTIFICATION_QUEUE_USAGE() >= {queue_threshold} THEN
+    INSERT INTO {spill_table} (name, payload)
+        SELECT name, notification FROM {documents_table};
+    notification = JSON_BUILD_OBJECT('{SPILL}', TG_TABLE_SCHEMA);
+END IF;
+-- Notify/Listen updates occur asynchronously,
+-- so this doesn't block the Postgres trigger procedure.
+PERFORM PG_NOTIFY(channel, notification::TEXT);"""
+    return f'\n{" " * indent}'.join(block.split('\n'))
+
+
+def create_trigger_template(
+    schema,
+    table,
+    primary_keys,
+    foreign_keys,
+    columns,
+    text_columns=None,
+    queue_threshold=NOTIFY_QUEUE_THRESHOLD,
+    outbox=OUTBOX_CAPTURE,
+):
+    """
+    Generate the trigger function of a table.
+
+    The key columns are inlined so the notification is built directly from
+    the NEW and OLD records, and UPDATEs that do not change any of the
+    columns are skipped without a notification.
+
+    Args:
+        schema (str): The database schema
+        table (str): The tablename
+        primary_keys (list): The primary key columns
+        foreign_keys (list): The foreign key columns
+        columns (list): The columns compared for UPDATEs
+        text_columns (list): The columns compared as text because their
+            type has no equality operator e.g json
+        queue_threshold (float): The notification queue usage from which
+            notifications are spilled to the spill table
+        outbox (bool): Append the notifications to the outbox table
+            instead of sending them
+
+    Returns:
+        The CREATE FUNCTION statement
+    """
+    keys = primary_keys + [
+        key for key in foreign_keys if key not in primary_keys
+    ]
+    function = f'{_identifier(schema)}.{_identifier(trigger_function(table))}'
+    return f"""
+CREATE OR REPLACE FUNCTION {function}() RETURNS TRIGGER AS $$
 DECLARE
   channel TEXT;
   old_row JSON;
@@ -10,44 +163,24 @@ DECLARE
   notification JSON;
   xmin BIGINT;
 
-  primary_keys TEXT [] := (
-      SELECT primary_keys
-      FROM {PRIMARY_KEY_VIEW}
-      WHERE table_name = TG_TABLE_NAME::REGCLASS
-  );
-  foreign_keys TEXT [] := (
-      SELECT foreign_keys
-      FROM {FOREIGN_KEY_VIEW}
-      WHERE table_name = TG_TABLE_NAME
-  );
-
 BEGIN
     -- database is also the channel name.
     channel := CURRENT_DATABASE();
 
     IF TG_OP = 'DELETE' THEN
-        old_row = ROW_TO_JSON(OLD);
-        old_row := (
-            SELECT JSONB_OBJECT_AGG(key, value)
-            FROM JSON_EACH(old_row)
-            WHERE key = ANY(primary_keys)
-        );
+        old_row := {_json_object('OLD', primary_keys)};
         xmin := OLD.xmin;
     ELSE
         IF TG_OP <> 'TRUNCATE' THEN
-            new_row = ROW_TO_JSON(NEW);
-            new_row := (
-                SELECT JSONB_OBJECT_AGG(key, value)
-                FROM JSON_EACH(new_row)
-                WHERE key = ANY(primary_keys || foreign_keys)
-            );
+            -- nothing to sync if none of the columns changed.
+            IF TG_OP = 'UPDATE' AND NOT (
+                {_is_distinct(columns, text_columns)}
+            ) THEN
+                RETURN NEW;
+            END IF;
+            new_row := {_json_object('NEW', keys)};
             IF TG_OP = 'UPDATE' THEN
-                old_row = ROW_TO_JSON(OLD);
-                old_row := (
-                    SELECT JSONB_OBJECT_AGG(key, value)
-                    FROM JSON_EACH(old_row)
-                    WHERE key = ANY(primary_keys || foreign_keys)
-                );
+                old_row := {_json_object('OLD', keys)};
             END IF;
             xmin := NEW.xmin;
         END IF;
@@ -63,11 +196,157 @@ BEGIN
         'schema', TG_TABLE_SCHEMA
     );
 
-    -- Notify/Listen updates occur asynchronously,
-    -- so this doesn't block the Postgres trigger procedure.
-    PERFORM PG_NOTIFY(channel, notification::TEXT);
+    {_notify(schema, queue_threshold, outbox=outbox)}
 
   RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 """
+
+
+def create_statement_trigger_template(
+    schema,
+    table,
+    primary_keys,
+    foreign_keys,
+    columns,
+    text_columns=None,
+    queue_threshold=NOTIFY_QUEUE_THRESHOLD,
+    outbox=OUTBOX_CAPTURE,
+):
+    """
+    Generate the statement level trigger function of a table.
+
+    The keys of all the rows changed by a statement are read from the
+    transition tables and sent in as few notifications as fit in the NOTIFY
+    payload limit. The old and new rows of an UPDATE are paired by primary
+    key and the rows whose primary key changed are sent as a DELETE of the
+    old row and an INSERT of the new row. e.g:
+        {
+            "xmin": 1234,
+            "new": [{"id": 1}, {"id": 2}],
+            "old": null,
+            "tg_op": "INSERT",
+            "table": "book",
+            "schema": "public"
+        }
+
+    The arguments are the same as create_trigger_template.
+    NB: transition tables require Postgres 10 or later.
+    """
+    keys = primary_keys + [
+        key for key in foreign_keys if key not in primary_keys
+    ]
+    function = f'{_identifier(schema)}.{_identifier(trigger_function(table))}'
+    paired = ' AND '.join(
+        f'o.{_identifier(key)} = n.{_identifier(key)}' for key in primary_keys
+    ) or 'FALSE'
+    return f"""
+CREATE OR REPLACE FUNCTION {function}() RETURNS TRIGGER AS $$
+DECLARE
+  channel TEXT;
+  changes REFCURSOR;
+  op TEXT;
+  row_op TEXT;
+  old_row TEXT;
+  new_row TEXT;
+  old_rows TEXT;
+  new_rows TEXT;
+  done BOOLEAN;
+  notification JSON;
+  xmin BIGINT;
+
+BEGIN
+    -- database is also the channel name.
+    channel := CURRENT_DATABASE();
+    xmin := TXID_CURRENT();
+
+    IF TG_OP = 'INSERT' THEN
+        OPEN changes FOR
+            SELECT TG_OP, NULL, {_json_object('n', keys)}::TEXT
+            FROM new_table AS n;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- the old and new rows are paired by primary key.
+        -- the rows whose primary key changed are deleted and inserted.
+        -- nothing to sync for the rows where none of the columns changed.
+        OPEN changes FOR
+            SELECT
+                CASE
+                    WHEN n._pgsync_row IS NULL THEN 'DELETE'
+                    WHEN o._pgsync_row IS NULL THEN 'INSERT'
+                    ELSE 'UPDATE'
+                END,
+                CASE
+                    WHEN n._pgsync_row IS NULL
+                    THEN {_json_object('o', primary_keys)}
+                    WHEN o._pgsync_row IS NOT NULL
+                    THEN {_json_object('o', keys)}
+                END::TEXT,
+                CASE
+                    WHEN n._pgsync_row IS NOT NULL
+                    THEN {_json_object('n', keys)}
+                END::TEXT
+            FROM (SELECT *, TRUE AS _pgsync_row FROM old_table) AS o
+            FULL JOIN (SELECT *, TRUE AS _pgsync_row FROM new_table) AS n
+                ON {paired}
+            WHERE o._pgsync_row IS NULL OR n._pgsync_row IS NULL OR (
+                {_is_distinct(columns, text_columns, new='n', old='o')}
+            )
+            ORDER BY 1;
+    ELSIF TG_OP = 'DELETE' THEN
+        OPEN changes FOR
+            SELECT TG_OP, {_json_object('o', primary_keys)}::TEXT, NULL
+            FROM old_table AS o;
+    ELSE
+        notification = JSON_BUILD_OBJECT(
+            'xmin', xmin,
+            'new', NULL,
+            'old', NULL,
+            'tg_op', TG_OP,
+            'table', TG_TABLE_NAME,
+            'schema', TG_TABLE_SCHEMA
+        );
+        {_notify(schema, queue_threshold, outbox=outbox, indent=8)}
+        RETURN NULL;
+    END IF;
+
+    LOOP
+        FETCH changes INTO row_op, old_row, new_row;
+        done := NOT FOUND;
+        -- send the rows so far when full, the operation changes or there
+        -- are no more rows.
+        IF (old_rows IS NOT NULL OR new_rows IS NOT NULL) AND (
+            done OR
+            row_op IS DISTINCT FROM op OR
+            COALESCE(OCTET_LENGTH(old_rows), 0) +
+            COALESCE(OCTET_LENGTH(new_rows), 0) +
+            COALESCE(OCTET_LENGTH(old_row), 0) +
+            COALESCE(OCTET_LENGTH(new_row), 0) > {NOTIFY_PAYLOAD_SIZE}
+        ) THEN
+            notification = JSON_BUILD_OBJECT(
+                'xmin', xmin,
+                'new', ('[' || new_rows || ']')::JSON,
+                'old', ('[' || old_rows || ']')::JSON,
+                'tg_op', op,
+                'table', TG_TABLE_NAME,
+                'schema', TG_TABLE_SCHEMA
+            );
+            {_notify(schema, queue_threshold, outbox=outbox, indent=12)}
+            old_rows := NULL;
+            new_rows := NULL;
+        END IF;
+        EXIT WHEN done;
+        op := row_op;
+        IF old_row IS NOT NULL THEN
+            old_rows := CONCAT_WS(',', old_rows, old_row);
+        END IF;
+        IF new_row IS NOT NULL THEN
+            new_rows := CONCAT_WS(',', new_rows, new_row);
+        END IF;
+    END LOOP;
+    CLOSE changes;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
@@ -113,6 +113,17 @@ def show_settings(schema=None, params={}):
     logger.info('-' * 65)
 
 
+def format_lsn(lsn):
+    """Format an integer WAL location as text e.g: 0/16B3748."""
+    return f'{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}'
+
+
+def parse_lsn(lsn):
+    """Parse a WAL location as text e.g: 0/16B3748 into an integer."""
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
 def threaded(fn):
     """Decorator for threaded code execution."""
     def wrapper(*args, **kwargs):
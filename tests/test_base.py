@@ -101,6 +101,69 @@ class TestBase(object):
         pg_base.create_replication_slot('slot_name')
         pg_base.drop_replication_slot('slot_name')
 
+    def test_spill_table_documents(self, connection):
+        pg_base = Base(connection.engine.url.database)
+        pg_base.add_document('public', 'a')
+        pg_base.add_document('public', 'b')
+        pg_base.create_spill_table('public')
+        # the triggers copy a spilled notification for each document
+        pg_base.execute(
+            'INSERT INTO "public"."_pgsync_spill" (name, payload) '
+            'SELECT name, \'{"id": 1}\' FROM "public"."_pgsync_documents"'
+        )
+        notifications = []
+        assert pg_base.pop_notifications(
+            'public', '_pgsync_spill', 'a', notifications.extend
+        ) == 1
+        assert pg_base.pop_notifications(
+            'public', '_pgsync_spill', 'b', notifications.extend
+        ) == 1
+        assert notifications == [{'id': 1}, {'id': 1}]
+        # the tables are kept until the last document is removed
+        assert pg_base.remove_document('public', 'a') == 1
+        assert pg_base.remove_document('public', 'b') == 0
+        assert pg_base.remove_document('public', 'b') == 0
+        pg_base.drop_spill_table('public')
+
+    def test_documents_columns(self, connection):
+        pg_base = Base(connection.engine.url.database)
+        pg_base.add_document(
+            'public',
+            'a',
+            columns={'book': {'isbn', 'title'}},
+            foreign_keys={'book': ['publisher_id']},
+        )
+        pg_base.add_document(
+            'public',
+            'b',
+            columns={'book': {'isbn', 'description'}, 'author': {'id'}},
+        )
+        # the triggers are generated with the columns of every document
+        columns, foreign_keys = pg_base.documents_columns('public')
+        assert columns == {
+            'book': {'isbn', 'title', 'description'},
+            'author': {'id'},
+        }
+        assert foreign_keys == {'book': {'publisher_id'}}
+        pg_base.remove_document('public', 'a')
+        columns, foreign_keys = pg_base.documents_columns('public')
+        assert columns == {'book': {'isbn', 'description'}, 'author': {'id'}}
+        assert foreign_keys == {}
+        pg_base.remove_document('public', 'b')
+        assert pg_base.documents_columns('public') == ({}, {})
+
+    def test_drop_legacy_trigger_function(self, connection):
+        pg_base = Base(connection.engine.url.database)
+        pg_base.execute(
+            'CREATE OR REPLACE FUNCTION "public"."table_notify"() '
+            'RETURNS TRIGGER AS $$ BEGIN RETURN NULL; END; $$ '
+            'LANGUAGE plpgsql'
+        )
+        pg_base.drop_triggers('public', tables=['book'])
+        assert pg_base.fetchone(
+            "SELECT TO_REGPROC('public.table_notify')"
+        )[0] is None
+
     def test_get_schema(self, connection):
         pg_base = Base(connection.engine.url.database)
 
@@ -300,7 +363,7 @@ class TestBase(object):
         pg_base = Base(connection.engine.url.database)
         with pytest.raises(ParseLogicalSlotError) as excinfo:
             pg_base.parse_logical_slot('')
-            assert 'No match for row:' in str(excinfo.value)
+        assert 'No match for row:' in str(excinfo.value)
 
         row = '''
         table public."B1_XYZ": INSERT: "ID"[integer]:5 "CREATED_TIMESTAMP"[bigint]:222 "ADDRESS"[character varying]:'from3' "SOME_FIELD_KEY"[character varying]:'key3' "SOME_OTHER_FIELD_KEY"[character varying]:'issue3' "CHANNEL_ID"[integer]:3 "CHANNEL_NAME"[character varying]:'channel3' "ITEM_ID"[integer]:3 "MESSAGE"[character varying]:'message3' "RETRY"[integer]:4 "STATUS"[character varying]:'status' "SUBJECT"[character varying]:'sub3' "TIMESTAMP"[bigint]:33
@@ -327,3 +390,59 @@ class TestBase(object):
             'table': 'B1_XYZ',
             'tg_op': 'INSERT',
         }
+
+    def test_parse_logical_slot_quoted(
+        self,
+        connection,
+    ):
+        pg_base = Base(connection.engine.url.database)
+        row = (
+            'table "my schema"."my ""book""": UPDATE: old-key: '
+            'id[integer]:1 new-tuple: id[integer]:2 '
+            '"Title"[character varying]:\'It\'\'s a "book"\' '
+            'tags[text[]]:\'{a,b}\' description[text]:unchanged-toast-datum '
+            'copyright[text]:null'
+        )
+        values = pg_base.parse_logical_slot(row)
+        assert values == {
+            'new': {
+                'id': 2,
+                'Title': 'It\'s a "book"',
+                'tags': '{a,b}',
+                'copyright': None,
+            },
+            'old': {'id': 1},
+            'schema': 'my schema',
+            'table': 'my "book"',
+            'tg_op': 'UPDATE',
+        }
+
+        row = 'table public.book: DELETE: (no-tuple-data)'
+        values = pg_base.parse_logical_slot(row)
+        assert values == {
+            'new': {},
+            'old': {},
+            'schema': 'public',
+            'table': 'book',
+            'tg_op': 'DELETE',
+        }
+
+        with pytest.raises(ParseLogicalSlotError) as excinfo:
+            pg_base.parse_logical_slot(
+                'table public.book: INSERT: old-key: id[integer]:1'
+            )
+            assert 'Unknown INSERT operation for row:' in str(excinfo.value)
+
+        row = 'table public.book: TRUNCATE: restart_seqs cascade '
+        values = pg_base.parse_logical_slot(row)
+        assert values['tg_op'] == 'TRUNCATE'
+        assert values['new'] == {}
+
+        # the columns after a token which cannot be parsed are not dropped
+        with pytest.raises(ParseLogicalSlotError) as excinfo:
+            pg_base.parse_logical_slot(
+                'table public.book: INSERT: id[integer]:1 garbage '
+                'title[text]:\'a\''
+            )
+        assert 'Cannot parse' in str(excinfo.value)
+        assert 'garbage' in str(excinfo.value)
@@ -0,0 +1,57 @@
+"""Codec tests."""
+import json
+
+import pytest
+
+from pgsync.codec import (
+    check_codec,
+    decode,
+    encode,
+    msgpack,
+    MSGPACK,
+    TUPLE,
+    ZLIB,
+)
+from pgsync.constants import CHECKPOINT
+
+
+class TestCodec(object):
+    """Codec tests."""
+
+    def setup_method(self):
+        self.items = [
+            {
+                'xmin': 1234,
+                'tg_op': 'INSERT',
+                'schema': 'public',
+                'table': 'book',
+                'new': {'isbn': 'abc'},
+                'old': None,
+            },
+            {CHECKPOINT: '0/16B3748'},
+        ]
+
+    @pytest.mark.parametrize('codec', ['json', 'tuple', 'zlib'])
+    def test_codec(self, codec):
+        for item in self.items:
+            assert decode(encode(item, codec)) == item
+
+    @pytest.mark.skipif(msgpack is None, reason='requires msgpack')
+    def test_msgpack_codec(self):
+        for item in self.items:
+            data = encode(item, 'msgpack')
+            assert data[:1] == MSGPACK
+            assert decode(data) == item
+
+    def test_version_byte(self):
+        assert encode(self.items[0], 'tuple') == (
+            TUPLE + b'[1234,"INSERT","public","book",{"isbn":"abc"},null]'
+        )
+        assert encode(self.items[0], 'zlib')[:1] == ZLIB
+        # items queued before the codecs are plain JSON
+        assert decode(json.dumps(self.items[0]).encode()) == self.items[0]
+
+    def test_check_codec(self):
+        check_codec('tuple')
+        with pytest.raises(ValueError):
+            check_codec('xml')
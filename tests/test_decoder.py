@@ -0,0 +1,271 @@
+"""Decoder tests."""
+import decimal
+import json
+import re
+import struct
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from pgsync import decoder as _decoder
+from pgsync.base import ColumnDecoders
+from pgsync.decoder import (
+    decode_array,
+    decode_bytea,
+    decode_changes,
+    decode_changes_parallel,
+    decode_date,
+    decode_pool,
+    decode_timestamp,
+    get_column_decoders,
+    get_decoder,
+    PgOutputDecoder,
+    Wal2JsonDecoder,
+)
+from pgsync.exc import ParseLogicalSlotError
+
+
+def _string(value):
+    return value.encode() + b'\x00'
+
+
+def _tuple(values):
+    data = struct.pack('!h', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        else:
+            data += b't' + struct.pack('!i', len(value)) + value.encode()
+    return data
+
+
+class TestDecoder(object):
+    """Decoder tests."""
+
+    def test_get_decoder(self):
+        assert isinstance(
+            get_decoder(None, 'test_decoding'),
+            _decoder.TestDecodingDecoder,
+        )
+        assert isinstance(get_decoder(None, 'wal2json'), Wal2JsonDecoder)
+        assert isinstance(get_decoder(None, 'pgoutput'), PgOutputDecoder)
+        with pytest.raises(ValueError) as excinfo:
+            get_decoder(None, 'decoderbufs')
+        assert 'pgoutput, test_decoding, wal2json' in str(excinfo.value)
+
+    def test_wal2json_decode(self):
+        decoder = Wal2JsonDecoder()
+        assert decoder.options('testdb') == {
+            'format-version': '2',
+            'include-xids': '1',
+        }
+        assert list(decoder.decode('{"action":"B","xid":1234}')) == []
+        payloads = list(
+            decoder.decode(
+                json.dumps({
+                    'action': 'U',
+                    'schema': 'public',
+                    'table': 'book',
+                    'columns': [
+                        {'name': 'id', 'type': 'integer', 'value': 2},
+                        {'name': 'title', 'type': 'text', 'value': 'xyz'},
+                    ],
+                    'identity': [
+                        {'name': 'id', 'type': 'integer', 'value': 1},
+                    ],
+                })
+            )
+        )
+        assert payloads == [{
+            'schema': 'public',
+            'tg_op': 'UPDATE',
+            'table': 'book',
+            'old': {'id': 1},
+            'new': {'id': 2, 'title': 'xyz'},
+            'xmin': 1234,
+        }]
+        assert decoder.is_commit('{"action":"C","xid":1234}')
+        assert list(decoder.decode('{"action":"C","xid":1234}')) == []
+
+    def test_pgoutput_decode(self):
+        decoder = PgOutputDecoder()
+        assert decoder.options('testdb') == {
+            'proto_version': '1',
+            'publication_names': 'testdb',
+        }
+        begin = b'B' + struct.pack('!qqI', 1, 2, 1234)
+        relation = (
+            b'R' + struct.pack('!I', 16384) + _string('public') +
+            _string('book') + b'd' + struct.pack('!h', 2) +
+            b'\x01' + _string('id') + struct.pack('!Ii', 23, -1) +
+            b'\x00' + _string('title') + struct.pack('!Ii', 25, -1)
+        )
+        update = (
+            b'U' + struct.pack('!I', 16384) +
+            b'K' + _tuple(['1', None]) +
+            b'N' + _tuple(['2', 'xyz'])
+        )
+        truncate = b'T' + struct.pack('!ibI', 1, 0, 16384)
+        assert list(decoder.decode(begin)) == []
+        assert list(decoder.decode(relation)) == []
+        assert list(decoder.decode(update)) == [{
+            'schema': 'public',
+            'tg_op': 'UPDATE',
+            'table': 'book',
+            'old': {'id': 1, 'title': None},
+            'new': {'id': 2, 'title': 'xyz'},
+            'xmin': 1234,
+        }]
+        assert list(decoder.decode(truncate)) == [{
+            'schema': 'public',
+            'tg_op': 'TRUNCATE',
+            'table': 'book',
+            'old': {},
+            'new': {},
+            'xmin': 1234,
+        }]
+        assert decoder.is_commit(b'C')
+        with pytest.raises(ParseLogicalSlotError):
+            list(decoder.decode(b'I' + struct.pack('!I', 1) + b'N'))
+
+    def test_data_pattern(self):
+        decoder = _decoder.TestDecodingDecoder(None)
+        pattern = re.compile(decoder.data_pattern({'book', 'Author'}))
+        assert pattern.match('table public.book: INSERT: id[integer]:1')
+        assert pattern.match('table "my schema"."Author": DELETE: (no-tuple')
+        assert not pattern.match('table public.booking: INSERT: id[int]:1')
+        assert not pattern.match('BEGIN 1234')
+        assert not pattern.match('COMMIT 1234')
+        assert Wal2JsonDecoder().data_pattern({'book'}) is None
+        assert PgOutputDecoder().data_pattern({'book'}) is None
+
+    def test_options(self):
+        options = Wal2JsonDecoder().options('slot', tables={'book', 'a.b'})
+        assert options['add-tables'] == '*.a\\.b,*.book'
+        assert 'add-tables' not in Wal2JsonDecoder().options('slot')
+        assert PgOutputDecoder().options('slot', tables={'book'}) == {
+            'proto_version': '1',
+            'publication_names': 'slot',
+        }
+
+    def test_decode_changes_parallel(self):
+        decoder = Wal2JsonDecoder()
+        rows = [
+            (
+                i,
+                json.dumps({
+                    'action': 'I',
+                    'schema': 'public',
+                    'table': 'book',
+                    'columns': [
+                        {'name': 'id', 'type': 'integer', 'value': i},
+                    ],
+                }),
+            ) for i in range(10)
+        ]
+        pool = decode_pool(decoder, 3)
+        try:
+            payloads = list(decode_changes_parallel(pool, rows, 3))
+            assert list(decode_changes_parallel(pool, [], 3)) == []
+        finally:
+            pool.close()
+            pool.join()
+        # merged back in commit order
+        assert [payload['new']['id'] for payload in payloads] == list(
+            range(10)
+        )
+        assert [payload['xmin'] for payload in payloads] == list(range(10))
+        assert payloads == list(decode_changes(decoder, rows))
+
+    def test_decode_changes_parallel_column_decoders(self):
+        decoders = get_column_decoders(
+            sa.Table(
+                'book', sa.MetaData(),
+                sa.Column('id', sa.Integer, primary_key=True),
+                sa.Column('tags', postgresql.ARRAY(sa.Integer)),
+            )
+        )
+        decoder = get_decoder(
+            ColumnDecoders({'public.book': decoders}), 'test_decoding'
+        )
+        rows = [
+            (
+                i,
+                f"table public.book: INSERT: id[integer]:{i} "
+                f"tags[integer[]]:'{{{i},{i + 1}}}'",
+            ) for i in range(4)
+        ]
+        pool = decode_pool(decoder, 2)
+        try:
+            payloads = list(decode_changes_parallel(pool, rows, 2))
+        finally:
+            pool.close()
+            pool.join()
+        assert [payload['new'] for payload in payloads] == [
+            {'id': i, 'tags': [i, i + 1]} for i in range(4)
+        ]
+        assert payloads == list(decode_changes(decoder, rows))
+
+    def test_decode_timestamp(self):
+        assert decode_timestamp('2021-04-01 12:30:15') == datetime(
+            2021, 4, 1, 12, 30, 15
+        )
+        assert decode_timestamp('2021-04-01 12:30:15.25+05:30') == datetime(
+            2021, 4, 1, 12, 30, 15, 250000,
+            tzinfo=timezone(timedelta(hours=5, minutes=30)),
+        )
+        assert decode_timestamp('2021-04-01 12:30:15-03') == datetime(
+            2021, 4, 1, 12, 30, 15,
+            tzinfo=timezone(-timedelta(hours=3)),
+        )
+        assert decode_timestamp('infinity') == 'infinity'
+
+    def test_decode_date(self):
+        assert decode_date('2020-02-29') == date(2020, 2, 29)
+        assert decode_date('-infinity') == '-infinity'
+
+    def test_decode_array(self):
+        assert decode_array('{}') == []
+        assert decode_array('{1,2,NULL}', int) == [1, 2, None]
+        assert decode_array('{{a,b},{"c d","e \\"f\\""}}') == [
+            ['a', 'b'],
+            ['c d', 'e "f"'],
+        ]
+        assert decode_array('[0:1]={1,2}') == '[0:1]={1,2}'
+
+    def test_decode_bytea(self):
+        assert decode_bytea('\\x00ff') == b'\x00\xff'
+
+    def test_get_column_decoders(self):
+        model = sa.Table(
+            'book',
+            sa.MetaData(),
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('title', sa.String),
+            sa.Column('price', sa.Numeric),
+            sa.Column('rating', postgresql.DOUBLE_PRECISION),
+            sa.Column('published', sa.Boolean),
+            sa.Column('created_at', sa.DateTime(timezone=True)),
+            sa.Column('tags', postgresql.ARRAY(sa.Integer)),
+            sa.Column('doc', postgresql.JSONB),
+            sa.Column('status', sa.Enum('new', 'old', name='status')),
+        )
+        decoders = get_column_decoders(model)
+        assert sorted(decoders.keys()) == [
+            'created_at',
+            'doc',
+            'id',
+            'price',
+            'published',
+            'rating',
+            'tags',
+        ]
+        assert decoders['id']('1') == 1
+        assert decoders['price']('1.10') == decimal.Decimal('1.10')
+        assert decoders['rating']('4.5') == 4.5
+        assert decoders['published']('true') is True
+        assert decoders['published']('f') is False
+        assert decoders['tags']('{1,2}') == [1, 2]
+        assert decoders['doc']('{"a": 1}') == {'a': 1}
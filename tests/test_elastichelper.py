@@ -76,3 +76,62 @@ class TestElasticsearchHelper(object):
                             verify_certs=True,
                             connection_class=RequestsHttpConnection,
                         )
+
+    def test_search_keys(self, mocker):
+        with mock.patch(
+            'pgsync.elastichelper.get_elasticsearch_client',
+            return_value=MagicMock(),
+        ):
+            with mock.patch(
+                'pgsync.elastichelper.ElasticHelper._scan',
+                return_value=iter(['1', '2']),
+            ) as mock_scan:
+                es = ElasticHelper()
+                keys = [{'id': 1}, {'id': 2}, {'id': 3}]
+                assert list(es._search_keys('testdb', 'book', keys)) == [
+                    '1',
+                    '2',
+                ]
+                # a single terms query for all the keys
+                mock_scan.assert_called_once_with('testdb', ANY)
+                query = mock_scan.call_args[0][1].to_dict()['query']
+                assert query['bool']['filter'][0]['bool']['should'][0] == {
+                    'terms': {'_meta.book.id': [1, 2, 3]}
+                }
+
+    def test_scan_without_point_in_time(self, mocker):
+        hit = MagicMock()
+        hit.meta.id = '1'
+        with mock.patch(
+            'pgsync.elastichelper.get_elasticsearch_client',
+            return_value=MagicMock(spec=['info']),
+        ):
+            with mock.patch(
+                'pgsync.elastichelper.Search.scan',
+                return_value=iter([hit]),
+            ) as mock_scan:
+                es = ElasticHelper()
+                es.version = [7, 13, 0]
+                # a client without point in time support scrolls
+                assert list(es._search('testdb', 'book', {})) == ['1']
+                mock_scan.assert_called_once_with()
+
+    def test_bulk_done(self, mocker):
+        items = [(True, {'index': {'_id': str(i)}}) for i in range(5)]
+        with mock.patch(
+            'pgsync.elastichelper.get_elasticsearch_client',
+            return_value=MagicMock(),
+        ):
+            with mock.patch(
+                'pgsync.elastichelper.parallel_bulk',
+                return_value=iter(items),
+            ):
+                es = ElasticHelper()
+                done = MagicMock()
+                es.bulk('testdb', [], chunk_size=2, done=done)
+                # the results are passed on a chunk at a time
+                assert done.call_args_list == [
+                    mock.call([item for _, item in items[:2]]),
+                    mock.call([item for _, item in items[2:4]]),
+                    mock.call([item for _, item in items[4:]]),
+                ]
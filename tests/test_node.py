@@ -180,3 +180,13 @@ class TestNode(object):
                 assert node.table == 'subject'
             if i == 8:
                 assert node.table == 'book'
+
+    def test_indexed_columns(self, sync, nodes):
+        tree = Tree(sync)
+        root = tree.build(nodes[0])
+        assert root.indexed_columns == {'isbn', 'title', 'description'}
+        root = tree.build({
+            'table': 'book',
+            'columns': ['isbn', 'tags->0', 'tags#>>{a,b}'],
+        })
+        assert root.indexed_columns == {'isbn', 'tags'}
@@ -0,0 +1,62 @@
+"""Queue backend tests."""
+import pytest
+
+from pgsync.queues import get_queue, MemoryQueue, SQLiteQueue
+
+
+class TestQueues(object):
+    """Queue backend tests."""
+
+    def test_get_queue(self):
+        assert isinstance(get_queue('test', backend='memory'), MemoryQueue)
+        with pytest.raises(ValueError):
+            get_queue('test', backend='kafka')
+
+    def test_memory_queue(self):
+        queue = MemoryQueue('test', maxsize=10)
+        assert queue.pop(timeout=0.01) is None
+        queue.bulk_push([{'id': i} for i in range(3)])
+        queue.bulk_push_raw(['{"id": 3}'])
+        assert queue.qsize() == 4
+        assert queue.pop() == {'id': 0}
+        assert queue.bulk_pop(chunk_size=2) == [{'id': 1}, {'id': 2}]
+        assert queue.bulk_pop() == [{'id': 3}]
+        assert queue.empty()
+        # the producer never waits on a full queue
+        queue.bulk_push([{'id': i} for i in range(20)])
+        assert queue.qsize() == 20
+
+    def test_sqlite_queue(self, tmpdir):
+        queue = SQLiteQueue('test', path=str(tmpdir))
+        assert queue.bulk_reserve(timeout=0.01) == []
+        queue.bulk_push([{'id': i} for i in range(3)])
+        queue.bulk_push_raw(['{"id": 3}'])
+        assert queue.bulk_reserve(chunk_size=2) == [{'id': 0}, {'id': 1}]
+        assert queue.qsize() == 2
+
+        # the items not acknowledged are read again after a restart
+        queue = SQLiteQueue('test', path=str(tmpdir))
+        assert queue.requeue() == 4
+        assert queue.bulk_reserve(chunk_size=3) == [
+            {'id': 0},
+            {'id': 1},
+            {'id': 2},
+        ]
+        queue.ack()
+        assert queue.requeue() == 1
+        assert queue.bulk_pop() == [{'id': 3}]
+        assert queue.empty()
+        queue._delete()
+
+    def test_sqlite_queue_codec(self, tmpdir):
+        queue = SQLiteQueue('test', path=str(tmpdir), codec='tuple')
+        item = {
+            'xmin': 1234,
+            'tg_op': 'INSERT',
+            'schema': 'public',
+            'table': 'book',
+            'new': {'isbn': 'abc'},
+            'old': None,
+        }
+        queue.push(item)
+        assert queue.pop() == item
@@ -1,9 +1,333 @@
 """RedisQueues tests."""
+import time
+
 import pytest
+from mock import patch
+
+from pgsync.constants import CHECKPOINT, DELETE, INSERT, UPDATE
+from pgsync.redisqueue import (
+    RedisCoalescingQueue,
+    RedisQueue,
+    RedisStreamQueue,
+)
 
 
 @pytest.mark.usefixtures('table_creator')
 class TestRedisQueue(object):
     """Redis Queue tests."""
 
-    pass
+    def test_bulk_pop(self):
+        queue = RedisQueue('test')
+        queue._delete()
+        queue.bulk_push([{'id': i} for i in range(5)])
+        assert queue.bulk_pop(chunk_size=2) == [{'id': 0}, {'id': 1}]
+        assert queue.bulk_pop(chunk_size=10) == [
+            {'id': 2},
+            {'id': 3},
+            {'id': 4},
+        ]
+        assert queue.bulk_pop() == []
+        queue._delete()
+
+    def test_reliable_queue(self):
+        queue = RedisQueue('test')
+        queue._delete()
+        queue.bulk_push([{'id': i} for i in range(5)])
+        assert queue.bulk_reserve(chunk_size=3) == [
+            {'id': 0},
+            {'id': 1},
+            {'id': 2},
+        ]
+        assert queue.qsize() == 2
+        # a consumer restarting before the ack gets the items back in order
+        assert queue.requeue() == 3
+        assert queue.bulk_reserve(chunk_size=2) == [{'id': 0}, {'id': 1}]
+        queue.ack()
+        assert queue.requeue() == 0
+        assert queue.bulk_pop() == [{'id': 2}, {'id': 3}, {'id': 4}]
+        queue._delete()
+
+    def test_reliable_queue_consumers(self):
+        queue = RedisQueue('test')
+        queue._delete()
+        other = RedisQueue('test')
+        queue.bulk_push([{'id': i} for i in range(5)])
+        assert other.bulk_reserve(chunk_size=3) == [
+            {'id': 0},
+            {'id': 1},
+            {'id': 2},
+        ]
+        assert queue.bulk_reserve(chunk_size=1) == [{'id': 3}]
+        # the items of a running consumer are left alone
+        assert queue.requeue() == 1
+        assert queue.qsize() == 2
+        # and those of a consumer whose heartbeat expired are requeued
+        with patch('pgsync.redisqueue.REDIS_STREAM_CLAIM_IDLE', 1):
+            other._heartbeat()
+        time.sleep(0.01)
+        assert queue.requeue() == 3
+        assert queue.bulk_pop() == [
+            {'id': 0},
+            {'id': 1},
+            {'id': 2},
+            {'id': 3},
+            {'id': 4},
+        ]
+        queue._delete()
+
+    def test_stream_queue(self):
+        # NB: deleting the streams also deletes their consumer group
+        RedisStreamQueue('test', partitions=4)._delete()
+        queue = RedisStreamQueue(
+            'test',
+            partitions=4,
+            primary_keys=lambda schema, table: ['isbn'],
+        )
+        items = [
+            {
+                'tg_op': INSERT,
+                'schema': 'public',
+                'table': 'book',
+                'new': {'isbn': 'abc'},
+                'old': None,
+            },
+            {
+                'tg_op': UPDATE,
+                'schema': 'public',
+                'table': 'book',
+                'new': {'isbn': 'abc'},
+                'old': {'isbn': 'abc'},
+            },
+            {CHECKPOINT: '0/16B3748'},
+        ]
+        queue.bulk_push(items)
+        # the checkpoint goes to every partition
+        assert queue.qsize() == 6
+        # and the changes of a row to the same one
+        assert queue.partition(items[0]) == queue.partition(items[1])
+        # whichever foreign keys they hold
+        assert queue.partition(items[0]) == queue.partition({
+            'tg_op': UPDATE,
+            'schema': 'public',
+            'table': 'book',
+            'new': {'isbn': 'abc', 'publisher_id': 1},
+            'old': {'isbn': 'abc', 'publisher_id': 2},
+        })
+        # the checkpoints are kept by the queue
+        assert queue.bulk_reserve() == items[:2]
+        # a consumer restarting before the ack gets the items again
+        queue.requeue()
+        assert queue.bulk_reserve() == items[:2]
+        assert queue.checkpoint() is None
+        queue.ack()
+        assert queue.checkpoint() == '0/16B3748'
+        queue.requeue()
+        assert queue.bulk_reserve() == []
+        assert queue.qsize() == 0
+        queue.bulk_push([{CHECKPOINT: '0/16B3750'}])
+        assert queue.bulk_reserve() == []
+        # a batch of checkpoints only is acknowledged at once
+        assert queue.checkpoint() == '0/16B3750'
+        queue._delete()
+
+    def test_stream_queue_backlog(self):
+        RedisStreamQueue('test', partitions=1)._delete()
+        queue = RedisStreamQueue('test', partitions=1)
+        items = [
+            {
+                'tg_op': INSERT,
+                'schema': 'public',
+                'table': 'book',
+                'new': {'isbn': str(i)},
+                'old': None,
+            }
+            for i in range(3)
+        ]
+        queue.bulk_push(items)
+        assert queue.bulk_reserve() == items
+        queue.requeue()
+        # the pending entries are read once across the reserves of a batch
+        assert queue.bulk_reserve(chunk_size=2) == items[:2]
+        assert queue.bulk_reserve(chunk_size=2) == items[2:]
+        assert queue.bulk_reserve() == []
+        queue.ack()
+        assert queue.qsize() == 0
+        queue._delete()
+
+    def test_stream_queue_checkpoint(self):
+        RedisStreamQueue('test', partitions=2)._delete()
+        queues = [
+            RedisStreamQueue('test', partitions=2, consumer=i, consumers=2)
+            for i in range(2)
+        ]
+        for queue in queues + queues:
+            queue.requeue()
+        queues[0].bulk_push([{CHECKPOINT: '0/16B3748'}])
+        assert queues[0].bulk_reserve() == []
+        assert queues[0].checkpoint() is None
+        assert queues[1].bulk_reserve() == []
+        assert queues[0].checkpoint() == '0/16B3748'
+        # the partitions are only synced up to the oldest checkpoint
+        queues[0].bulk_push([{CHECKPOINT: '1/0'}])
+        queues[0].bulk_reserve()
+        assert queues[0].checkpoint() == '0/16B3748'
+        queues[1].bulk_reserve()
+        assert queues[0].checkpoint() == '1/0'
+        queues[0]._delete()
+
+    def test_stream_queue_consumers(self):
+        RedisStreamQueue('test', partitions=4)._delete()
+        queue = RedisStreamQueue(
+            'test',
+            partitions=4,
+            consumer=1,
+            consumers=2,
+        )
+        assert queue.consumer == 'consumer-1'
+        # the partitions of the other consumer are taken over while it is
+        # not running
+        queue.requeue()
+        assert queue.streams == [
+            'stream:test:0',
+            'stream:test:1',
+            'stream:test:2',
+            'stream:test:3',
+        ]
+        item = {
+            'tg_op': INSERT,
+            'schema': 'public',
+            'table': 'book',
+            'new': {'isbn': 'abc'},
+            'old': None,
+        }
+        queue.bulk_push([item])
+        assert queue.bulk_reserve() == [item]
+        # and handed back to it once it is running
+        other = RedisStreamQueue(
+            'test',
+            partitions=4,
+            consumer=0,
+            consumers=2,
+        )
+        other.requeue()
+        assert other.streams == []
+        queue.ack()
+        queue.requeue()
+        assert queue.streams == ['stream:test:1', 'stream:test:3']
+        other.requeue()
+        assert other.streams == ['stream:test:0', 'stream:test:2']
+        queue._delete()
+        with pytest.raises(ValueError):
+            RedisStreamQueue('test', partitions=4, consumer=2, consumers=2)
+
+    def test_stream_queue_takeover(self):
+        RedisStreamQueue('test', partitions=2)._delete()
+        queues = [
+            RedisStreamQueue('test', partitions=2, consumer=i, consumers=2)
+            for i in range(2)
+        ]
+        for queue in queues + queues:
+            queue.requeue()
+        item = {
+            'tg_op': INSERT,
+            'schema': 'public',
+            'table': 'book',
+            'new': {'isbn': 'abc'},
+            'old': None,
+        }
+        queues[0].bulk_push([item])
+        stream = queues[0].partition(item)
+        consumer = queues[0] if stream in queues[0].streams else queues[1]
+        other = queues[1] if consumer is queues[0] else queues[0]
+        assert consumer.bulk_reserve() == [item]
+        assert other.bulk_reserve() == []
+        # the consumer stops before the ack and its leases expire
+        with patch('pgsync.redisqueue.REDIS_STREAM_CLAIM_IDLE', 1):
+            consumer.requeue()
+        time.sleep(0.01)
+        # the other consumer claims the item left pending
+        assert other.requeue() == 1
+        assert other.streams == ['stream:test:0', 'stream:test:1']
+        assert other.bulk_reserve() == [item]
+        other.ack()
+        assert other.qsize() == 0
+        other._delete()
+
+    def test_stream_queue_lock(self):
+        RedisStreamQueue('test', partitions=2)._delete()
+        queues = [
+            RedisStreamQueue('test', partitions=2, consumer=i, consumers=2)
+            for i in range(2)
+        ]
+        queues[0].lock(['1', '2'])
+        # a document is locked by one consumer at a time
+        with patch('pgsync.redisqueue.time.sleep', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                queues[1].lock(['2', '3'])
+        queues[1].lock(['3'])
+        queues[0].unlock()
+        queues[1].lock(['1', '2'])
+        queues[1].unlock()
+        queues[0]._delete()
+
+    def test_coalescing_queue(self):
+        queue = RedisCoalescingQueue(
+            'test', primary_keys=lambda schema, table: ['isbn']
+        )
+        queue._delete()
+
+        def change(tg_op, new=None, old=None):
+            return {
+                'xmin': 1234,
+                'tg_op': tg_op,
+                'schema': 'public',
+                'table': 'book',
+                'new': new,
+                'old': old,
+            }
+
+        queue.bulk_push(
+            [
+                change(INSERT, new={'isbn': 'a', 'publisher_id': 1}),
+                change(
+                    UPDATE,
+                    new={'isbn': 'a', 'publisher_id': 2},
+                    old={'isbn': 'a', 'publisher_id': 1},
+                ),
+                change(INSERT, new={'isbn': 'b', 'publisher_id': 1}),
+                change(DELETE, old={'isbn': 'b'}),
+                change(
+                    UPDATE,
+                    new={'isbn': 'c', 'publisher_id': 2},
+                    old={'isbn': 'c', 'publisher_id': 1},
+                ),
+                {CHECKPOINT: '0/16B3748'},
+            ]
+        )
+        queue.push(
+            change(
+                UPDATE,
+                new={'isbn': 'c', 'publisher_id': 3},
+                old={'isbn': 'c', 'publisher_id': 2},
+            )
+        )
+        # the DELETE of a row with a pending UPDATE is not merged
+        queue.push(change(DELETE, old={'isbn': 'c'}))
+        assert queue.qsize() == 4
+        assert queue.bulk_pop() == [
+            # the INSERT of the updated row
+            change(INSERT, new={'isbn': 'a', 'publisher_id': 2}),
+            # the UPDATE from the first old row to the last new row
+            change(
+                UPDATE,
+                new={'isbn': 'c', 'publisher_id': 3},
+                old={'isbn': 'c', 'publisher_id': 1},
+            ),
+            {CHECKPOINT: '0/16B3748'},
+            change(DELETE, old={'isbn': 'c'}),
+        ]
+        # a change after the pop is not merged with the popped one
+        queue.push(change(DELETE, old={'isbn': 'a'}))
+        assert queue.bulk_pop() == [change(DELETE, old={'isbn': 'a'})]
+        assert queue.empty()
+        queue._delete()
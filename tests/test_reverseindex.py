@@ -0,0 +1,71 @@
+"""Reverse index tests."""
+from pgsync.reverseindex import ReverseIndex
+
+
+class TestReverseIndex(object):
+    """Reverse index tests."""
+
+    def test_lookup(self, tmpdir):
+        index = ReverseIndex('test', path=str(tmpdir))
+        index.update([
+            (
+                '1',
+                {
+                    'author': {'id': [1, 2]},
+                    'book_author': {'book_isbn': ['a'], 'author_id': [1]},
+                },
+            ),
+            ('2', {'author': {'id': [2]}}),
+        ])
+        assert index.lookup('author', [{'id': 1}]) == {'1'}
+        assert index.lookup('author', [{'id': 1}, {'id': 2}]) == {'1', '2'}
+        # every column of a composite key must match
+        assert index.lookup(
+            'book_author', [{'book_isbn': 'a', 'author_id': 1}]
+        ) == {'1'}
+        assert index.lookup(
+            'book_author', [{'book_isbn': 'a', 'author_id': 2}]
+        ) == set()
+        # and without keys, any row of the table matches
+        assert index.lookup('author', []) == {'1', '2'}
+
+        # syncing a document replaces its keys
+        index.update([('1', {'author': {'id': [3]}})])
+        assert index.lookup('author', [{'id': 1}]) == set()
+        index.delete(['2'])
+        assert index.lookup('author', [{'id': 2}]) == set()
+
+    def test_lookup_values(self, tmpdir):
+        index = ReverseIndex('test', path=str(tmpdir))
+        index.update([
+            ('1', {'book': {'isbn': ['1']}}),
+            ('2', {'book': {'isbn': [1]}}),
+            ('3', {'book': {'isbn': ['a"b']}}),
+        ])
+        # values of different types never match
+        assert index.lookup('book', [{'isbn': '1'}]) == {'1'}
+        assert index.lookup('book', [{'isbn': 1}]) == {'2'}
+        assert index.lookup('book', [{'isbn': 'a"b'}]) == {'3'}
+
+    def test_encoding(self, tmpdir):
+        index = ReverseIndex('test', path=str(tmpdir))
+        index.update([('1', {'author': {'id': [1]}})])
+        index.complete = True
+        assert ReverseIndex('test', path=str(tmpdir)).complete is True
+        index._ReverseIndex__db.execute(
+            "UPDATE state SET value = 'text' WHERE key = 'encoding'"
+        )
+        index._ReverseIndex__db.commit()
+        # an index stored with another encoding is rebuilt
+        index = ReverseIndex('test', path=str(tmpdir))
+        assert index.complete is False
+        assert index.lookup('author', []) == set()
+
+    def test_complete(self, tmpdir):
+        index = ReverseIndex('test', path=str(tmpdir))
+        assert index.complete is False
+        index.complete = True
+        # the state is kept across restarts
+        assert ReverseIndex('test', path=str(tmpdir)).complete is True
+        index._drop()
+        assert index.complete is False
@@ -1,8 +1,30 @@
 """Node tests."""
+import asyncio
+import json
+import os
+import socket
+import threading
 from collections import namedtuple
 
 import pytest
-from mock import patch
+from mock import ANY, call, MagicMock, patch, PropertyMock
+
+from pgsync.constants import (
+    CHECKPOINT,
+    DELETE,
+    INSERT,
+    RESYNC,
+    SPILL_TABLE,
+    TRUNCATE,
+    UPDATE,
+)
+from pgsync.queues import MemoryQueue
+from pgsync.reverseindex import ReverseIndex
+from pgsync.settings import (
+    LOGICAL_SLOT_CHUNK_SIZE,
+    REDIS_BLOCK_TIMEOUT,
+    REDIS_CHUNK_SIZE,
+)
 
 ROW = namedtuple('Row', ['data', 'xid'])
 
@@ -16,29 +38,45 @@ class TestSync(object):
             mock_peek.return_value = [
                 ROW('BEGIN: blah', 1234),
             ]
-            with patch('pgsync.sync.Sync.sync_payloads') as mock_sync_payloads:
-                sync.logical_slot_changes()
-                mock_peek.assert_called_once_with(
-                    'testdb_testdb',
-                    txmin=None,
-                    txmax=None,
-                    upto_nchanges=None,
-                )
-                mock_sync_payloads.assert_not_called()
+            with patch(
+                'pgsync.sync.Sync.logical_slot_count_changes',
+                return_value=1,
+            ):
+                with patch(
+                    'pgsync.sync.Sync._sync_roots'
+                ) as mock_sync_roots:
+                    sync.logical_slot_changes()
+                    mock_peek.assert_called_once_with(
+                        'testdb_testdb',
+                        txmin=None,
+                        txmax=None,
+                        upto_lsn=ANY,
+                        upto_nchanges=LOGICAL_SLOT_CHUNK_SIZE,
+                        tables=sync.document_tables,
+                    )
+                    mock_sync_roots.assert_called_once_with({}, {})
 
         with patch('pgsync.sync.Sync.logical_slot_peek_changes') as mock_peek:
             mock_peek.return_value = [
                 ROW('COMMIT: blah', 1234),
             ]
-            with patch('pgsync.sync.Sync.sync_payloads') as mock_sync_payloads:
-                sync.logical_slot_changes()
-                mock_peek.assert_called_once_with(
-                    'testdb_testdb',
-                    txmin=None,
-                    txmax=None,
-                    upto_nchanges=None,
-                )
-                mock_sync_payloads.assert_not_called()
+            with patch(
+                'pgsync.sync.Sync.logical_slot_count_changes',
+                return_value=1,
+            ):
+                with patch(
+                    'pgsync.sync.Sync._sync_roots'
+                ) as mock_sync_roots:
+                    sync.logical_slot_changes()
+                    mock_peek.assert_called_once_with(
+                        'testdb_testdb',
+                        txmin=None,
+                        txmax=None,
+                        upto_lsn=ANY,
+                        upto_nchanges=LOGICAL_SLOT_CHUNK_SIZE,
+                        tables=sync.document_tables,
+                    )
+                    mock_sync_roots.assert_called_once_with({}, {})
 
         with patch('pgsync.sync.Sync.logical_slot_peek_changes') as mock_peek:
             mock_peek.return_value = [
@@ -50,14 +88,485 @@ class TestSync(object):
                     1234
                 ),
             ]
-            with patch('pgsync.sync.Sync.logical_slot_get_changes') as mock_get:
-                with patch('pgsync.sync.Sync.sync_payloads') as mock_sync_payloads:
+            with patch(
+                'pgsync.sync.Sync.logical_slot_count_changes',
+                return_value=1,
+            ) as mock_count:
+                with patch(
+                    'pgsync.sync.Sync._sync_roots'
+                ) as mock_sync_roots:
                     sync.logical_slot_changes()
                     mock_peek.assert_called_once_with(
                         'testdb_testdb',
                         txmin=None,
                         txmax=None,
-                        upto_nchanges=None,
+                        upto_lsn=ANY,
+                        upto_nchanges=LOGICAL_SLOT_CHUNK_SIZE,
+                        tables=sync.document_tables,
+                    )
+                    mock_count.assert_called_once()
+                    # the changes are compacted into the root documents
+                    mock_sync_roots.assert_called_once_with(
+                        {'888': {'isbn': '888'}}, {}
+                    )
+
+    def test_logical_slot_changes_windows(self, sync):
+        with patch('pgsync.sync.Sync.logical_slot_peek_changes') as mock_peek:
+            mock_peek.return_value = []
+            with patch(
+                'pgsync.sync.Sync.logical_slot_count_changes',
+                side_effect=[2, 2, 1],
+            ) as mock_count:
+                sync.logical_slot_changes(upto_nchanges=2)
+                assert mock_peek.call_count == 3
+                assert mock_count.call_count == 3
+
+    def test_checkpoint(self, sync):
+        sync.checkpoint = '0/16B3748'
+        assert sync.checkpoint == '0/16B3748'
+        # the checkpoint never goes back
+        sync.checkpoint = '0/16B3740'
+        assert sync.checkpoint == '0/16B3748'
+        sync.checkpoint = '1/0'
+        assert sync.checkpoint == '1/0'
+        # txid checkpoint of older versions
+        sync.checkpoint = 1234
+        assert sync.checkpoint == 1234
+        with pytest.raises(ValueError):
+            sync.checkpoint = None
+        os.unlink(sync._checkpoint_file)
+
+    def test_on_publish_checkpoint(self, sync):
+        payloads = [
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'isbn': 1}},
+            {CHECKPOINT: '0/16B3748'},
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'isbn': 2}},
+            {CHECKPOINT: '0/16B3800'},
+        ]
+        with patch('pgsync.sync.Sync._sync_roots') as mock_sync_roots:
+            sync.on_publish(payloads)
+            mock_sync_roots.assert_called_once_with(
+                {'1': {'isbn': 1}, '2': {'isbn': 2}}, {}
+            )
+        assert sync.checkpoint == '0/16B3800'
+        os.unlink(sync._checkpoint_file)
+
+    def test_pull(self, sync):
+        # the first pull syncs everything
+        with patch('pgsync.sync.Sync.sync') as mock_sync:
+            with patch('pgsync.sync.Sync.logical_slot_changes') as mock_slot:
+                sync.pull()
+                mock_sync.assert_called_once_with(txmin=None)
+                mock_slot.assert_called_once_with()
+
+        # and after that, we resume from the checkpoint
+        sync.checkpoint = '0/16B3748'
+        with patch('pgsync.sync.Sync.sync') as mock_sync:
+            with patch(
+                'pgsync.sync.Sync.logical_slot_count_changes'
+            ) as mock_count:
+                with patch('pgsync.sync.Sync.logical_slot_changes'):
+                    sync.pull()
+                    mock_sync.assert_not_called()
+                    mock_count.assert_called_once_with(
+                        'testdb_testdb',
+                        upto_lsn='0/16B3748',
+                        tables=sync.document_tables,
+                    )
+        os.unlink(sync._checkpoint_file)
+
+    def test_poll_spill_tables(self, sync):
+        notifications = [
+            {'tg_op': INSERT, 'table': 'book', 'new': {'id': 1}, 'old': None},
+            {
+                'tg_op': INSERT,
+                'table': 'book',
+                'new': [{'id': 2}, {'id': 3}],
+                'old': None,
+            },
+        ]
+
+        def pop_notifications(schema, table, name, callback):
+            assert table == SPILL_TABLE
+            # only the notifications of this document
+            assert name == sync._Sync__name
+            callback(notifications)
+
+        with patch(
+            'pgsync.sync.Sync.pop_notifications',
+            side_effect=pop_notifications,
+        ):
+            with patch('pgsync.redisqueue.RedisQueue.bulk_push') as mock_push:
+                assert sync.poll_spill_tables() == 2
+                mock_push.assert_called_once_with(notifications)
+
+    def test_on_publish_statement_notifications(self, sync):
+        payloads = [
+            {
+                'tg_op': INSERT,
+                'table': 'book',
+                'new': [{'isbn': 1}, {'isbn': 2}],
+                'old': None,
+            },
+        ]
+        with patch('pgsync.sync.Sync._sync_roots') as mock_sync_roots:
+            sync.on_publish(payloads)
+            mock_sync_roots.assert_called_once_with(
+                {'1': {'isbn': 1}, '2': {'isbn': 2}}, {}
+            )
+
+    def test_on_publish_compaction(self, sync):
+        payloads = [
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'isbn': 1}},
+            {
+                'tg_op': UPDATE,
+                'table': 'book',
+                'old': {'isbn': 2},
+                'new': {'isbn': 3},
+            },
+            {'tg_op': DELETE, 'table': 'book', 'old': {'isbn': 1}, 'new': {}},
+            {'tg_op': TRUNCATE, 'table': 'book', 'old': None, 'new': None},
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'isbn': 1}},
+        ]
+        with patch('pgsync.sync.Sync._sync_roots') as mock_sync_roots:
+            with patch(
+                'pgsync.sync.Sync._lookup',
+                return_value=['3'],
+            ) as mock_lookup:
+                sync.on_publish(payloads)
+                # the TRUNCATE deletes every document
+                mock_lookup.assert_called_once_with('book', [])
+            # only the last change to each document is synced
+            mock_sync_roots.assert_called_once_with(
+                {'1': {'isbn': 1}, '2': None, '3': None}, {}
+            )
+
+    def test_sync_changes_parent_keys(self, sync):
+        payloads = [
+            {
+                'tg_op': INSERT,
+                'schema': 'public',
+                'table': 'author',
+                'old': {},
+                'new': {'id': i, 'book_isbn': i},
+            } for i in range(3)
+        ]
+        with patch.object(sync.tree, 'nodes', {'book', 'author'}):
+            with patch(
+                'pgsync.sync.Sync._root_parent_keys',
+                return_value=[(['isbn'], ['book_isbn'])],
+            ) as mock_parent_keys:
+                with patch('pgsync.sync.Sync._sync_roots') as mock_sync_roots:
+                    sync._sync_changes(payloads)
+        # the parent keys are resolved once per table
+        mock_parent_keys.assert_called_once()
+        mock_sync_roots.assert_called_once_with(
+            {'0': {'isbn': 0}, '1': {'isbn': 1}, '2': {'isbn': 2}}, {}
+        )
+
+    def test_async_poll_redis(self, sync):
+        payload = {'tg_op': INSERT, 'table': 'book', 'new': {'id': 1}}
+        with patch(
+            'pgsync.redisqueue.RedisQueue.pop',
+            side_effect=[None, payload, RuntimeError],
+        ):
+            with patch(
+                'pgsync.redisqueue.RedisQueue.bulk_pop',
+                return_value=[],
+            ):
+                with patch('pgsync.sync.Sync.on_publish') as mock_on_publish:
+                    loop = asyncio.new_event_loop()
+                    with pytest.raises(RuntimeError):
+                        loop.run_until_complete(sync.async_poll_redis())
+                    loop.close()
+                    mock_on_publish.assert_called_once_with([payload])
+
+    def test_add_db_reader(self, sync):
+        conn, other = socket.socketpair()
+        threads = []
+
+        def _on_notify(conn):
+            threads.append(threading.current_thread())
+            conn.recv(1)
+            sync._notify_buffer.append('{}')
+
+        loop = asyncio.new_event_loop()
+        with patch('pgsync.sync.Sync._listen', return_value=conn):
+            with patch('pgsync.sync.Sync._on_notify', side_effect=_on_notify):
+                with patch('pgsync.sync.Sync.poll_spill_tables'):
+                    with patch('pgsync.sync.REDIS_WRITE_INTERVAL', 0):
+                        with patch(
+                            'pgsync.redisqueue.RedisQueue.bulk_push_raw'
+                        ) as mock_push_raw:
+                            sync.add_db_reader(loop)
+                            other.send(b'x')
+                            loop.run_until_complete(asyncio.sleep(0.1))
+                            mock_push_raw.assert_called_once_with(['{}'])
+        # the notifications are read off the event loop
+        assert len(threads) == 1
+        assert threads[0] is not threading.main_thread()
+        loop.remove_reader(conn)
+        loop.close()
+        conn.close()
+        other.close()
+
+    def test_add_db_reader_error(self, sync):
+        conn, other = socket.socketpair()
+
+        def _on_notify(conn):
+            conn.recv(1)
+            sync._notify_buffer.append('{}')
+
+        loop = asyncio.new_event_loop()
+        with patch('pgsync.sync.Sync._listen', return_value=conn):
+            with patch('pgsync.sync.Sync._on_notify', side_effect=_on_notify):
+                with patch('pgsync.sync.Sync.poll_spill_tables'):
+                    with patch('pgsync.sync.REDIS_WRITE_INTERVAL', 0):
+                        with patch(
+                            'pgsync.redisqueue.RedisQueue.bulk_push_raw',
+                            side_effect=[RuntimeError, None, None],
+                        ) as mock_push_raw:
+                            sync.add_db_reader(loop)
+                            other.send(b'x')
+                            # retried after POLL_TIMEOUT
+                            loop.run_until_complete(asyncio.sleep(0.5))
+                            # the notifications are pushed again
+                            assert mock_push_raw.call_args_list == [
+                                call(['{}']),
+                                call(['{}']),
+                            ]
+                            # and the connection is still read
+                            other.send(b'x')
+                            loop.run_until_complete(asyncio.sleep(0.1))
+                            assert mock_push_raw.call_count == 3
+        loop.remove_reader(conn)
+        loop.close()
+        conn.close()
+        other.close()
+
+    def test_on_notify_idle(self, sync):
+        conn = MagicMock(notifies=[])
+        sync._notify_lsn = '0/16B3748'
+        with patch(
+            'pgsync.sync.Sync.current_wal_lsn',
+            new_callable=PropertyMock,
+            return_value='0/16B3800',
+        ):
+            # the checkpoint moves on while no notifications arrive
+            assert sync._on_notify(conn) == 0
+            assert sync._notify_buffer == [
+                json.dumps({CHECKPOINT: '0/16B3748'})
+            ]
+            sync._notify_buffer = []
+            sync._on_notify(conn)
+            assert sync._notify_buffer == [
+                json.dumps({CHECKPOINT: '0/16B3800'})
+            ]
+            sync._notify_buffer = []
+            # once for each WAL location
+            sync._on_notify(conn)
+            assert sync._notify_buffer == []
+        sync._notify_lsn = None
+        sync._notify_checkpoint = None
+        sync._notify_deadline = None
+
+    def test_pop_redis(self, sync):
+        # an idle consumer blocks on Redis
+        with patch(
+            'pgsync.redisqueue.RedisQueue.pop',
+            return_value=None,
+        ) as mock_pop:
+            with patch(
+                'pgsync.redisqueue.RedisQueue.bulk_pop'
+            ) as mock_bulk_pop:
+                assert sync._pop_redis() == []
+                mock_pop.assert_called_once_with(timeout=REDIS_BLOCK_TIMEOUT)
+                mock_bulk_pop.assert_not_called()
+
+        # and a busy one reads the rest of the batch right away
+        payloads = [{'id': 1}, {'id': 2}]
+        with patch(
+            'pgsync.redisqueue.RedisQueue.pop',
+            return_value=payloads[0],
+        ):
+            with patch(
+                'pgsync.redisqueue.RedisQueue.bulk_pop',
+                return_value=payloads[1:],
+            ) as mock_bulk_pop:
+                assert sync._pop_redis() == payloads
+                mock_bulk_pop.assert_called_once_with(
+                    chunk_size=REDIS_CHUNK_SIZE - 1
+                )
+
+    def test_on_publish_resync(self, sync):
+        payloads = [
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'id': 1}},
+            {RESYNC: '0/16B3748'},
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'id': 2}},
+        ]
+        with patch('pgsync.sync.Sync._root_changes', return_value=None):
+            with patch(
+                'pgsync.sync.Sync.sync_payloads'
+            ) as mock_sync_payloads:
+                with patch('pgsync.sync.Sync.resync') as mock_resync:
+                    sync.on_publish(payloads)
+                    mock_resync.assert_called_once_with('0/16B3748')
+                assert mock_sync_payloads.call_args_list == [
+                    call([payloads[0]]),
+                    call([payloads[2]]),
+                ]
+
+    def test_backpressure(self, sync):
+        sync._notify_lsn = '0/16B3748'
+        with patch('pgsync.sync.REDIS_HIGH_WATERMARK', 10):
+            with patch('pgsync.sync.REDIS_LOW_WATERMARK', 2):
+                with patch(
+                    'pgsync.redisqueue.RedisQueue.qsize',
+                    side_effect=[10, 5, 2],
+                ):
+                    with patch(
+                        'pgsync.redisqueue.RedisQueue.bulk_push_raw'
+                    ) as mock_push_raw:
+                        with patch(
+                            'pgsync.redisqueue.RedisQueue.push'
+                        ) as mock_push:
+                            # changes are dropped above the high watermark
+                            sync._notify_buffer = ['{}']
+                            sync._flush_notifications()
+                            assert sync._resync_lsn == '0/16B3748'
+                            # until the queue is drained to the low one
+                            sync._notify_buffer = ['{}']
+                            sync._flush_notifications()
+                            mock_push_raw.assert_not_called()
+                            sync._notify_buffer = ['{}']
+                            sync._flush_notifications()
+                            mock_push.assert_called_once_with(
+                                {RESYNC: '0/16B3748'}
+                            )
+                            mock_push_raw.assert_called_once_with(['{}'])
+                            assert sync._resync_lsn is None
+        sync._notify_lsn = None
+
+    def test_backpressure_memory_queue(self, sync):
+        redis = sync.redis
+        sync.redis = MemoryQueue('test', maxsize=4)
+        sync._notify_lsn = '0/16B3748'
+        # changes are dropped once the queue is full
+        sync._notify_buffer = ['{}'] * 4
+        sync._flush_notifications()
+        sync._notify_buffer = ['{}']
+        sync._flush_notifications()
+        assert sync.redis.qsize() == 4
+        assert sync._resync_lsn == '0/16B3748'
+        # until it is drained to half of it
+        sync.redis.bulk_pop(chunk_size=2)
+        sync._notify_buffer = ['{}']
+        sync._flush_notifications()
+        assert sync.redis.bulk_pop()[-2:] == [{RESYNC: '0/16B3748'}, {}]
+        assert sync._resync_lsn is None
+        sync.redis = redis
+        sync._notify_lsn = None
+
+    def test_sync_roots_lookups(self, sync):
+        lookups = {'book_author': {(1,): {'id': 1}, (2,): {'id': 2}}}
+        with patch(
+            'pgsync.elastichelper.ElasticHelper._search_keys',
+            return_value=['1', '2'],
+        ) as mock_search_keys:
+            with patch('pgsync.sync.Sync._sync', return_value=[]) as mock_sync:
+                with patch('pgsync.elastichelper.ElasticHelper.bulk'):
+                    sync._sync_roots({'1': None}, lookups)
+                    # the root documents are looked up in one search
+                    mock_search_keys.assert_called_once_with(
+                        'testdb', 'book_author', [{'id': 1}, {'id': 2}]
                     )
-                    mock_get.assert_called_once()
-                    mock_sync_payloads.assert_called_once()
+                    # and the deleted one is not synced
+                    mock_sync.assert_called_once_with(
+                        sync.nodes,
+                        'testdb',
+                        filters={'book': [{'isbn': '2'}]},
+                    )
+
+    def test_sync_roots_lock(self, sync):
+        with patch('pgsync.sync.Sync._sync', return_value=[]):
+            with patch('pgsync.elastichelper.ElasticHelper.bulk'):
+                with patch('pgsync.sync.Sync._lock') as mock_lock:
+                    with patch('pgsync.sync.Sync._unlock') as mock_unlock:
+                        # the documents are locked while they are synced
+                        sync._sync_roots({'1': None, '2': {'isbn': '2'}})
+                        mock_lock.assert_called_once_with(
+                            {'1': None, '2': {'isbn': '2'}}
+                        )
+                        mock_unlock.assert_called_once_with()
+
+    def test_sync_payloads_locked(self, sync):
+        payloads = [
+            {'tg_op': INSERT, 'table': 'book', 'old': {}, 'new': {'isbn': 1}},
+        ]
+        docs = [{'_id': '1'}, {'_id': '2'}]
+        with patch(
+            'pgsync.sync.Sync._payloads',
+            side_effect=[[docs[:1]], [docs], [docs]],
+        ) as mock_payloads:
+            with patch('pgsync.elastichelper.ElasticHelper.bulk') as mock_bulk:
+                with patch('pgsync.sync.Sync._lock') as mock_lock:
+                    with patch('pgsync.sync.Sync._unlock'):
+                        sync._sync_payloads_locked(payloads)
+                        # rendered again until every document is locked
+                        assert mock_payloads.call_count == 3
+                        assert mock_lock.call_args_list == [
+                            call({'1'}),
+                            call({'1', '2'}),
+                        ]
+                        mock_bulk.assert_called_once_with('testdb', docs)
+
+    def test_sync_roots_reverse_index(self, sync, tmpdir):
+        sync.reverse_index = ReverseIndex('test', path=str(tmpdir))
+        sync.reverse_index.update([('1', {'author': {'id': [1]}})])
+
+        def _sync(*args, **kwargs):
+            sync._private_keys['2'] = {'author': {'id': [2]}}
+            yield {'_id': '2'}
+
+        def _fail(index, docs, done=None):
+            list(docs)
+            raise RuntimeError
+
+        with patch('pgsync.sync.Sync._sync', side_effect=_sync):
+            with patch(
+                'pgsync.elastichelper.ElasticHelper.bulk',
+                side_effect=_fail,
+            ):
+                with pytest.raises(RuntimeError):
+                    sync._sync_roots({'1': None, '2': {'isbn': '2'}})
+            # nothing changes in the reverse index when the bulk fails
+            assert sync.reverse_index.lookup('author', []) == {'1'}
+            assert sync._private_keys == {}
+
+            def _bulk(index, docs, done=None):
+                done([
+                    {'delete' if doc['_id'] == '1' else 'index': doc}
+                    for doc in docs
+                ])
+
+            with patch(
+                'pgsync.elastichelper.ElasticHelper.bulk',
+                side_effect=_bulk,
+            ):
+                sync._sync_roots({'1': None, '2': {'isbn': '2'}})
+            assert sync.reverse_index.lookup('author', []) == {'2'}
+        sync.reverse_index = None
+
+    def test_lookup_reverse_index(self, sync, tmpdir):
+        sync.reverse_index = ReverseIndex('test', path=str(tmpdir))
+        sync.reverse_index.update([('1', {'author': {'id': [1]}})])
+        with patch(
+            'pgsync.elastichelper.ElasticHelper._search_keys',
+            return_value=['2'],
+        ) as mock_search_keys:
+            # Elasticsearch is searched until a full sync
+            assert list(sync._lookup('author', [{'id': 1}])) == ['2']
+            sync.reverse_index.complete = True
+            assert sync._lookup('author', [{'id': 1}]) == {'1'}
+            mock_search_keys.assert_called_once()
+        sync.reverse_index = None
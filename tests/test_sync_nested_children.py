@@ -730,6 +730,7 @@ class TestNestedChildren(object):
         # 1. sync first to add the initial document
         sync = Sync(document)
         sync.sync()
+        txmin = sync.txid_current
 
         session = sync.session
 
@@ -741,7 +742,6 @@ class TestNestedChildren(object):
             session.add_all(book_subjects)
             session.add_all(book_shelves)
 
-        txmin = sync.checkpoint
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -857,6 +857,7 @@ class TestNestedChildren(object):
         # 1. sync first to add the initial document
         sync = Sync(document)
         sync.sync()
+        txmin = sync.txid_current
 
         session = sync.session
 
@@ -867,7 +868,6 @@ class TestNestedChildren(object):
                 ).values(description='xcaliber')
             )
 
-        txmin = sync.checkpoint
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -963,9 +963,8 @@ class TestNestedChildren(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -999,6 +998,8 @@ class TestNestedChildren(object):
                 )
                 session.commit()
 
+        # the txid before the changes
+        txmin = sync.txid_current
         with mock.patch('pgsync.sync.Sync.poll_redis', side_effect=poll_redis):
             with mock.patch('pgsync.sync.Sync.poll_db', side_effect=poll_db):
                 with mock.patch('pgsync.sync.Sync.pull', side_effect=pull):
@@ -1009,7 +1010,15 @@ class TestNestedChildren(object):
                         sync.receive()
                         sync.es.refresh('testdb')
 
-        txmin = sync.checkpoint
+        # the changes were drained from the slot up to the checkpoint
+        assert list(
+            sync.logical_slot_peek_changes(
+                f'{sync.database}_testdb',
+                upto_lsn=sync.checkpoint,
+                tables=sync.document_tables,
+            )
+        ) == []
+        # and none of the other root documents changed
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -1824,6 +1833,7 @@ class TestNestedChildren(object):
         # 1. sync first to add the initial document
         sync = Sync(document)
         sync.sync()
+        txmin = sync.txid_current
         sync.es.refresh('testdb')
 
         docs = search(sync.es, 'testdb')
@@ -1834,7 +1844,6 @@ class TestNestedChildren(object):
         with subtransactions(session):
             session.add(city)
 
-        txmin = sync.checkpoint
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -1859,6 +1868,7 @@ class TestNestedChildren(object):
         # 1. sync first to add the initial document
         sync = Sync(document)
         sync.sync()
+        txmin = sync.txid_current
         sync.es.refresh('testdb')
 
         docs = search(sync.es, 'testdb')
@@ -1873,7 +1883,6 @@ class TestNestedChildren(object):
                 ).values(shelf='Shelf Y')
             )
 
-        txmin = sync.checkpoint
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -1898,6 +1907,7 @@ class TestNestedChildren(object):
         # 1. sync first to add the initial document
         sync = Sync(document)
         sync.sync()
+        txmin = sync.txid_current
         sync.es.refresh('testdb')
 
         docs = search(sync.es, 'testdb')
@@ -1912,7 +1922,6 @@ class TestNestedChildren(object):
                 )
             )
 
-        txmin = sync.checkpoint
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -2089,9 +2098,8 @@ class TestNestedChildren(object):
         sync.es.refresh('testdb')
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -2100,6 +2108,8 @@ class TestNestedChildren(object):
             with subtransactions(session):
                 session.add(country)
 
+        # the txid before the changes
+        txmin = sync.txid_current
         with mock.patch('pgsync.sync.Sync.poll_redis', side_effect=poll_redis):
             with mock.patch('pgsync.sync.Sync.poll_db', side_effect=poll_db):
                 with mock.patch('pgsync.sync.Sync.pull', side_effect=pull):
@@ -2110,7 +2120,15 @@ class TestNestedChildren(object):
                         sync.receive()
                         sync.es.refresh('testdb')
 
-        txmin = sync.checkpoint
+        # the changes were drained from the slot up to the checkpoint
+        assert list(
+            sync.logical_slot_peek_changes(
+                f'{sync.database}_testdb',
+                upto_lsn=sync.checkpoint,
+                tables=sync.document_tables,
+            )
+        ) == []
+        # and none of the other root documents changed
         docs = [
             doc for doc in sync._sync(
                 nodes, 'testdb', txmin=txmin
@@ -99,11 +99,10 @@ class TestRoot(object):
             'table': 'book',
             'columns': ['isbn', 'title', 'description']
         }]
-        txmin = sync.checkpoint
         txmax = sync.txid_current
         docs = [
             doc for doc in sync._sync(
-                nodes, 'testdb', txmin=txmin, txmax=txmax
+                nodes, 'testdb', txmax=txmax
             )
         ]
         assert docs == [
@@ -517,9 +516,8 @@ class TestRoot(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -753,9 +751,8 @@ class TestRoot(object):
         ]
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -838,9 +835,8 @@ class TestRoot(object):
         ]
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
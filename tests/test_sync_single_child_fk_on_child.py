@@ -769,9 +769,8 @@ class TestParentSingleChildFkOnChild(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -1077,9 +1076,8 @@ class TestParentSingleChildFkOnChild(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -1179,9 +1177,8 @@ class TestParentSingleChildFkOnChild(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
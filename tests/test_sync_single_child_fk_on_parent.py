@@ -754,9 +754,8 @@ class TestParentSingleChildFkOnParent(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -1057,9 +1056,8 @@ class TestParentSingleChildFkOnParent(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
@@ -1159,9 +1157,8 @@ class TestParentSingleChildFkOnParent(object):
         session = sync.session
 
         def pull():
-            txmin = sync.checkpoint
             txmax = sync.txid_current
-            sync.logical_slot_changes(txmin=txmin, txmax=txmax)
+            sync.logical_slot_changes(txmax=txmax)
 
         def poll_redis():
             return []
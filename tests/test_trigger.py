@@ -2,7 +2,13 @@
 import pytest
 
 from pgsync.base import Base
-from pgsync.trigger import CREATE_TRIGGER_TEMPLATE
+from pgsync.trigger import (
+    create_statement_trigger_template,
+    create_trigger_template,
+    notification_payloads,
+    spill_schema,
+    trigger_function,
+)
 
 
 @pytest.mark.usefixtures('table_creator')
@@ -10,8 +16,16 @@ class TestTrigger(object):
     """Trigger tests."""
 
     def test_trigger_template(self):
-        expected = """
-CREATE OR REPLACE FUNCTION table_notify() RETURNS TRIGGER AS $$
+        new_row = (
+            "JSON_BUILD_OBJECT('isbn', NEW.\"isbn\", "
+            "'publisher_id', NEW.\"publisher_id\")"
+        )
+        old_row = (
+            "JSON_BUILD_OBJECT('isbn', OLD.\"isbn\", "
+            "'publisher_id', OLD.\"publisher_id\")"
+        )
+        expected = f"""
+CREATE OR REPLACE FUNCTION "public"."table_notify_book"() RETURNS TRIGGER AS $$
 DECLARE
   channel TEXT;
   old_row JSON;
@@ -19,44 +33,26 @@ DECLARE
   notification JSON;
   xmin BIGINT;
 
-  primary_keys TEXT [] := (
-      SELECT primary_keys
-      FROM _pkey_view
-      WHERE table_name = TG_TABLE_NAME::REGCLASS
-  );
-  foreign_keys TEXT [] := (
-      SELECT foreign_keys
-      FROM _fkey_view
-      WHERE table_name = TG_TABLE_NAME
-  );
-
 BEGIN
     -- database is also the channel name.
     channel := CURRENT_DATABASE();
 
     IF TG_OP = 'DELETE' THEN
-        old_row = ROW_TO_JSON(OLD);
-        old_row := (
-            SELECT JSONB_OBJECT_AGG(key, value)
-            FROM JSON_EACH(old_row)
-            WHERE key = ANY(primary_keys)
-        );
+        old_row := JSON_BUILD_OBJECT('isbn', OLD."isbn");
         xmin := OLD.xmin;
     ELSE
         IF TG_OP <> 'TRUNCATE' THEN
-            new_row = ROW_TO_JSON(NEW);
-            new_row := (
-                SELECT JSONB_OBJECT_AGG(key, value)
-                FROM JSON_EACH(new_row)
-                WHERE key = ANY(primary_keys || foreign_keys)
-            );
+            -- nothing to sync if none of the columns changed.
+            IF TG_OP = 'UPDATE' AND NOT (
+                NEW."isbn" IS DISTINCT FROM OLD."isbn"
+                OR NEW."publisher_id" IS DISTINCT FROM OLD."publisher_id"
+                OR NEW."tags"::TEXT IS DISTINCT FROM OLD."tags"::TEXT
+            ) THEN
+                RETURN NEW;
+            END IF;
+            new_row := {new_row};
             IF TG_OP = 'UPDATE' THEN
-                old_row = ROW_TO_JSON(OLD);
-                old_row := (
-                    SELECT JSONB_OBJECT_AGG(key, value)
-                    FROM JSON_EACH(old_row)
-                    WHERE key = ANY(primary_keys || foreign_keys)
-                );
+                old_row := {old_row};
             END IF;
             xmin := NEW.xmin;
         END IF;
@@ -72,6 +68,12 @@ BEGIN
         'schema', TG_TABLE_SCHEMA
     );
 
+    IF OCTET_LENGTH(notification::TEXT) >= 8000 OR
+        PG_NOTIFICATION_QUEUE_USAGE() >= 0.5 THEN
+        INSERT INTO "public"."_pgsync_spill" (name, payload)
+            SELECT name, notification FROM "public"."_pgsync_documents";
+        notification = JSON_BUILD_OBJECT('spill', TG_TABLE_SCHEMA);
+    END IF;
     -- Notify/Listen updates occur asynchronously,
     -- so this doesn't block the Postgres trigger procedure.
     PERFORM PG_NOTIFY(channel, notification::TEXT);
@@ -80,7 +82,161 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 """
-        assert CREATE_TRIGGER_TEMPLATE == expected
+        assert create_trigger_template(
+            'public',
+            'book',
+            ['isbn'],
+            ['publisher_id'],
+            ['isbn', 'publisher_id', 'tags'],
+            text_columns=['tags'],
+            queue_threshold=0.5,
+        ) == expected
+
+    def test_trigger_function(self):
+        assert trigger_function('book') == 'table_notify_book'
+
+    def test_trigger_template_without_columns(self):
+        template = create_trigger_template('public', 'book', [], [], [])
+        # UPDATEs are always notified
+        assert 'AND NOT (\n                TRUE\n            )' in template
+        assert 'new_row := NULL;' in template
+
+    def test_statement_trigger_template(self):
+        template = create_statement_trigger_template(
+            'public',
+            'book',
+            ['isbn'],
+            ['publisher_id'],
+            ['isbn', 'publisher_id', 'tags'],
+            text_columns=['tags'],
+            queue_threshold=0.5,
+        )
+        assert template.startswith(
+            '\nCREATE OR REPLACE FUNCTION "public"."table_notify_book"() '
+            'RETURNS TRIGGER AS $$'
+        )
+        assert (
+            "SELECT TG_OP, NULL, JSON_BUILD_OBJECT('isbn', n.\"isbn\", "
+            "'publisher_id', n.\"publisher_id\")::TEXT\n"
+            "            FROM new_table AS n;"
+        ) in template
+        assert (
+            "SELECT TG_OP, JSON_BUILD_OBJECT('isbn', o.\"isbn\")::TEXT, "
+            "NULL\n"
+            "            FROM old_table AS o;"
+        ) in template
+        # the old and new rows are paired by primary key
+        assert 'ON o."isbn" = n."isbn"' in template
+        assert 'ROW_NUMBER' not in template
+        assert "'tg_op', op," in template
+        assert 'n."tags"::TEXT IS DISTINCT FROM o."tags"::TEXT' in template
+        assert '> 7500' in template
+        # both notifications are spilled when needed
+        assert template.count(
+            'PG_NOTIFICATION_QUEUE_USAGE() >= 0.5 THEN'
+        ) == 2
+        # without a primary key the rows are never paired
+        template = create_statement_trigger_template(
+            'public', 'book', [], ['publisher_id'], ['publisher_id']
+        )
+        assert 'ON FALSE' in template
+
+    def test_spill_notification(self):
+        template = create_trigger_template(
+            'public',
+            'book',
+            ['isbn'],
+            [],
+            ['isbn'],
+            queue_threshold=0.8,
+        )
+        assert (
+            '    IF OCTET_LENGTH(notification::TEXT) >= 8000 OR\n'
+            '        PG_NOTIFICATION_QUEUE_USAGE() >= 0.8 THEN\n'
+            '        INSERT INTO "public"."_pgsync_spill" (name, payload)\n'
+            '            SELECT name, notification FROM '
+            '"public"."_pgsync_documents";\n'
+            "        notification = JSON_BUILD_OBJECT('spill', "
+            'TG_TABLE_SCHEMA);\n'
+            '    END IF;\n'
+        ) in template
+
+    def test_outbox_notification(self):
+        for template in (
+            create_trigger_template(
+                'public', 'book', ['isbn'], [], ['isbn'], outbox=True
+            ),
+            create_statement_trigger_template(
+                'public', 'book', ['isbn'], [], ['isbn'], outbox=True
+            ),
+        ):
+            # a copy of the notification for each document
+            assert (
+                'INSERT INTO "public"."_pgsync_outbox" (name, payload)\n'
+            ) in template
+            assert (
+                'SELECT name, notification FROM "public"."_pgsync_documents";'
+            ) in template
+            assert 'PG_NOTIFY' not in template
+            assert '_pgsync_spill' not in template
+
+    def test_notification_payloads(self):
+        notification = {
+            'xmin': 1234,
+            'new': {'id': 1},
+            'old': None,
+            'tg_op': 'INSERT',
+            'table': 'book',
+            'schema': 'public',
+        }
+        assert notification_payloads(notification) == [notification]
+        notification = {
+            'xmin': 1234,
+            'new': None,
+            'old': None,
+            'tg_op': 'TRUNCATE',
+            'table': 'book',
+            'schema': 'public',
+        }
+        assert notification_payloads(notification) == [notification]
+        notification = {
+            'xmin': 1234,
+            'new': [{'id': 1}, {'id': 2}],
+            'old': None,
+            'tg_op': 'INSERT',
+            'table': 'book',
+            'schema': 'public',
+        }
+        payloads = notification_payloads(notification)
+        assert [payload['new'] for payload in payloads] == [
+            {'id': 1}, {'id': 2},
+        ]
+        assert [payload['old'] for payload in payloads] == [None, None]
+        assert payloads[0]['tg_op'] == 'INSERT'
+        assert payloads[0]['xmin'] == 1234
+        notification = {
+            'xmin': 1234,
+            'new': [{'id': 3}, {'id': 4}],
+            'old': [{'id': 1}, {'id': 2}],
+            'tg_op': 'UPDATE',
+            'table': 'book',
+            'schema': 'public',
+        }
+        payloads = notification_payloads(notification)
+        assert [
+            (payload['old'], payload['new']) for payload in payloads
+        ] == [({'id': 1}, {'id': 3}), ({'id': 2}, {'id': 4})]
+        notification = {
+            'xmin': 1234,
+            'new': None,
+            'old': [{'id': 1}],
+            'tg_op': 'DELETE',
+            'table': 'book',
+            'schema': 'public',
+        }
+        assert notification_payloads(notification) == [
+            dict(notification, old={'id': 1}, new=None)
+        ]
 
     def test_trigger_primary_key_function(self, connection):
         tables = {
@@ -126,3 +282,10 @@ $$ LANGUAGE plpgsql;
             )
             rows = pg_base.query(query)[0]
             assert rows[0] == foreign_keys
+
+    def test_spill_schema(self):
+        assert spill_schema('{"spill" : "public"}') == 'public'
+        assert spill_schema(
+            '{"xmin" : 1234, "new" : {"id" : 1}, "old" : null, '
+            '"tg_op" : "INSERT", "table" : "book", "schema" : "public"}'
+        ) is None